@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2014  Dignity Health
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL PURPOSES
+#    AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+#    SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+#    PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+#    USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT
+#    LIMITED TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR
+#    MAKES NO WARRANTY AND HAS NO LIABILITY ARISING FROM ANY USE OF THE
+#    SOFTWARE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+
+'''Compare the GPI_PROCESS result channel with the Manager().list() proxy it
+replaced.
+
+A forked child makes a number of setData()-like appends of each payload size
+while the main process collects them (the proxy is read after the child
+exits, as applyQueuedData() did).  The per-append latency seen by the child
+and the total transfer throughput are reported.
+
+    $ python benchmarks/bench_channel.py [-n 50]
+'''
+
+import sys
+import time
+import optparse
+import multiprocessing
+
+import numpy as np
+
+from gpi.channel import ResultChannel
+from gpi.defines import GetHumanReadable_bytes, GetHumanReadable_time
+
+ctx = multiprocessing.get_context('fork')
+
+SIZES = [8, 1024, 1024**2, 16*1024**2]  # bytes
+
+
+def child(queue, payload, cnt, elapsed):
+    st = time.time()
+    for i in range(cnt):
+        queue.append(['setData', 'out', payload])
+    queue.append(['retcode', 0])
+    elapsed.value = time.time() - st
+
+def runProxy(payload, cnt):
+    manager = ctx.Manager()
+    proxy = manager.list()
+    elapsed = ctx.Value('d', 0.0)
+
+    st = time.time()
+    proc = ctx.Process(target=child, args=(proxy, payload, cnt, elapsed))
+    proc.start()
+    proc.join()
+    items = [o for o in proxy]
+    total = time.time() - st
+
+    assert len(items) == cnt+1
+    manager.shutdown()
+    return elapsed.value/cnt, total
+
+def runChannel(payload, cnt):
+    channel = ResultChannel()
+    elapsed = ctx.Value('d', 0.0)
+
+    st = time.time()
+    proc = ctx.Process(target=child, args=(channel, payload, cnt, elapsed))
+    proc.start()
+    channel.closeWriter()
+    while proc.is_alive():
+        channel.drain()
+        time.sleep(0.001)
+    proc.join()
+    channel.drain()
+    items = [o for o in channel]
+    total = time.time() - st
+
+    assert len(items) == cnt+1
+    channel.close()
+    return elapsed.value/cnt, total
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', dest='cnt', type='int', default=50,
+            help='the number of appends for each payload size')
+    opts, args = parser.parse_args()
+
+    print('%12s %10s %14s %14s %14s' % ('payload', 'queue', 'per append', 'total', 'throughput'))
+    for nbytes in SIZES:
+        payload = np.ones(nbytes, dtype=np.uint8)
+        for name, run in (('proxy', runProxy), ('channel', runChannel)):
+            per, total = run(payload, opts.cnt)
+            rate = nbytes*opts.cnt/total
+            print('%12s %10s %14s %14s %14s' % (GetHumanReadable_bytes(nbytes), name,
+                GetHumanReadable_time(per), GetHumanReadable_time(total),
+                GetHumanReadable_bytes(int(rate))+'/s'))
+        sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2014  Dignity Health
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL PURPOSES
+#    AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+#    SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+#    PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+#    USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT
+#    LIMITED TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR
+#    MAKES NO WARRANTY AND HAS NO LIABILITY ARISING FROM ANY USE OF THE
+'''Count the copies made to pass a large GPI_PROCESS output to the main
+process with each transport.
+
+A forked child computes an array and sets it as an output (as setData()
+does), then changes its first element.  The main process maps the array
+it received: if the change shows, the array was passed without a copy.
+
+    memmap:  DATA_TRANSPORT = memmap, the array is copied to a file
+    shm:     DATA_TRANSPORT = shm, the array is copied to a segment
+    shared:  the array is allocated under NodeAPI.sharedOutputs()
+
+The compute and setData() time seen by the child and the total time to
+the mapped array are reported.
+
+    $ python benchmarks/bench_outputs.py [-n 5]
+'''
+
+import os
+import sys
+import time
+import optparse
+import multiprocessing
+
+import numpy as np
+
+from gpi.channel import ResultChannel
+from gpi.config import Config
+from gpi.dataproxy import DataProxy, Segments, SharedOutputs
+from gpi.defines import GetHumanReadable_bytes, GetHumanReadable_time
+
+ctx = multiprocessing.get_context('fork')
+
+SIZES = [64*1024**2, 256*1024**2, 1024**3]  # bytes
+MODES = ['memmap', 'shm', 'shared']
+
+
+def child(channel, nbytes, mode, elapsed):
+    st = time.time()
+    with SharedOutputs(mode == 'shared'):
+        out = np.empty(nbytes//8, dtype=np.float64)
+    out.fill(1.0)  # compute
+    channel.append(['setData', 'out', DataProxy().NDArray(out, nodeID=0, portname='bench_'+mode)])
+    elapsed.value = time.time() - st
+
+    # a copy won't see this
+    out[0] = -1.0
+    channel.append(['retcode', 0])
+    Segments.releaseUnsent()
+
+def run(nbytes, mode):
+    Config._g_data_transport = 'memmap' if mode == 'memmap' else 'shm'
+    channel = ResultChannel()
+    elapsed = ctx.Value('d', 0.0)
+
+    st = time.time()
+    proc = ctx.Process(target=child, args=(channel, nbytes, mode, elapsed))
+    proc.start()
+    channel.closeWriter()
+    while proc.is_alive():
+        channel.drain()
+        time.sleep(0.001)
+    proc.join()
+    channel.drain()
+    data = channel[0][2].getData()
+    total = time.time() - st
+
+    copies = 0 if data[0] == -1.0 else 1
+    assert data[1] == 1.0
+    channel.close()
+    return copies, elapsed.value, total
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', dest='cnt', type='int', default=5,
+            help='the number of runs for each size and transport')
+    opts, args = parser.parse_args()
+
+    if not Segments.available():
+        print('shared memory is not available, only memmap is run.')
+        del MODES[1:]
+
+    print('%12s %10s %8s %14s %14s' % ('output', 'transport', 'copies', 'setData', 'total'))
+    for nbytes in SIZES:
+        for mode in MODES:
+            runs = [run(nbytes, mode) for i in range(opts.cnt)]
+            print('%12s %10s %8d %14s %14s' % (GetHumanReadable_bytes(nbytes), mode,
+                max([r[0] for r in runs]),
+                GetHumanReadable_time(min([r[1] for r in runs])),
+                GetHumanReadable_time(min([r[2] for r in runs]))))
+        sys.stdout.flush()
+
+    os.remove(DataProxy().getSHMF(0, 'bench_memmap'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+#    Copyright (C) 2014  Dignity Health
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL PURPOSES
+#    AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+#    SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+#    PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+#    USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT
+#    LIMITED TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR
+#    MAKES NO WARRANTY AND HAS NO LIABILITY ARISING FROM ANY USE OF THE
+#    SOFTWARE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+
+
+'''Runs a network over many cases of String-node args (gpi --batch).
+
+The library is scanned and the network is loaded once.  Each case is then
+run in a fork of that process, so module imports and node instantiation are
+only paid for once and every case starts from the freshly loaded network.
+Up to a given number of cases run at the same time, and a case that runs past
+the optional timeout is killed so that it can't stall the rest of the batch.
+'''
+
+import time
+import shlex
+import traceback
+import multiprocessing.connection
+
+from .cmd import parseStringNodeArgs
+from .defines import GetHumanReadable_time
+from .logger import manager
+from .workerPool import multiprocessing_context
+
+# start logger for this module
+log = manager.getLogger(__name__)
+
+# grace period between terminating a timed out case and killing it
+BATCH_KILL_WAIT = 5  # sec
+
+
+def readManifest(path):
+    '''Read a batch manifest.  Each line is one case, holding the string args
+    for the network in the -s syntax:
+
+        # label:string/path ...
+        infile:/data/case01.npy outfile:/data/recon01.npy
+        infile:/data/case02.npy outfile:"/data/recon 02.npy"
+
+    Blank lines and comments are skipped.  Returns a list of {label: string}
+    dicts, or None if the manifest can't be read.
+    '''
+    cases = []
+    try:
+        with open(path, 'r') as manifest:
+            for num, line in enumerate(manifest, 1):
+                try:
+                    args = shlex.split(line, comments=True)
+                    if len(args):
+                        cases.append(parseStringNodeArgs(args))
+                except ValueError as e:
+                    log.error(str(path)+':'+str(num)+': '+str(e))
+                    return None
+    except (IOError, OSError) as e:
+        log.error('readManifest(): '+str(e))
+        return None
+    return cases
+
+
+class BatchCase(object):
+    '''The args and the outcome of one case in a batch.'''
+
+    def __init__(self, num, args):
+        self.num = num
+        self.args = args
+        self.status = 'pending'
+        self.walltime = 0
+        self.failed = []  # the nodes that ended in an error state
+
+        self._proc = None
+        self._conn = None
+        self._start = 0
+
+    def __str__(self):
+        return 'case '+str(self.num)+' ('+self.argString()+')'
+
+    def argString(self):
+        return ' '.join([str(k)+':'+str(v) for k, v in sorted(self.args.items())])
+
+    def ok(self):
+        return self.status == 'ok'
+
+
+class BatchRunner(object):
+    '''Runs the cases of a batch on forks of a loaded Engine.
+
+        engine = Engine()
+        engine.loadNetwork('recon.net')
+        runner = BatchRunner(engine, jobs=4, timeout=600)
+        runner.run(readManifest('cases.txt'))
+        runner.writeSummary('summary.tsv')
+    '''
+
+    def __init__(self, engine, jobs=1, timeout=None):
+        self._engine = engine
+        self._jobs = max(1, int(jobs))
+        self._timeout = timeout  # sec, per case (None: no limit)
+        self._cases = []
+
+    def cases(self):
+        return list(self._cases)
+
+    def run(self, cases):
+        '''Run each {label: string} case and wait for all of them to finish.
+        Returns 0 if every case succeeded, otherwise 1.
+        '''
+        if multiprocessing_context.get_start_method() != 'fork':
+            log.error('run(): batches are run on forks of the loaded network, which this platform can\'t make.')
+            return 1
+
+        self._cases = [BatchCase(num, args) for num, args in enumerate(cases, 1)]
+        pending = list(self._cases)
+        running = {}  # sentinel: BatchCase
+
+        st = time.time()
+        while len(pending) or len(running):
+            while len(pending) and (len(running) < self._jobs):
+                case = pending.pop(0)
+                self.startCase(case)
+                running[case._proc.sentinel] = case
+
+            for sentinel in multiprocessing.connection.wait(list(running.keys()), self.nextDeadline(running)):
+                self.finishCase(running.pop(sentinel))
+
+            for sentinel, case in list(running.items()):
+                if self.overdue(case):
+                    self.killCase(case)
+                    self.finishCase(running.pop(sentinel))
+
+        failed = len([c for c in self._cases if not c.ok()])
+        log.dialog('Batch Wall Time: '+GetHumanReadable_time(time.time()-st)+', ' + \
+            str(len(self._cases)-failed)+' of '+str(len(self._cases))+' cases succeeded.')
+        return int(failed > 0)
+
+    def startCase(self, case):
+        log.info('startCase(): '+str(case))
+        case._conn, childConn = multiprocessing_context.Pipe(duplex=False)
+        case._proc = multiprocessing_context.Process(target=self._runCase,
+                args=(case.args, childConn), name='GPIBatch-'+str(case.num))
+        case._start = time.time()
+        case.status = 'running'
+        case._proc.start()
+        # only the child should hold its end, so a crash reads as EOF
+        childConn.close()
+
+    def nextDeadline(self, running):
+        '''Seconds until the first running case is overdue (None: no limit).'''
+        if self._timeout is None:
+            return None
+        first = min([c._start for c in running.values()])
+        return max(0, first + self._timeout - time.time())
+
+    def overdue(self, case):
+        return (self._timeout is not None) and (time.time() - case._start >= self._timeout)
+
+    def killCase(self, case):
+        '''Stop a case that ran past the timeout.  SIGTERM first, then SIGKILL
+        if it doesn't exit in a few seconds.'''
+        log.error('killCase(): '+str(case)+' exceeded the '+GetHumanReadable_time(self._timeout)+' timeout, killing it.')
+        case.status = 'timed out'
+        case._proc.terminate()
+        case._proc.join(BATCH_KILL_WAIT)
+        if case._proc.is_alive():
+            case._proc.kill()
+
+    def finishCase(self, case):
+        case._proc.join()
+        case.walltime = time.time() - case._start
+
+        result = None
+        try:
+            if case._conn.poll():
+                result = case._conn.recv()
+        except (EOFError, OSError):
+            pass
+        case._conn.close()
+
+        if case.status == 'timed out':
+            pass
+        elif result is None:
+            case.status = 'crashed ('+str(case._proc.exitcode)+')'
+        else:
+            case.failed = result['failed']
+            case.status = 'failed' if result['retcode'] else 'ok'
+
+        if case.ok():
+            log.info('finishCase(): '+str(case)+' finished in '+GetHumanReadable_time(case.walltime))
+        else:
+            log.error('finishCase(): '+str(case)+' '+case.status+' '+', '.join(case.failed))
+
+    # CHILD PROCESS
+    def _runCase(self, args, conn):
+        engine = self._engine
+        try:
+            engine.setStringArgs(args)
+            retcode = engine.run()
+        except:
+            log.error('_runCase(): '+str(traceback.format_exc()))
+            retcode = 1
+        conn.send({'retcode': retcode,
+                   'failed': [n.getName() for n in engine.failedNodes()]})
+        conn.close()
+
+    def summary(self):
+        '''A tab separated table of each case's status and wall time.'''
+        lines = ['\t'.join(['case', 'status', 'walltime (s)', 'failed', 'args'])]
+        for case in self._cases:
+            lines.append('\t'.join([str(case.num), case.status, '%.3f' % case.walltime,
+                ','.join(case.failed), case.argString()]))
+        return '\n'.join(lines)+'\n'
+
+    def writeSummary(self, path):
+        try:
+            with open(path, 'w') as summary:
+                summary.write(self.summary())
+        except (IOError, OSError) as e:
+            log.error('writeSummary(): '+str(e))
+            return False
+        return True
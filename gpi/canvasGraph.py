@@ -79,6 +79,7 @@ from gpi import QtCore, QtGui, QtWidgets
 from .associate import Bindings, isGPIAssociatedFile, isGPIAssociatedExt
 from .canvasScene import CanvasScene
 from .cmd import Commands
+from .config import Config
 from .defines import GPI_REQUEUE_EVENT, GPI_INIT_EVENT, GPI_WIDGET_EVENT
 from .defines import getKeyboardModifiers, printMouseEvent, stw
 from .defines import isMacroChildNode
@@ -93,6 +94,7 @@ from .node import Node
 from .nodeQueue import GPINodeQueue
 from .port import Port, InPort
 from .stateMachine import GPI_FSM, GPIState
+from .sysspecs import Specs
 from . import topsort
 
 from .logger import manager
@@ -100,6 +102,10 @@ from .logger import manager
 # start logger for this module
 log = manager.getLogger(__name__)
 
+# the view refresh rate while a loop is iterating
+LOOP_REFRESH_INTERVAL = 0.25  # sec
+
+
 class GraphWidget(QtWidgets.QGraphicsView):
     '''Provides the main canvas widget and background painting as well as the
     execution model for the canvas.'''
@@ -158,6 +164,18 @@ class GraphWidget(QtWidgets.QGraphicsView):
         self.setCursor(QtCore.Qt.OpenHandCursor)
         self.gridRes = 5  # pts
         self.nodeQueue = GPINodeQueue()
+        self.nodeQueue.setMaxJobs(self.maxJobs())
+        self.nodeQueue.setMemBudget(Config.MEM_BUDGET)
+
+        # the node hierarchy is updated as edges are added and removed
+        self._hierarchy = topsort.DynamicTopologicalOrder()
+        self._hierarchyEdges = {}  # edge: (src, sink) nodes
+
+        # nodes with a pending event, so they don't have to be searched for
+        self._eventNodes = set()
+
+        # the last time the view was refreshed while processing
+        self._lastRefresh = 0
         self.extWidgets = dict()
 
         # timed painter update
@@ -288,6 +306,11 @@ class GraphWidget(QtWidgets.QGraphicsView):
     def walltime_disp(self):
         return GetHumanReadable_time(self.walltime(), precision=1)
 
+    def predictedWallTime(self):
+        # an estimate (sec) of the time to run the whole network, based on
+        # the wall times of previous computes
+        return self.nodeQueue.predictedWallTime(self.getAllNodes())
+
     def initRun(self, sig):
         # run any initialization stuff here
         # since the 'check state' can't run yet, the canvas is virtually paused.
@@ -371,6 +394,12 @@ class GraphWidget(QtWidgets.QGraphicsView):
         else:
             self.clearWalltime()
 
+        predicted = self.predictedWallTime()
+        if predicted > 0:
+            self._idleStateSig['predicted'] = GetHumanReadable_time(predicted, precision=1)
+        elif 'predicted' in self._idleStateSig:
+            self._idleStateSig.pop('predicted')
+
         self._curState.emit(self._idleStateSig)
         self.printCurState()
         self.viewAndSceneForcedUpdate()
@@ -420,13 +449,14 @@ class GraphWidget(QtWidgets.QGraphicsView):
 
         # EVENTS
         # check for event status BEFORE triggering highest compute
-        for node in self.getAllNodes():
-            if node.isReady():
-                # Re/-initialize queue and start processing.
-                # This was called because 'a' node has an event status.
-                self.nodeQueue.setQueue(self.getLinearNodeHierarchy())
-                self._switchSig.emit('process')
-                return
+        nodes = [n for n in self._eventNodes if n.isReady()]
+        if len(nodes):
+            # Re/-initialize queue and start processing.
+            # This was called because 'a' node has an event status, only
+            # the nodes downstream of an event can be affected.
+            self.nodeQueue.setQueue(self.getDownstreamClosure(nodes))
+            self._switchSig.emit('process')
+            return
 
         # REQUEUE EVENTS
         # if queue is done then check for re-queue nodes
@@ -658,17 +688,42 @@ class GraphWidget(QtWidgets.QGraphicsView):
         return False
 
     def processingRun(self, sig):
-        self._curState.emit(self._processingStateSig)
+        if self.nodeQueue.iteration() == 0:
+            sig = dict(self._processingStateSig)
+            predicted = self.nodeQueue.predictedWallTime()
+            if predicted > 0:
+                sig['predicted'] = GetHumanReadable_time(predicted, precision=1)
+            self._curState.emit(sig)
         self.printCurState()
 
-        if not self.aNodeIsProcessing():
-            queueState = self.nodeQueue.startNextNode()
-            if queueState == 'paused':
-                self._switchSig.emit('paused')
-            elif queueState == 'finished':
-                self._switchSig.emit('check')
+        # start as many nodes as the queue allows, nodes that are still
+        # computing will re-enter this state when they finish.
+        queueState = self.nodeQueue.startNextNode()
+
+        # while a loop iterates the view is only refreshed at a fixed rate
+        iteration = self.nodeQueue.iteration()
+        refresh = (iteration == 0) or (queueState != 'started') or \
+            (time.time() - self._lastRefresh > LOOP_REFRESH_INTERVAL)
+
+        # let the user know why nothing else is starting
+        hold = self.nodeQueue.memHoldMessage()
+        if hold is not None:
+            sig = dict(self._processingStateSig)
+            sig['msg'] += ' ('+hold+')'
+            self._curState.emit(sig)
+        elif iteration and refresh:
+            sig = dict(self._processingStateSig)
+            sig['msg'] += ' (iteration '+str(iteration+1)+')'
+            self._curState.emit(sig)
+
+        if queueState == 'paused':
+            self._switchSig.emit('paused')
+        elif queueState == 'finished':
+            self._switchSig.emit('check')
 
-        self.viewAndSceneForcedUpdate()
+        if refresh:
+            self._lastRefresh = time.time()
+            self.viewAndSceneForcedUpdate()
 
     # State Checking:
     def getCurState(self):
@@ -1005,6 +1060,16 @@ class GraphWidget(QtWidgets.QGraphicsView):
         nodes = [item for item in allitems if isinstance(item, MacroNode)]
         return(nodes)
 
+    def getFusedMacro(self, node):
+        '''Get the collapsed macro that encapsulates the node, if the macro
+        runs its nodes in one worker.
+        '''
+        for item in self.getAllNodes():
+            if isMacroChildNode(item):
+                macro = item.macroParent()
+                if macro.isFused() and macro.isCollapsed() and (node in macro.getEncapsulatedNodes()):
+                    return macro
+
     def findNodeByNameAndLabel(self, name, lab):
         # return the first occurrence of a Node with the given name and label
         for node in self.getAllNodes():
@@ -1045,8 +1110,39 @@ class GraphWidget(QtWidgets.QGraphicsView):
         self.timerId = 0
         self.chargeRepON = False
 
+    def maxJobs(self):
+        # the cmd-line takes precedence over the config file
+        jobs = Commands.jobs()
+        if jobs is None:
+            return Config.JOBS
+        if jobs == 0:
+            return max(1, Specs.NUM_CPUS())
+        return jobs
+
+    def addEventNode(self, node):
+        self._eventNodes.add(node)
+
+    def removeEventNode(self, node):
+        self._eventNodes.discard(node)
+
+    def eventNodes(self):
+        return set(self._eventNodes)
+
+    def getDownstreamClosure(self, nodes):
+        # the given nodes and every node downstream of them
+        closure = set(nodes)
+        stack = list(nodes)
+        while len(stack):
+            for node in stack.pop().getDownstreamNodes():
+                if node not in closure:
+                    closure.add(node)
+                    stack.append(node)
+        return closure
+
     def getLinearNodeHierarchy(self):
-        return self.getLinearNodeHierarchy_fromList(self.getAllNodes())
+        # island nodes have top priority
+        nodes = [n for n in self.getAllNodes() if n not in self._hierarchy]
+        return nodes + self._hierarchy.order()
 
     def getLinearNodeHierarchy_fromList(self, nodeList):
         return sorted(nodeList, key=lambda y: y.getHierarchalLevel())
@@ -1073,37 +1169,60 @@ class GraphWidget(QtWidgets.QGraphicsView):
         ##QtWidgets.QApplication.processEvents() # allow gui to update
 
     def calcNodeHierarchy(self):
-        # tells each node which level it is
-        # and returns a list based on that level
+        # Rebuild the hierarchy from all connections (e.g. after a network is
+        # loaded), tells each node which level it is and returns a list based
+        # on that level.  Edits are made with insert/removeHierarchyEdge().
 
-        nodeList = self.getAllNodes()
+        # gather each non-cyclic edge once
+        self._hierarchyEdges = {}
+        for node in self.getAllNodes():
+            for port in node.getPorts():
+                for edge in port.edges():
+                    if not edge.isCyclicConnection():
+                        self._hierarchyEdges[edge] = edge.getConnectionTuple()
 
-        # concatenate all connections (even if list is redundant)
-        c = []
-        for node in nodeList:
-            if len(node.getNonCyclicConnectionTuples()):
-                c += node.getNonCyclicConnectionTuples()
-            #if len(node.getConnectionTuples()):
-            #    c += node.getConnectionTuples()
-            else:
-                # island nodes have top priority
-                node.resetHierarchalLevel()
-                node.refreshName()
+        skipped = self._hierarchy.reset(list(self._hierarchyEdges.values()))
 
-        sortedNodes = topsort.topsort(c)
+        # set node hierarchy
+        # -each node knows its current level
+        # -island nodes have top priority
+        for node in self.getAllNodes():
+            node.setHierarchalLevel(self._hierarchy.index(node))
+            node.refreshName()
 
         # signal that the connection is cyclic
-        if sortedNodes is None:
+        if len(skipped):
+            for edge, pair in list(self._hierarchyEdges.items()):
+                if pair in skipped:
+                    del self._hierarchyEdges[edge]
             return None
 
-        # set node hierarchy
-        # -each node knows its current level
-        cnt = 0
-        for node in sortedNodes:
-            node.setHierarchalLevel(cnt)
-            cnt += 1
+        return self._hierarchy.order()
 
-        return sortedNodes
+    def insertHierarchyEdge(self, edge):
+        '''Update the node hierarchy for a new edge.  Returns False if the
+        edge would make the network cyclic, leaving the hierarchy unchanged.
+        '''
+        if edge.isCyclicConnection():
+            return True  # these aren't part of the hierarchy
+
+        pair = edge.getConnectionTuple()
+        changed = self._hierarchy.addArc(*pair)
+        if changed is None:
+            return False
+
+        self._hierarchyEdges[edge] = pair
+        for node in changed:
+            node.setHierarchalLevel(self._hierarchy.index(node))
+        return True
+
+    def removeHierarchyEdge(self, edge):
+        pair = self._hierarchyEdges.pop(edge, None)
+        if pair is None:
+            return
+        for node in self._hierarchy.removeArc(*pair):
+            node.resetHierarchalLevel()
+            node.refreshName()
 
     def roundPosToGrid(self, pos):
         x = int(pos[0] / self.gridRes) * self.gridRes
@@ -1326,8 +1445,7 @@ class GraphWidget(QtWidgets.QGraphicsView):
                     self.scene().addItem(newEdge)
                     connected.append(outport)
                 
-                    nodeHierarchy = inport.getNode().graph.calcNodeHierarchy()
-                    if nodeHierarchy is None:
+                    if not inport.getNode().graph.insertHierarchyEdge(newEdge):
                         self.scene().removeItem(newEdge)
                         newEdge.detachSelf()
                         # del newEdge
@@ -1372,8 +1490,7 @@ class GraphWidget(QtWidgets.QGraphicsView):
         newEdge = Edge(outport, inport)
         self.scene().addItem(newEdge)
     
-        nodeHierarchy = inport.getNode().graph.calcNodeHierarchy()
-        if nodeHierarchy is None:
+        if not inport.getNode().graph.insertHierarchyEdge(newEdge):
             self.scene().removeItem(newEdge)
             newEdge.detachSelf()
             # del newEdge
@@ -2019,7 +2136,10 @@ class GraphWidget(QtWidgets.QGraphicsView):
             buf.append(node)
 
             # set other node attributes
-            if 'walltime' in s:
+            if 'walltimes' in s:
+                for t in s['walltimes']:
+                    node.appendWallTime(float(t))
+            elif 'walltime' in s:
                 try:  # deprecate this try statement
                     node.appendWallTime(float(s['walltime']))
                 except:
@@ -2238,6 +2358,7 @@ class GraphWidget(QtWidgets.QGraphicsView):
         network['layouts'] = self.serializeLayoutWindows()
         network['WALLTIME'] = str(self.walltime())  # sec
         network['TOTAL_PMEM'] = str(self.totalPortMem())  # bytes
+        network['PREDICTED_WALLTIME'] = str(self.predictedWallTime())  # sec
         return network
 
     def deserializeCanvas(self, network, pos):
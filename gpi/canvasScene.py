@@ -171,9 +171,8 @@ class CanvasScene(QtWidgets.QGraphicsScene):
                 self.addItem(newEdge)
 
                 # if its cyclic then don't allow the connection
-                # -at the same time, calculate the hierarchy
-                nodeHierarchy = inport.getNode().graph.calcNodeHierarchy()
-                if nodeHierarchy is None:
+                # -at the same time, update the hierarchy
+                if not inport.getNode().graph.insertHierarchyEdge(newEdge):
                     self.removeItem(newEdge)
                     newEdge.detachSelf()
                     # del newEdge
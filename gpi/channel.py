@@ -0,0 +1,251 @@
+#    Copyright (C) 2014  Dignity Health
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL PURPOSES
+#    AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+#    SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+#    PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+#    USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT
+#    LIMITED TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR
+#    MAKES NO WARRANTY AND HAS NO LIABILITY ARISING FROM ANY USE OF THE
+#    SOFTWARE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+
+'''Message framing for the pipes between the main process and GPI_PROCESS
+tasks.
+
+Each message is pickled with protocol 5 so that large contiguous buffers
+(e.g. numpy arrays) are written to the pipe directly from their memory
+instead of being copied into the pickle stream.  A frame is a header,
+holding the buffer sizes and the pickle stream, followed by one pipe message
+per out-of-band buffer.
+'''
+
+import struct
+import pickle
+import threading
+import multiprocessing
+
+from .stream import CHUNK_BUFFER, chunkBytes
+
+# header: number of out-of-band buffers, then the size of each
+_COUNT = struct.Struct('!I')
+_SIZE = struct.Struct('!Q')
+
+
+def sendFramed(conn, obj):
+    '''Send a picklable object over a multiprocessing Connection.  The object
+    is fully pickled before anything is written, so a pickling error leaves
+    the pipe untouched.
+    '''
+    buffers = []
+    payload = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    raws = [b.raw() for b in buffers]
+
+    header = [_COUNT.pack(len(raws))]
+    for r in raws:
+        header.append(_SIZE.pack(r.nbytes))
+    header.append(payload)
+    conn.send_bytes(b''.join(header))
+
+    for r in raws:
+        conn.send_bytes(r)
+
+def recvFramed(conn):
+    '''Receive an object sent by sendFramed().  Out-of-band buffers are read
+    into writeable memory that is then owned by the unpickled object.
+    '''
+    header = memoryview(conn.recv_bytes())
+    cnt = _COUNT.unpack_from(header)[0]
+    off = _COUNT.size
+
+    buffers = []
+    for i in range(cnt):
+        buf = bytearray(_SIZE.unpack_from(header, off)[0])
+        off += _SIZE.size
+        if len(buf):
+            conn.recv_bytes_into(buf)
+        else:
+            conn.recv_bytes()
+        buffers.append(buf)
+
+    return pickle.loads(header[off:], buffers=buffers)
+
+
+class ResultChannel(object):
+    '''The queue of internal calls (port, widget, retcode...) made by a
+    GPI_PROCESS compute().
+
+    In the child process append() sends each item to the main process as it
+    is made.  In the main process drain() collects what has arrived, and the
+    channel can then be iterated like the list it replaces.  The channel uses
+    its own pipe unless it is connected to an existing one (see connect()).
+
+    Chunks (see NodeAPI.emitChunk()) are flow controlled: the child holds
+    back once CHUNK_BUFFER bytes of them are in the main process, until the
+    consumers there have taken them and sent back credit for them.
+    '''
+
+    def __init__(self, pipe=True):
+        self._items = []
+        self._handlers = {}  # item kind: func
+        self._closed = False
+        self._reader = None
+        self._writer = None
+        self._inflight = 0  # bytes of chunks sent that haven't been credited
+        self._creditLock = threading.Lock()
+        if pipe:
+            # credit for chunks goes back the other way
+            self._reader, self._writer = multiprocessing.Pipe()
+
+    def connect(self, conn):
+        # share a duplex connection (e.g. a worker's) for reading and writing
+        self._reader = conn
+        self._writer = conn
+
+    def handle(self, kind, func):
+        # pass items of this kind (e.g. 'chunk') to func as they are drained,
+        # instead of keeping them
+        self._handlers[kind] = func
+
+    def fileno(self):
+        return self._reader.fileno()
+
+    # CHILD PROCESS
+    def append(self, item):
+        if item[0] == 'chunk':
+            self.waitForCredit(chunkBytes(item[2]))
+        sendFramed(self._writer, ('item', item))
+
+    def waitForCredit(self, nbytes):
+        # hold the compute while the main process has more than CHUNK_BUFFER
+        # bytes of chunks that the consumers haven't taken
+        while self._writer.poll():
+            self.takeCredit(recvFramed(self._writer))
+        while self._inflight and (self._inflight + nbytes > CHUNK_BUFFER):
+            self.takeCredit(recvFramed(self._writer))
+        self._inflight += nbytes
+
+    def takeCredit(self, msg):
+        # a ('credit', nbytes) message from the main process
+        if msg[0] == 'credit':
+            self._inflight = max(0, self._inflight - msg[1])
+
+    # MAIN PROCESS
+    def credit(self, nbytes):
+        '''Tell the child that nbytes of its chunks have been taken by the
+        consumers (called on their threads).
+        '''
+        if nbytes == 0:
+            return
+        with self._creditLock:
+            try:
+                sendFramed(self._reader, ('credit', nbytes))
+            except (OSError, ValueError):
+                pass  # the child is gone
+
+    def closeWriter(self):
+        # once the child has its copy, the main process' copy of the write
+        # end has to be closed for the end of the child to read as EOF.
+        if self._writer is not self._reader:
+            self._writer.close()
+
+    def isClosed(self):
+        return self._closed
+
+    def drain(self):
+        '''Collect all items that are waiting in the pipe.  Any other messages
+        (e.g. worker control messages) are returned in the order received.
+        '''
+        other = []
+        if self._closed:
+            return other
+        try:
+            while self._reader.poll():
+                msg = recvFramed(self._reader)
+                if msg[0] == 'item':
+                    func = self._handlers.get(msg[1][0])
+                    if func is None:
+                        self._items.append(msg[1])
+                    else:
+                        func(msg[1])
+                else:
+                    other.append(msg)
+        except (EOFError, OSError):
+            self._closed = True
+        return other
+
+    def close(self):
+        if (self._reader is not None) and (self._reader is not self._writer):
+            self._reader.close()
+        self._closed = True
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, i):
+        return self._items[i]
+
+
+if __name__ == '__main__':
+    import numpy as np
+
+    print("test framing")
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    a = np.arange(1024*1024, dtype=np.float32).reshape(1024, 1024)
+    msg = {'a': a, 'b': a[::2], 'empty': np.zeros(0), 'str': 'x'}
+
+    # a frame of this size would fill the pipe, so send from a thread
+    t = threading.Thread(target=sendFramed, args=(writer, msg))
+    t.start()
+    out = recvFramed(reader)
+    t.join()
+    assert np.array_equal(out['a'], a) and out['a'].flags.writeable
+    assert np.array_equal(out['b'], a[::2])
+    assert out['empty'].size == 0
+    assert out['str'] == 'x'
+
+    # a pickling error leaves the pipe untouched
+    try:
+        sendFramed(writer, lambda: None)
+        assert False
+    except (pickle.PicklingError, AttributeError, TypeError):
+        pass
+    assert not reader.poll()
+
+    print("result channel")
+    ch = ResultChannel()
+    taken = []
+    ch.handle('chunk', lambda item: (taken.append(item[2]), ch.credit(chunkBytes(item[2]))))
+    ch.append(('setData', 'out', np.ones(8)))
+    ch.append(('chunk', 'out', np.ones(16), 0))
+    assert ch._inflight == 128
+    assert ch.drain() == []
+    assert len(ch) == 1 and ch[0][0] == 'setData'
+    assert np.array_equal(ch[0][2], np.ones(8))
+    assert len(taken) == 1
+
+    # the credit is picked up before the next chunk is counted
+    ch.append(('chunk', 'out', np.ones(4), 1))
+    assert ch._inflight == 32
+    ch.drain()
+    assert len(taken) == 2 and len(ch) == 1
+
+    ch.close()
+    assert ch.isClosed() and ch.drain() == []
+
+    print("ok")
@@ -25,9 +25,11 @@
 # Brief: Commandline option parsing.
 #           -can initiate some simple commands
 
+import io
 import sys
 import logging
 import optparse
+import contextlib
 
 # gpi
 from .associate import isGPIAssociatedFile
@@ -41,6 +43,23 @@ from .sysspecs import Specs
 log = manager.getLogger(__name__)
 
 
+def parseStringNodeArgs(args):
+    '''Convert a list of '<label>:<string/path>' args to a {label: string}
+    dict.  Raises ValueError for an arg without a label.
+    '''
+    sargs = {}
+    # merge any redundant labels with warnings
+    for arg in args:
+        lab, sep, path = arg.partition(':')
+        if not sep:
+            raise ValueError('string arg \''+str(arg)+'\' has no label, use <label>:<string/path>.')
+        if lab in sargs:
+            log.warn('input string label for arg: \''+ str(arg) + '\' already exists, skipping.') 
+        else:
+            sargs[lab] = path
+    return sargs
+
+
 class CmdParser(object):
     '''An object to parse input commandline args after the QApplication has
     done its own parsing.
@@ -60,9 +79,25 @@ class CmdParser(object):
         self._nogui = False
         self._scriptMode = False
 
+        # a manifest of string args to run the network with, case by case
+        self._batch = None
+        self._summary = None
+
+        # the directory of the socket a resident server takes jobs on
+        self._serve = None
+
         # splash is on by default
         self._nosplash = False
 
+        # number of nodes allowed to compute concurrently (None: use config)
+        self._jobs = None
+
+        # seconds a --batch case may run before it is killed (None: no limit)
+        self._timeout = None
+
+        # don't read or write the node output caches
+        self._nocache = False
+
         self._loadable_mods = []
         self._loadable_nets = []
         self._loadable_files = []  # associated files
@@ -73,12 +108,33 @@ class CmdParser(object):
         # take in any filename for extension checking, then loading. 
         self._parser.add_option('--config', dest='dumpConfig', action='store_true', help='''GPI will read the User ENV and config file and dump the parsed info to stdout.''')
         self._parser.add_option('--log', dest='loglevel', action='store', choices=['debug', 'info', 'node', 'warn', 'error', 'critical'], help='''Change the output level of the logger: debug, info, node, warn, error, and critical''')
-        self._parser.add_option('--nogui', dest='nogui', action='store_true', help='''causes GPI to run without a GUI for scripting.  Requires a network file.  The --script option is implied.''')
+        self._parser.add_option('--nogui', dest='nogui', action='store_true', help='''causes GPI to run without a GUI for scripting.  Requires a network file.  The --script option is implied.  This is a reduced mode: PyQt is still needed (the node menus are built offscreen), macro nodes are expanded, GPI_PROCESS nodes are forked (up to --jobs at a time) and all other nodes compute in the main thread.''')
         self._parser.add_option('--script', dest='script', action='store_true', help='''causes GPI to terminate after the supplied network is finished executing.  Requires a network file.''')
+        self._parser.add_option('--batch', dest='batch', action='store', type='string', help='''runs the network, without a GUI, once for each line of a manifest file.  Each line holds the string args for one case, using the -s syntax: <label1>:<string/path> <label2>:<string/path>.  Up to --jobs cases are run at the same time.''')
+        self._parser.add_option('--timeout', dest='timeout', action='store', type='float', help='''kill any --batch case that runs longer than the given number of seconds and mark it as timed out.''')
+        self._parser.add_option('--summary', dest='summary', action='store', type='string', help='''write the status and wall time of each --batch case to the given file.''')
+        self._parser.add_option('--serve', dest='serve', action='store', type='string', help='''keeps the networks loaded, without a GUI, and runs the jobs sent to a local socket in the given directory (made private to the user).  See gpi.server.submit().''')
         self._parser.add_option('-s', '--string', dest='string', action='append', type='string', default=[], help='''passes a string arg to a String-node by label.  Handles multiple args.  Syntax: -s <label1>:<string/path> -s <label2>:<string/path>.''')
         self._parser.add_option('--specs', dest='dumpSpecs', action='store_true', help='''GPI will create a platform specs file and exit.''')
         self._parser.add_option('--defines', dest='dumpDefines', action='store_true', help='''Show some internally used defines, such as temp directory paths.''')
         self._parser.add_option('--nosplash', dest='nosplash', action='store_true', help='''Skip the splash screen.''')
+        self._parser.add_option('-j', '--jobs', dest='jobs', action='store', type='int', help='''The number of independent nodes allowed to compute at the same time.  A value of 0 uses all cpus.  Overrides the config file setting.''')
+        self._parser.add_option('--nocache', dest='nocache', action='store_true', help='''Don't reuse or save cached node outputs (in memory or on disk) for this session.''')
+        self._parser.add_option('--clear-cache', dest='clearCache', action='store_true', help='''Delete the on-disk cache of node outputs before starting.''')
+
+    def headless(self, argv):
+        '''Check whether argv asks for a run without a window (--nogui, --batch
+        or --serve), using the same option parser as parse().  This runs
+        before the QApplication is made, so args that only Qt knows about are
+        tolerated and nothing is printed; parse() reports any real errors.
+        '''
+        quiet = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(quiet), contextlib.redirect_stderr(quiet):
+                options, _ = self._parser.parse_args(list(argv))
+        except SystemExit:
+            return False
+        return bool(options.nogui or options.batch or options.serve)
 
     def parse(self, argv):
         # keep a copy of what was parsed
@@ -102,6 +158,23 @@ class CmdParser(object):
                 log.error('the --nogui option was passed without a network, exiting.')
                 sys.exit(1)
 
+        # make sure the user passes a network
+        if self._options.batch:
+            if self.netCount():
+                self._batch = self._options.batch
+                self._summary = self._options.summary
+            else:
+                log.error('the --batch option was passed without a network, exiting.')
+                sys.exit(1)
+
+        # make sure the user passes a network
+        if self._options.serve:
+            if self.netCount():
+                self._serve = self._options.serve
+            else:
+                log.error('the --serve option was passed without a network, exiting.')
+                sys.exit(1)
+
         # make sure the user passes a network
         if self._options.script:
             if self.netCount():
@@ -129,6 +202,25 @@ class CmdParser(object):
         # splash
         self._nosplash = self._options.nosplash
 
+        # concurrency
+        if self._options.jobs is not None:
+            if self._options.jobs < 0:
+                log.error('the --jobs option must be >= 0, exiting.')
+                sys.exit(1)
+            self._jobs = self._options.jobs
+
+        if self._options.timeout is not None:
+            if self._options.timeout <= 0:
+                log.error('the --timeout option must be > 0, exiting.')
+                sys.exit(1)
+            self._timeout = self._options.timeout
+
+        # caching
+        self._nocache = bool(self._options.nocache)
+        if self._options.clearCache:
+            from .memo import Disk
+            Disk.clear()
+
     def dumpDefines(self):
         import gpi.defines
         msg = []
@@ -169,12 +261,30 @@ class CmdParser(object):
     def noGUI(self):
         return self._nogui
 
+    def batch(self):
+        return self._batch
+
+    def timeout(self):
+        return self._timeout
+
+    def summary(self):
+        return self._summary
+
+    def serve(self):
+        return self._serve
+
     def scriptMode(self):
         return self._scriptMode
 
     def noSplash(self):
         return self._nosplash
 
+    def jobs(self):
+        return self._jobs
+
+    def noCache(self):
+        return self._nocache
+
     def mods(self):
         return self._loadable_mods
 
@@ -193,13 +303,11 @@ class CmdParser(object):
         return list(self._sargs.keys())
 
     def storeStringNodeArgs(self):
-        # merge any redundant labels with warnings
-        for arg in self._options.string:
-            lab, path = arg.split(':')
-            if lab in self._sargs:
-                log.warn('input string label for arg: \''+ str(arg) + '\' already exists, skipping.') 
-            else:
-                self._sargs[lab] = path
+        try:
+            self._sargs = parseStringNodeArgs(self._options.string)
+        except ValueError as e:
+            log.error(str(e)+' Exiting.')
+            sys.exit(1)
 
     def __str__(self):
         msg = ''
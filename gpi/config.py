@@ -63,6 +63,16 @@ SP_PREFIX = os.path.dirname(GPI_PREFIX)
 GPI_NET_PATH_DEFAULT = USER_HOME
 GPI_DATA_PATH_DEFAULT = USER_HOME
 GPI_FOLLOW_CWD = True
+GPI_JOBS_DEFAULT = 1
+GPI_PROCESS_POOL_SIZE_DEFAULT = 0
+GPI_MEM_BUDGET_DEFAULT = 0  # MiB
+GPI_WDG_DEBOUNCE_DEFAULT = 0  # ms
+GPI_DATA_TRANSPORT_DEFAULT = 'memmap'
+GPI_DATA_TRANSPORTS = ['memmap', 'shm']
+GPI_SHM_ARENA_SIZE_DEFAULT = 1024  # MiB
+GPI_MEMO_SIZE_DEFAULT = 0  # MiB
+GPI_DISK_CACHE_DIR_DEFAULT = os.path.join(USER_HOME, '.cache', 'gpi')
+GPI_DISK_CACHE_SIZE_DEFAULT = 0  # MiB
 
 # Build the distro default to include any gpi_<name> packages in site-packages
 GPI_SP_NODE_LIBS = glob.glob(os.path.join(SP_PREFIX,'gpi_*'))
@@ -87,6 +97,17 @@ class ConfigManager(object):
 
         # general
         self._g_import_check = True
+        self._g_jobs = GPI_JOBS_DEFAULT
+        self._g_process_pool_size = GPI_PROCESS_POOL_SIZE_DEFAULT
+        self._g_mem_budget = GPI_MEM_BUDGET_DEFAULT
+        self._g_wdg_debounce = GPI_WDG_DEBOUNCE_DEFAULT
+        self._g_data_transport = GPI_DATA_TRANSPORT_DEFAULT
+        self._g_shm_arena_size = GPI_SHM_ARENA_SIZE_DEFAULT
+
+        # node output caching
+        self._cache_memo_size = GPI_MEMO_SIZE_DEFAULT
+        self._cache_disk_dir = GPI_DISK_CACHE_DIR_DEFAULT
+        self._cache_disk_size = GPI_DISK_CACHE_SIZE_DEFAULT
 
         # root dirs for organizing gpi related files.
         self._c_networkDir = GPI_NET_PATH_DEFAULT
@@ -130,6 +151,12 @@ class ConfigManager(object):
             if o.startswith('_g_'):
                 msg += str(o) + ': ' + str(getattr(self, o)) + '\n'
 
+        # cache
+        msg += 'CACHE:\n'
+        for o in dir(self):
+            if o.startswith('_cache_'):
+                msg += str(o) + ': ' + str(getattr(self, o)) + '\n'
+
         # path
         msg += 'PATH:\n'
         for o in dir(self):
@@ -152,6 +179,56 @@ class ConfigManager(object):
     def IMPORT_CHECK(self):
         return self._g_import_check
 
+    @property
+    def JOBS(self):
+        # the number of nodes allowed to compute concurrently, 0 uses all cpus
+        if self._g_jobs == 0:
+            return max(1, Specs.NUM_CPUS())
+        return self._g_jobs
+
+    @property
+    def PROCESS_POOL_SIZE(self):
+        # the number of warm GPI_PROCESS workers kept alive, 0 disables
+        return self._g_process_pool_size
+
+    @property
+    def MEM_BUDGET(self):
+        # the memory (in bytes) that running nodes are predicted to fit in, 0
+        # for no limit
+        return self._g_mem_budget * 1024**2
+
+    @property
+    def WDG_DEBOUNCE(self):
+        # the time (in ms) that widget changes are collected into one event,
+        # 0 disables
+        return self._g_wdg_debounce
+
+    @property
+    def DATA_TRANSPORT(self):
+        # how large arrays are passed back from process nodes: 'memmap' files
+        # in the tmp dir or 'shm' shared memory segments
+        return self._g_data_transport
+
+    @property
+    def SHM_ARENA_SIZE(self):
+        # the shared memory (in bytes) kept for reuse by process node outputs,
+        # 0 disables
+        return self._g_shm_arena_size * 1024**2
+
+    @property
+    def MEMO_SIZE(self):
+        # the memory (in bytes) allowed for memoized node outputs, 0 disables
+        return self._cache_memo_size * 1024**2
+
+    @property
+    def DISK_CACHE_DIR(self):
+        return self._cache_disk_dir
+
+    @property
+    def DISK_CACHE_SIZE(self):
+        # the disk space (in bytes) allowed for cached node outputs, 0 disables
+        return self._cache_disk_size * 1024**2
+
     @property
     def GPI_NET_PATH(self):
         return self._c_networkDir
@@ -280,6 +357,38 @@ class ExternalNode(gpi.NodeAPI):
             configfile.write('# Add nodes to the library only if they \'import\'.\n')
             configfile.write('# GPI loads faster if this check is disabled.\n')
             configfile.write('#IMPORT_CHECK = False\n')
+            configfile.write('\n# The number of independent nodes that can compute at the same time.\n')
+            configfile.write('# Set to 0 to use all available cpus.\n')
+            configfile.write('#JOBS = '+str(GPI_JOBS_DEFAULT)+'\n')
+            configfile.write('\n# The number of process nodes that keep a worker alive between computes.\n')
+            configfile.write('# Set to 0 (the default) to fork a new process for every compute.\n')
+            configfile.write('#PROCESS_POOL_SIZE = '+str(GPI_PROCESS_POOL_SIZE_DEFAULT)+'\n')
+            configfile.write('\n# The memory (in MiB) GPI and its running nodes should fit in.  A node\n')
+            configfile.write('# waits to compute if the memory it used last time doesn\'t fit.\n')
+            configfile.write('# Set to 0 for no limit.\n')
+            configfile.write('#MEM_BUDGET = '+str(GPI_MEM_BUDGET_DEFAULT)+'\n')
+            configfile.write('\n# The time (in ms) that a node collects widget changes before computing\n')
+            configfile.write('# once with the latest values.  Set to 0 to compute on every change.\n')
+            configfile.write('#WDG_DEBOUNCE = '+str(GPI_WDG_DEBOUNCE_DEFAULT)+'\n')
+            configfile.write('\n# How large arrays are passed back from process nodes: \'memmap\' files\n')
+            configfile.write('# in the tmp dir or \'shm\' shared memory segments that don\'t touch disk.\n')
+            configfile.write('#DATA_TRANSPORT = '+GPI_DATA_TRANSPORT_DEFAULT+'\n')
+            configfile.write('\n# The shared memory (in MiB) kept to reuse for the outputs of process\n')
+            configfile.write('# nodes that compute again.  Set to 0 to disable.\n')
+            configfile.write('#SHM_ARENA_SIZE = '+str(GPI_SHM_ARENA_SIZE_DEFAULT)+'\n')
+
+            # CACHE Section
+            configfile.write('\n[CACHE]\n')
+            configfile.write('# Reuse node outputs when a node\'s inputs and widget settings are\n')
+            configfile.write('# the same as a previous compute.  The memory (in MiB) used to hold\n')
+            configfile.write('# outputs, set to 0 to disable.\n')
+            configfile.write('#MEMO_SIZE = '+str(GPI_MEMO_SIZE_DEFAULT)+'\n')
+            configfile.write('\n# Keep node outputs on disk so they can be reused in later sessions.\n')
+            configfile.write('# Arrays are memory-mapped from the cache instead of being read in.\n')
+            configfile.write('# The disk space (in MiB) used for outputs, set to 0 to disable.\n')
+            configfile.write('#DISK_SIZE = '+str(GPI_DISK_CACHE_SIZE_DEFAULT)+'\n')
+            configfile.write('\n# The directory that holds the on-disk cache.\n')
+            configfile.write('#DISK_DIR = '+GPI_DISK_CACHE_DIR_DEFAULT+'\n')
 
             # PATH Section
             configfile.write('\n[PATH]\n')
@@ -358,6 +467,70 @@ class ExternalNode(gpi.NodeAPI):
                 elif parm[0].lower() == 'false':
                     self._g_import_check = False
 
+            parm = self.parseMultiOPTS(config, 'GENERAL', 'JOBS', 'GPI_JOBS')
+            if parm:
+                try:
+                    self._g_jobs = max(0, int(parm[0]))
+                except ValueError:
+                    log.error(str(self._c_configFileName) + ': GENERAL::JOBS must be an integer: ' + str(parm[0]))
+
+            parm = self.parseMultiOPTS(config, 'GENERAL', 'PROCESS_POOL_SIZE', 'GPI_PROCESS_POOL_SIZE')
+            if parm:
+                try:
+                    self._g_process_pool_size = max(0, int(parm[0]))
+                except ValueError:
+                    log.error(str(self._c_configFileName) + ': GENERAL::PROCESS_POOL_SIZE must be an integer: ' + str(parm[0]))
+
+            parm = self.parseMultiOPTS(config, 'GENERAL', 'MEM_BUDGET', 'GPI_MEM_BUDGET')
+            if parm:
+                try:
+                    self._g_mem_budget = max(0, int(parm[0]))
+                except ValueError:
+                    log.error(str(self._c_configFileName) + ': GENERAL::MEM_BUDGET must be an integer: ' + str(parm[0]))
+
+            parm = self.parseMultiOPTS(config, 'GENERAL', 'WDG_DEBOUNCE', 'GPI_WDG_DEBOUNCE')
+            if parm:
+                try:
+                    self._g_wdg_debounce = max(0, int(parm[0]))
+                except ValueError:
+                    log.error(str(self._c_configFileName) + ': GENERAL::WDG_DEBOUNCE must be an integer: ' + str(parm[0]))
+
+            parm = self.parseMultiOPTS(config, 'GENERAL', 'DATA_TRANSPORT', 'GPI_DATA_TRANSPORT')
+            if parm:
+                if parm[0].lower() in GPI_DATA_TRANSPORTS:
+                    self._g_data_transport = parm[0].lower()
+                else:
+                    log.error(str(self._c_configFileName) + ': GENERAL::DATA_TRANSPORT must be one of ' + str(GPI_DATA_TRANSPORTS) + ': ' + str(parm[0]))
+
+            parm = self.parseMultiOPTS(config, 'GENERAL', 'SHM_ARENA_SIZE', 'GPI_SHM_ARENA_SIZE')
+            if parm:
+                try:
+                    self._g_shm_arena_size = max(0, int(parm[0]))
+                except ValueError:
+                    log.error(str(self._c_configFileName) + ': GENERAL::SHM_ARENA_SIZE must be an integer: ' + str(parm[0]))
+
+        # CACHE section
+        if config.has_section('CACHE'):
+
+            parm = self.parseMultiOPTS(config, 'CACHE', 'MEMO_SIZE', 'GPI_MEMO_SIZE')
+            if parm:
+                try:
+                    self._cache_memo_size = max(0, int(parm[0]))
+                except ValueError:
+                    log.error(str(self._c_configFileName) + ': CACHE::MEMO_SIZE must be an integer: ' + str(parm[0]))
+
+            parm = self.parseMultiOPTS(config, 'CACHE', 'DISK_SIZE', 'GPI_DISK_CACHE_SIZE')
+            if parm:
+                try:
+                    self._cache_disk_size = max(0, int(parm[0]))
+                except ValueError:
+                    log.error(str(self._c_configFileName) + ': CACHE::DISK_SIZE must be an integer: ' + str(parm[0]))
+
+            parm = self.parseMultiOPTS(config, 'CACHE', 'DISK_DIR', 'GPI_DISK_CACHE_DIR')
+            if parm:
+                # created on first use
+                self._cache_disk_dir = os.path.realpath(os.path.expanduser(parm[0]))  # only single dir
+
         # PATH section
         #   Precedence is set by this config file, then env vars, then defaults.
         if config.has_section('PATH'):
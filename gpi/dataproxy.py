@@ -26,10 +26,25 @@
 Numpy-arrays. '''
 
 import os
+import re
+import atexit
+import pickle
+import struct
+import weakref
 import hashlib
+import binascii
+import threading
+import collections
 import numpy as np
 
+try:
+    from multiprocessing import shared_memory
+    from multiprocessing import resource_tracker
+except ImportError:
+    shared_memory = None  # python < 3.8
+
 # gpi
+from .config import Config
 from .defines import GPI_SHDM_PATH
 from .logger import manager
 from .sysspecs import Specs
@@ -37,6 +52,361 @@ from .sysspecs import Specs
 # start logger for this module
 log = manager.getLogger(__name__)
 
+# shared memory segments are named for the GPI process that receives them
+SHM_PREFIX = 'gpi'
+
+# arrays smaller than this are sent directly instead of through a file or
+# shared memory
+PROXY_DIRECT_BYTES = 2**25  # 32MiB
+
+# arena segments start with a header: [reader flag, data bytes] (uint64)
+ARENA_HEADER = 64  # bytes, keeps the data aligned
+ARENA_SLOTS = 2  # segments per outport, one can be read while the next is written
+
+# where POSIX shared memory segments are listed
+SHM_DIR = '/dev/shm'
+
+
+class ShmSegment(object):
+    '''A mapped shared memory segment.  The arrays made by array() hold a
+    reference to the segment, it's unmapped when the last of them is
+    released.
+    '''
+
+    def __init__(self, shm, reader=False):
+        self._shm = shm
+        self._reader = reader  # flags an arena segment as being read
+        self._pid = os.getpid()  # forked copies mustn't clear the flag
+        self.name = shm.name
+        self.size = shm.size
+        self.address = np.frombuffer(shm.buf, dtype=np.uint8).ctypes.data
+        if reader:
+            struct.pack_into('Q', shm.buf, 0, 1)
+
+    def array(self, shape, dtype, offset=0, strides=None, readonly=True):
+        # an array of the segment whose base is this object
+        dtype = np.dtype(dtype)
+        self.__array_interface__ = {'version': 3, 'shape': tuple(shape),
+            'typestr': dtype.str, 'descr': dtype.descr, 'strides': strides,
+            'data': (self.address+offset, readonly)}
+        return np.asarray(self)
+
+    def __del__(self):
+        try:
+            if self._reader and (os.getpid() == self._pid):
+                struct.pack_into('Q', self._shm.buf, 0, 0)
+            self._shm.close()
+        except Exception:
+            pass
+
+
+class ShmRegistry(object):
+    '''Tracks the lifetime of the shared memory segments used to pass
+    arrays from process nodes.
+
+    A segment is created by the process node and only named until the main
+    process maps it; its name is unlinked right away, so the memory is
+    returned as soon as the mapping is released.  Segments that are never
+    mapped (e.g. the compute was cancelled) are unlinked by discard().
+
+    Arrays allocated by a compute() (see SharedOutputs) are written in place
+    and passed on without a copy.  Those that aren't passed to setData() are
+    unlinked by releaseUnsent() when compute() returns.
+
+    Arrays copied out of a process node are written to an arena of
+    ARENA_SLOTS segments for each outport.  Arena segments keep their names
+    and are rewritten by later computes of the same shape, so an iterating
+    node doesn't allocate new memory each time.  The main process flags a
+    segment in its header while the port data (or anything else) still uses
+    it, and the node writes to a slot that isn't flagged.  The main process
+    keeps the arena names of each node, unlinks the least recently used ones
+    that aren't in use to stay within SHM_ARENA_SIZE and unlinks the rest
+    when the node is deleted or GPI exits.  The arena of a node that is
+    computing isn't trimmed, its process may be writing to it.  Segments
+    left by GPI sessions that crashed are unlinked at startup by
+    reclaimOrphans().
+
+    Outputs are mapped on pool threads, the registry is guarded by a lock.
+    '''
+
+    def __init__(self):
+        self._pid = os.getpid()
+        self._lock = threading.RLock()
+        self._mapped = weakref.WeakValueDictionary()  # name: ShmSegment
+        self._unsent = set()  # names of segments allocated by compute()
+        self._arena = collections.OrderedDict()  # name: (nodeID, bytes), LRU first
+        self._nodeArena = {}  # nodeID: set of names
+        self._computing = weakref.WeakKeyDictionary()  # owner: nodeID
+        atexit.register(self.releaseArena)
+        if hasattr(os, 'register_at_fork'):
+            # the lock may be held by another thread when a node forks
+            os.register_at_fork(after_in_child=self._resetLock)
+
+    def _resetLock(self):
+        self._lock = threading.RLock()
+
+    def __str__(self):
+        segs = list(self._mapped.values())
+        return 'ShmRegistry: '+str(len(segs))+' segments mapped, ' + \
+            str(sum([s.size for s in segs]))+' bytes, ' + \
+            str(len(self._arena))+' arena segments, '+str(self.arenaBytes())+' bytes'
+
+    def available(self):
+        return shared_memory is not None
+
+    def untrack(self, shm):
+        # segments outlive the process that made them, so the multiprocessing
+        # resource tracker mustn't unlink them when it exits
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+
+    def create(self, nbytes):
+        '''A new segment for the main process (called by a process node).
+        '''
+        name = SHM_PREFIX+str(os.getppid())+'_'+binascii.hexlify(os.urandom(6)).decode()
+        shm = shared_memory.SharedMemory(name=name, create=True, size=nbytes)
+        self.untrack(shm)
+        return shm
+
+    def attach(self, name, nodeID=None):
+        '''Map the named segment and unlink its name, arena segments (of
+        the given node) keep their name.
+        '''
+        with self._lock:
+            seg = self._mapped.get(name)
+            if seg is not None:
+                return seg  # set on more than one port
+            shm = shared_memory.SharedMemory(name=name)
+            if nodeID is None:
+                shm.unlink()
+            else:
+                self.untrack(shm)
+                self._arena[name] = (nodeID, shm.size)
+                self._arena.move_to_end(name)
+                self._nodeArena.setdefault(nodeID, set()).add(name)
+            seg = ShmSegment(shm, reader=(nodeID is not None))
+            self._mapped[name] = seg
+            if nodeID is not None:
+                self.trimArena()
+            return seg
+
+    def arenaName(self, nodeID, portname, slot):
+        hsh = hashlib.md5((str(nodeID)+'_'+str(portname)).encode('utf8')).hexdigest()[:10]
+        return SHM_PREFIX+str(os.getppid())+'_'+hsh+str(slot)
+
+    def arenaSegment(self, nodeID, portname, nbytes):
+        '''A segment of the outport's arena that the main process isn't
+        reading, sized for nbytes (called by a process node).  Returns None
+        if every slot is in use or the data doesn't fit in the arena.
+        '''
+        if nbytes*ARENA_SLOTS > Config.SHM_ARENA_SIZE:
+            return None
+        for slot in range(ARENA_SLOTS):
+            name = self.arenaName(nodeID, portname, slot)
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            except FileNotFoundError:
+                shm = shared_memory.SharedMemory(name=name, create=True, size=ARENA_HEADER+nbytes)
+                self.untrack(shm)
+                struct.pack_into('QQ', shm.buf, 0, 0, nbytes)
+                return shm
+            self.untrack(shm)
+            reader, size = struct.unpack_from('QQ', shm.buf, 0)
+            if reader:
+                shm.close()
+                continue
+            if size != nbytes:
+                # a different output, the slot is made again
+                shm.unlink()
+                shm.close()
+                shm = shared_memory.SharedMemory(name=name, create=True, size=ARENA_HEADER+nbytes)
+                self.untrack(shm)
+                struct.pack_into('QQ', shm.buf, 0, 0, nbytes)
+            return shm
+        return None
+
+    def arenaBytes(self):
+        with self._lock:
+            return sum([n for i, n in self._arena.values()])
+
+    def startCompute(self, owner, nodeID):
+        '''Keep the node's arena while the owner (the task that runs its
+        compute) is running, until endCompute().
+        '''
+        with self._lock:
+            self._computing[owner] = nodeID
+
+    def endCompute(self, owner):
+        with self._lock:
+            self._computing.pop(owner, None)
+
+    def trimArena(self):
+        # unlink the least recently used arena segments that aren't in use
+        # until the arena fits in SHM_ARENA_SIZE
+        with self._lock:
+            busy = set(self._computing.values())
+            total = self.arenaBytes()
+            for name in list(self._arena.keys()):
+                if total <= Config.SHM_ARENA_SIZE:
+                    break
+                if (name not in self._mapped) and (self._arena[name][0] not in busy):
+                    total -= self._arena[name][1]
+                    self.discard(name)
+
+    def releaseNode(self, nodeID):
+        '''Unlink the arena segments of a node that's being deleted.'''
+        with self._lock:
+            for name in list(self._nodeArena.get(nodeID, [])):
+                self.discard(name)
+
+    def releaseArena(self):
+        # unlink every arena segment when GPI exits, the processes GPI forks
+        # have copies of this registry that they don't own
+        if os.getpid() != self._pid:
+            return
+        with self._lock:
+            for name in list(self._arena.keys()):
+                self.discard(name)
+
+    def reclaimOrphans(self):
+        '''Unlink the segments left by GPI sessions that are no longer
+        running (e.g. after a crash).
+        '''
+        if (not self.available()) or (not os.path.isdir(SHM_DIR)):
+            return
+        pids = {}
+        for fn in os.listdir(SHM_DIR):
+            m = re.match(SHM_PREFIX+r'(\d+)_[0-9a-f]+$', fn)
+            if m is None:
+                continue
+            pid = int(m.group(1))
+            if pid not in pids:
+                pids[pid] = Specs.pidExists(pid)
+            if not pids[pid]:
+                log.info('reclaimOrphans(): unlinking shared memory \''+fn+'\' left by process '+str(pid))
+                self.discard(fn)
+
+    def allocate(self, shape, dtype):
+        '''A writable array in a new segment (called in the process that
+        runs compute()).
+        '''
+        nbytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+        seg = ShmSegment(self.create(max(1, nbytes)))
+        self._unsent.add(seg.name)
+        return seg.array(shape, dtype, readonly=False)
+
+    def segmentOf(self, data):
+        # the segment an array (or a view of one) was allocated in, if any
+        while isinstance(data, np.ndarray):
+            data = data.base
+        if isinstance(data, ShmSegment):
+            return data
+
+    def sent(self, name):
+        self._unsent.discard(name)
+
+    def releaseUnsent(self):
+        '''Unlink the segments allocated by compute() that weren't set on
+        an outport.
+        '''
+        for name in self._unsent:
+            self.discard(name)
+        self._unsent.clear()
+
+    def discard(self, name):
+        '''Unlink a segment that won't be mapped.'''
+        with self._lock:
+            arena = self._arena.pop(name, None)
+            if arena is not None:
+                self._nodeArena[arena[0]].discard(name)
+                if len(self._nodeArena[arena[0]]) == 0:
+                    del self._nodeArena[arena[0]]
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+            shm.unlink()
+            shm.close()
+        except FileNotFoundError:
+            pass
+
+    def mapped(self):
+        # the segments still held by port data
+        return list(self._mapped.values())
+
+
+Segments = ShmRegistry()
+
+
+def _sharedArray(shape, dtype, fill):
+    # an array in shared memory, or None if it should be a normal array
+    try:
+        shape = tuple([int(s) for s in shape])
+    except TypeError:
+        shape = (int(shape),)
+    dtype = np.dtype(dtype)
+    if dtype.hasobject or (int(np.prod(shape))*dtype.itemsize < PROXY_DIRECT_BYTES):
+        return None
+    arr = Segments.allocate(shape, dtype)
+    if fill:  # new segments are already zeroed
+        arr.fill(fill)
+    return arr
+
+
+class SharedOutputs(object):
+    '''While active, the numpy constructors empty(), zeros() and ones() (and
+    their _like() versions) allocate C-ordered arrays of PROXY_DIRECT_BYTES
+    or more in shared memory.  setData() then passes them to the main
+    process without a copy.  Only enabled in the process that runs compute().
+    '''
+
+    _depth = 0
+    _saved = {}  # numpy function name: numpy function
+
+    def __init__(self, enabled=True):
+        self._enabled = enabled and Segments.available()
+
+    def __enter__(self):
+        if self._enabled:
+            if SharedOutputs._depth == 0:
+                for name, fill in (('empty', None), ('zeros', None), ('ones', 1)):
+                    SharedOutputs._saved[name] = getattr(np, name)
+                    SharedOutputs._saved[name+'_like'] = getattr(np, name+'_like')
+                    setattr(np, name, self._constructor(name, fill))
+                    setattr(np, name+'_like', self._likeConstructor(name+'_like', fill))
+            SharedOutputs._depth += 1
+        return self
+
+    def __exit__(self, *args):
+        if self._enabled:
+            SharedOutputs._depth -= 1
+            if SharedOutputs._depth == 0:
+                for name, func in SharedOutputs._saved.items():
+                    setattr(np, name, func)
+                SharedOutputs._saved = {}
+        return False
+
+    def _constructor(self, name, fill):
+        orig = SharedOutputs._saved[name]
+        def alloc(shape, dtype=float, order='C', **kwargs):
+            if (order == 'C') and not kwargs:
+                arr = _sharedArray(shape, dtype, fill)
+                if arr is not None:
+                    return arr
+            return orig(shape, dtype, order, **kwargs)
+        return alloc
+
+    def _likeConstructor(self, name, fill):
+        orig = SharedOutputs._saved[name]
+        def alloc(prototype, dtype=None, order='K', subok=True, shape=None):
+            if (type(prototype) is np.ndarray) and ((order == 'C') or prototype.flags['C_CONTIGUOUS']):
+                arr = _sharedArray(prototype.shape if shape is None else shape,
+                        prototype.dtype if dtype is None else dtype, fill)
+                if arr is not None:
+                    return arr
+            return orig(prototype, dtype, order, subok, shape)
+        return alloc
+
 
 # List all types that are handled. This tells the deserializing side what to do
 class ProxyType(object):
@@ -44,6 +414,8 @@ class ProxyType(object):
     np_ndarray = 0
     np_memmap = 1
     segmented = 2
+    shm = 3
+    pickled = 4
 
 class DataProxy(dict):
     '''Holds all file descriptor information for any object that is
@@ -56,6 +428,17 @@ class DataProxy(dict):
     NUMPY-MMAP:
         MMAP file descriptors are passed through the proxy only if there are
         enough available resources (i.e. rlimit).
+
+    NUMPY-SHM:
+        With the 'shm' DATA_TRANSPORT, arrays are passed in shared memory
+        segments (see ShmRegistry) instead of memmap files.  Arrays that were
+        allocated in a segment (see SharedOutputs) are passed without a copy.
+
+    OBJECTS:
+        Other objects (e.g. lists or dicts of arrays) that hold large buffers
+        are pickled (protocol 5) with the buffers out-of-band.  The buffers
+        are copied to one segment (or memmap file) and only the rest of the
+        object is sent through the channel.
     '''
     def __init__(self):
         super(DataProxy, self).__init__()
@@ -79,8 +462,13 @@ class DataProxy(dict):
     # select the correct proxy data for np-ndarrays and memmaps
     def NDArray(self, data, shdf=None, nodeID=None, portname=None):
 
+        # if the array was allocated in shared memory
+        seg = Segments.segmentOf(data)
+        if seg is not None:
+            self._setNDArrayShmFromShmArray(data, seg)
+
         # if the user creates a memmapped numpy w/o using allocArray()
-        if type(data) is np.memmap and data.filename is not None:
+        elif type(data) is np.memmap and data.filename is not None:
             # it's a *real* np.memmap
             self._setNDArrayMemmapFromNDArrayMemmap(data)
 
@@ -96,13 +484,17 @@ class DataProxy(dict):
 
                 # if the array is small then just send it directly instead of
                 # using up a file handle
-                if data.nbytes < 2**25: # 32MiB 
+                if data.nbytes < PROXY_DIRECT_BYTES:
                     self._setNDArrayFromNDArray(data)
 
                 # we're too close to the open file limit so start using segmented proxy
                 elif Specs.openFileLimitThresh():
                     return self._genNDArraySegmentsFromNDArray(data)
             
+                # shared memory keeps the data off the filesystem
+                elif (Config.DATA_TRANSPORT == 'shm') and Segments.available():
+                    self._setNDArrayShmFromNDArray(data, nodeID, portname)
+
                 # in the normal case we'll use memmap to pass data.
                 else:
                     self._setNDArrayMemmapFromNDArray(data, nodeID, portname)
@@ -149,7 +541,9 @@ class DataProxy(dict):
             cnt += 1
         return buf
 
-    # assemble all the numpy chunks into one array and return the array
+    # assemble all the numpy chunks into one array and return the array,
+    # each chunk is copied into place and dropped from its proxy so only one
+    # extra segment is held at a time
     def _assembleNDArraySegments(self, segments):
         log.info("_assembleNDArraySegments(): ------ APPENDING LARGE NPY ARRAY SEGMENTS")
 
@@ -160,9 +554,14 @@ class DataProxy(dict):
         # order the segments based on their 'no.'
         segments = sorted(segments, key=lambda d: d['no.'])
 
-        # gather array segments and reshape NPY array
-        segs = [s['seg'] for s in segments]
-        lrgNPY = np.concatenate(segs)
+        # copy the array segments into the flattened NPY array
+        lrgNPY = np.empty(int(np.prod(segments[0]['oshape'])), dtype=segments[0]['seg'].dtype)
+        pos = 0
+        for s in segments:
+            seg = s.pop('seg')
+            lrgNPY[pos:pos+seg.size] = seg
+            pos += seg.size
+            del seg
         lrgNPY.shape = segments[0]['oshape']
         return lrgNPY
 
@@ -175,6 +574,81 @@ class DataProxy(dict):
         fp = np.memmap(self['shdf'], dtype=data.dtype, mode='w+', shape=self['shape'])
         fp[:] = data[:] # full copy
 
+    # copy an np-ndarray to a free segment of the outport's arena, or a new
+    # segment
+    def _setNDArrayShmFromNDArray(self, data, nodeID, portname):
+        self['proxy_type'] = ProxyType.shm
+        self['shape'] = tuple(data.shape)
+        self['dtype'] = data.dtype
+        self['offset'] = 0
+        shm = Segments.arenaSegment(nodeID, portname, data.nbytes)
+        if shm is None:
+            shm = Segments.create(data.nbytes)
+        else:
+            self['offset'] = ARENA_HEADER
+            self['arena'] = nodeID
+        self['shm'] = shm.name
+        buf = np.ndarray(self['shape'], dtype=data.dtype, buffer=shm.buf, offset=self['offset'])
+        buf[...] = data  # full copy
+        del buf
+        shm.close()
+
+    # an array allocated in a segment is passed as is
+    def _setNDArrayShmFromShmArray(self, data, seg):
+        self['proxy_type'] = ProxyType.shm
+        self['shape'] = tuple(data.shape)
+        self['dtype'] = data.dtype
+        self['strides'] = data.strides
+        self['offset'] = data.__array_interface__['data'][0] - seg.address
+        self['shm'] = seg.name
+        Segments.sent(seg.name)
+
+    # pickle an object with its buffers out-of-band, returns None if they add
+    # up to less than PROXY_DIRECT_BYTES (the object is then sent as is)
+    def Object(self, data, nodeID=None, portname=None):
+        if pickle.HIGHEST_PROTOCOL < 5:
+            return None
+        buffers = []
+        try:
+            meta = pickle.dumps(data, protocol=5, buffer_callback=buffers.append)
+        except Exception:
+            return None
+        views = [b.raw() for b in buffers]
+        if sum([v.nbytes for v in views]) < PROXY_DIRECT_BYTES:
+            return None
+
+        # each buffer is aligned in the segment like a new array would be
+        layout = []
+        nbytes = 0
+        for v in views:
+            layout.append((nbytes, v.nbytes))
+            nbytes += v.nbytes + (-v.nbytes % ARENA_HEADER)
+
+        self['proxy_type'] = ProxyType.pickled
+        self['meta'] = meta
+        self['buffers'] = layout
+        self['nbytes'] = nbytes
+        if (Config.DATA_TRANSPORT == 'shm') and Segments.available():
+            shm = Segments.create(nbytes)
+            self['shm'] = shm.name
+            buf = np.ndarray((nbytes,), dtype=np.uint8, buffer=shm.buf)
+        else:
+            shm = None
+            self['shdf'] = self.getSHMF(nodeID, portname)
+            buf = np.memmap(self['shdf'], dtype=np.uint8, mode='w+', shape=(nbytes,))
+        for (offset, n), v in zip(layout, views):
+            buf[offset:offset+n] = np.frombuffer(v, dtype=np.uint8)  # full copy
+        del buf
+        if shm is not None:
+            shm.close()
+        return self
+
+    # release a segment that getData() won't be called for
+    def discard(self):
+        if ('shm' in self) and not self.get('mapped'):
+            Segments.discard(self['shm'])
+            self['mapped'] = True
+
     # if the np-memmap is already generated and passed directly then just copy
     # the relevant information
     def _setNDArrayMemmapFromNDArrayMemmap(self, data):
@@ -215,6 +689,18 @@ class DataProxy(dict):
             buf = np.frombuffer(shd.data, dtype=shd.dtype)
             buf.shape = shd.shape
             return buf
+        elif self['proxy_type'] == ProxyType.shm:
+            self['mapped'] = True
+            return Segments.attach(self['shm'], self.get('arena')).array(self['shape'],
+                self['dtype'], self.get('offset', 0), self.get('strides'))
+        elif self['proxy_type'] == ProxyType.pickled:
+            if 'shm' in self:
+                self['mapped'] = True
+                buf = Segments.attach(self['shm']).array((self['nbytes'],), np.uint8)
+            else:
+                buf = np.memmap(self['shdf'], dtype=np.uint8, mode='r', shape=(self['nbytes'],))
+            # the unpickled arrays are views of the segment
+            return pickle.loads(self['meta'], buffers=[buf[o:o+n] for o, n in self['buffers']])
         elif self['proxy_type'] == ProxyType.np_ndarray:
             return self['data']
         elif self['proxy_type'] == ProxyType.segmented:
@@ -226,3 +712,68 @@ class DataProxy(dict):
         if segments[0]['proxy_type'] == ProxyType.segmented:
             if segments[0]['seg_type'] == ProxyType.np_ndarray:
                 return self._assembleNDArraySegments(segments)
+
+
+if __name__ == '__main__':
+
+    if (not Segments.available()) or (not os.path.isdir(SHM_DIR)):
+        print("no POSIX shared memory, skipped")
+        raise SystemExit(0)
+
+    def listed(name):
+        return os.path.exists(os.path.join(SHM_DIR, name))
+
+    print("test ShmRegistry")
+    reg = ShmRegistry()
+
+    print("arena slots")
+    shm = reg.arenaSegment(7, 'out', 4096)
+    first = shm.name
+    shm.close()
+    seg = reg.attach(first, nodeID=7)
+    assert reg.attach(first, nodeID=7) is seg
+    assert reg.arenaBytes() >= ARENA_HEADER+4096
+
+    # the slot being read is skipped, and reused once it is released
+    shm = reg.arenaSegment(7, 'out', 4096)
+    second = shm.name
+    shm.close()
+    assert second != first
+    del seg
+    shm = reg.arenaSegment(7, 'out', 4096)
+    assert shm.name == first
+    shm.close()
+
+    reg.releaseNode(7)
+    assert reg.arenaBytes() == 0
+    assert not listed(first)
+    reg.discard(second)  # never attached, so not tracked by the registry
+    assert not listed(second)
+
+    print("unsent outputs")
+    a = reg.allocate((16, 16), np.float32)
+    assert reg.segmentOf(a[2:]) is not None
+    name = reg.segmentOf(a).name
+    assert listed(name)
+    reg.releaseUnsent()
+    assert not listed(name)
+    del a
+
+    print("orphans")
+    # a segment named for a process that has exited, and one for this one
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    dead = shared_memory.SharedMemory(name=SHM_PREFIX+str(pid)+'_0123456789ab', create=True, size=64)
+    live = shared_memory.SharedMemory(name=SHM_PREFIX+str(os.getpid())+'_0123456789ab', create=True, size=64)
+    for shm in (dead, live):
+        reg.untrack(shm)
+        shm.close()
+    reg.reclaimOrphans()
+    assert not listed(dead.name)
+    assert listed(live.name)
+    reg.discard(live.name)
+    assert not listed(live.name)
+
+    print("ok")
@@ -207,6 +207,7 @@ OPTIONAL = 200
 GPI_THREAD = 1000
 GPI_PROCESS = 2000
 GPI_APPLOOP = 3000
+GPI_AUTO = 4000  # chosen for each compute, see execPolicy.py
 
 # limits
 GPI_FLOAT_MAX = sys.float_info.max
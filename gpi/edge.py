@@ -186,6 +186,12 @@ class Edge(QtWidgets.QGraphicsLineItem):
     def isCyclicConnection(self):
         return self.sourcePort().allowsCyclicConn() or self.destPort().allowsCyclicConn()
 
+    def getConnectionTuple(self):
+        '''(src, sink) nodes in the direction of data flow.'''
+        if isinstance(self.sourcePort(), OutPort):
+            return (self.sourceNode(), self.destNode())
+        return (self.destNode(), self.sourceNode())
+
     def getSourceCoords(self):
         c = {}
         c['nodeID'] = self.sourcePort().getNodeID()
@@ -231,13 +237,13 @@ class Edge(QtWidgets.QGraphicsLineItem):
         '''update: triggers a processing event for OPTIONAL node obligation'''
         self.source.detachEdge(self)
         self.dest.detachEdge(self)
+        self.dest.getNode().graph.removeHierarchyEdge(self)
 
         # add tracer
         if tracer:
             self.dest.getNode().graph.scene().addItem(EdgeTracer(self.dest.getNode().graph, self.source, self.dest))
 
         if update:
-            self.dest.getNode().graph.calcNodeHierarchy()
             self.dest.getNode().setEventStatus({GPI_PORT_EVENT: self.dest.portTitle})
             if self.dest.getNode().graph.inIdleState():
                 self.dest.getNode().graph._switchSig.emit('check')
@@ -0,0 +1,1944 @@
+#    Copyright (C) 2014  Dignity Health
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL PURPOSES
+#    AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+#    SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+#    PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+#    USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT
+#    LIMITED TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR
+#    MAKES NO WARRANTY AND HAS NO LIABILITY ARISING FROM ANY USE OF THE
+#    SOFTWARE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+
+'''The execution core of a network: node state, port data, event propagation
+and the node queue.
+
+The canvas builds its Node (a QGraphicsItem driven by a GPI_FSM) and
+GPINodeQueue on NodeState and NodeScheduler, the Engine drives the same state
+with plain objects.  The Engine is what runs a network for --nogui: it loads a
+.net file, computes every node that has an event in the order of the
+hierarchy and returns an exit code, without a canvas, state machines or an
+event loop.
+
+This is a reduced mode, not a Qt-free one.  The node definitions are still
+QWidgets (the node menus), so an (offscreen) QApplication has to exist while
+an Engine holds nodes.  GPI_PROCESS nodes are forked and run alongside the
+others (up to the number of jobs), every other node computes in the main
+thread.  Macro nodes are expanded into their member nodes when loaded.
+'''
+
+import sys
+import copy
+import math
+import time
+import heapq
+import itertools
+import traceback
+import multiprocessing.connection
+import numpy as np
+
+# gpi
+from .defaultTypes import GPIDefaultType
+from .defines import GPI_APPLOOP, GPI_PROCESS, REQUIRED, OPTIONAL, InPortTYPE, OutPortTYPE
+from .defines import GPI_WIDGET_EVENT, GPI_PORT_EVENT, GPI_INIT_EVENT, GPI_REQUEUE_EVENT
+from .defines import GetHumanReadable_bytes, GetHumanReadable_time, stw, Cl
+from .channel import ResultChannel
+from .dataproxy import DataProxy, Segments
+from .logger import manager
+from .memo import Memo
+from .stream import ChunkStream, chunkBytes
+from .sysspecs import Specs
+from .topsort import DynamicTopologicalOrder
+from .workerPool import multiprocessing_context
+
+# start logger for this module
+log = manager.getLogger(__name__)
+
+
+class ReturnCodes(object):
+
+    # Return codes from the functor have specific meaning to the node internals.
+    InitUIError = 2
+    ValidateError = 1
+    Success = 0
+    ComputeError = -1
+
+    def isComputeError(self, ret):
+        return ret == self.ComputeError
+    def isValidateError(self, ret):
+        return ret == self.ValidateError
+    def isInitUIError(self, ret):
+        return ret == self.InitUIError
+
+    # Return codes from the nodeAPI (i.e. compute(), validate() and initUI())
+    # are either success or failure for each function.
+    def isSuccess(self, ret):
+        return (ret is None) or (ret == 0)
+    def isError(self, ret):
+        return (ret is not None) and (ret != 0)
+
+Return = ReturnCodes() # make a global copy
+
+
+# Event Manager
+class EventManager(object):
+    '''Stores new events (without duplicates) in a timely manner.'''
+
+    def __init__(self):
+        self._wdg_events = set()  # holds wdg names
+        self._port_events = set()  # port names
+        self._init_event = False  # bool
+        self._requeue_event = False  # bool
+
+    def addWidgetEvent(self, e):
+        self._wdg_events.add(e)
+
+    def addPortEvent(self, e):
+        self._port_events.add(e)
+
+    def setInitEvent(self):
+        self._init_event = True
+
+    def setRequeueEvent(self):
+        self._requeue_event = True
+
+    def merge(self, other):
+        # add the events of another manager (e.g. of a cancelled compute)
+        self._wdg_events.update(other.widget)
+        self._port_events.update(other.port)
+        self._init_event = self._init_event or other.init
+        self._requeue_event = self._requeue_event or other.requeue
+
+    @property
+    def widget(self):
+        return self._wdg_events
+
+    @property
+    def port(self):
+        return self._port_events
+
+    @property
+    def init(self):
+        return self._init_event
+
+    @property
+    def requeue(self):
+        return self._requeue_event
+
+    @property
+    def events(self):
+        o = {}
+        o[GPI_WIDGET_EVENT] = self._wdg_events
+        o[GPI_PORT_EVENT] = self._port_events
+        o[GPI_INIT_EVENT] = self._init_event
+        o[GPI_REQUEUE_EVENT] = self._requeue_event
+        return o
+
+    def __str__(self):
+        msg = 'widgets: '+str(self._wdg_events)+'\n'
+        msg += 'ports: '+str(self._port_events)+'\n'
+        msg += 'init: '+str(self._init_event)+'\n'
+        msg += 'requeue: '+str(self._requeue_event)
+        return msg
+
+
+class NodeState(object):
+    '''The execution state of a node that doesn't depend on how it is shown:
+    its id and events, port lookup and data, connected nodes, hierarchy level
+    and compute statistics.  The node provides the attributes (inportList,
+    outportList, _nodeIF, graph, ...) and its own state checks.
+    '''
+
+    def setID(self, value=None):
+        if value is None:
+            self._id = id(self)  # this will always be unique
+        else:
+            self._id = value
+
+    def getID(self):
+        return self._id
+
+    def getName(self):
+        # node title
+        return self.name
+
+    def getNameFromItem(self):
+        return self.item.name
+
+    def getFullPath(self):
+        return self.item.fullpath
+
+    def getModuleName(self):
+        return self._moduleName
+
+    def getModuleCompute(self):
+        return self._nodeIF.compute
+
+    def getModuleValidate(self):
+        return self._nodeIF.validate
+
+    def getNodeLabel(self):
+        return self._nodeIF.label
+
+    def execType(self):
+        return self._nodeIF.execType()
+
+    def setEventStatus(self, val):
+        '''None: to clear event status.
+        {GPI_PORT_EVENT:'title'}: for the event type and port name.
+        {GPI_WIDGET_EVENT:'title'}: for the event type and widget name.
+        {GPI_INIT_EVENT:None}: if the node is freshly added.
+        {GPI_REQUEUE_EVENT:None}: if the node was automatically requeued.
+        '''
+        if val is not None:
+            self._event_type = val  # keep last event
+            self._event_pending = True
+            self.graph.addEventNode(self)
+
+            self.appendEvent(val)
+
+        else:
+            self._event_pending = False
+            self.graph.removeEventNode(self)
+            # the queue and delete functions set this to none
+            # so do the handoff at this point to make it available
+            # to the user.
+            self._events_handoff = self._events
+            self._events = EventManager()  # make a new one
+
+    def appendEvent(self, val):
+        # translate to new obj
+        if GPI_WIDGET_EVENT in val:
+            self._events.addWidgetEvent(val[GPI_WIDGET_EVENT])
+        if GPI_PORT_EVENT in val:
+            # TODO: for some reason, events are being added to _nodeIF at close
+            # so check for valid _nodIF function before using.
+            # -its b/c nodes are being deleted, which is causing more events.
+            # -this hack takes care of it for now.
+            if hasattr(self._nodeIF, 'getWidgetNames'):
+                # re-map widget-port events to widget events.
+                if val[GPI_PORT_EVENT] in self._nodeIF.getWidgetNames():
+                    self._events.addWidgetEvent(val[GPI_PORT_EVENT])
+                else:
+                    self._events.addPortEvent(val[GPI_PORT_EVENT])
+        if GPI_INIT_EVENT in val:
+            self._events.setInitEvent()
+        if GPI_REQUEUE_EVENT in val:
+            self._events.setRequeueEvent()
+
+    def hasEventPending(self):
+        return self._event_pending
+
+    def getPendingEvent(self):
+        '''Return copy of event to protect orig.'''
+        return copy.deepcopy(self._event_type)
+
+    def getPendingEvents(self):
+        '''Return copy of event to protect orig.'''
+        return copy.deepcopy(self._events_handoff)
+
+    def isReady(self):
+        return self.hasEventPending() and (not self.inDisabledState()) and (not self.inInitUIErrorState())
+
+    def setReQueue(self, val=False):  # NODE
+        # At the end of a nodeQueue, these tasked are checked for
+        # more events.
+        self._requeue = val
+
+    def getPorts(self):
+        return self.inportList + self.outportList
+
+    def getCyclicPorts(self):
+        plist = []
+        for port in self.inportList:
+            if port.allowsCyclicConn():
+                plist.append(port)
+        return plist
+
+    def getNonCyclicPorts(self):
+        plist = []
+        for port in self.getPorts():
+            if not port.allowsCyclicConn():
+                plist.append(port)
+        return plist
+
+    def getInPortByNumOrTitle(self, pnumORtitle):
+        return self.getPortByNumOrTitle(pnumORtitle, self.inportList)
+
+    def getOutPortByNumOrTitle(self, pnumORtitle):
+        return self.getPortByNumOrTitle(pnumORtitle, self.outportList)
+
+    def getPortByNumOrTitle(self, pnumORtitle, portList=None):
+        if portList is None:
+            portList = self.getPorts()
+        if type(pnumORtitle) is int:
+            if (pnumORtitle < 0) or (pnumORtitle >= len(portList)):
+                log.error("getPortByNumOrTitle (from Node): target out of port range: \'" +stw(pnumORtitle) +"\'")
+                return
+            src = portList[pnumORtitle]
+        elif type(pnumORtitle) is str:
+            src = None
+            cnt = 0
+            for port in portList:
+                if port.portTitle == pnumORtitle:
+                    src = port
+                    pnumORtitle = cnt
+                cnt += 1
+            if src is None:
+                log.error("getPortByNumOrTitle(): failed to find port: \'" + stw(pnumORtitle)+"\'")
+                return
+        else:
+            log.critical("getPortByNumOrTitle(): ERROR: port identifier must be either int or str")
+            return
+
+        return src
+
+    def getInPort(self, pnumORtitle):
+        return self.getPortByNumOrTitle(pnumORtitle, self.inportList)
+
+    def getOutPort(self, pnumORtitle):
+        return self.getPortByNumOrTitle(pnumORtitle, self.outportList)
+
+    def titleExists(self, title):
+        for port in self.getPorts():
+            if port.portTitle == title:
+                return True
+        # print type(self)
+        if self._nodeIF:
+            for wdg in self._nodeIF.parmList:
+                if wdg.getTitle() == title:
+                    return True
+        return False
+
+    # Parse the extTypes dict held by the graph
+    # to get an instance of the requested GPIType.
+    def findGPIType(self, ptype):
+        if self.graph:
+            typ, req = self.graph._library.getType(ptype)
+            if not req:
+                log.warn(str(self._moduleName)+' NODE: Requested port-type: \''+str(ptype)+'\' not found.  Using \'PASS\' instead.')
+            return typ
+        else:  # this is just in case the node is being instantiated as a dummy
+            return GPIDefaultType()
+
+    def resetOutportStatus(self):
+        for port in self.outportList:
+            port.setDataCalled(False)
+            port.update()
+
+    def setWidgetOutports(self):
+        # send events for widget ports
+        for port in self.outportList:
+            if port.isWidgetPort():
+                if port.setWidgetData():
+                    port.setDownstreamEvents()
+                    port.update()
+
+    def setData(self, pnumORtitle, data):
+        '''Set output data, determine port status, and send downstream events'''
+        port = self.getOutPort(pnumORtitle)
+        port.setData(data)
+        if port.dataHasChanged() and not self._restoring:
+            port.setDownstreamEvents()
+        port.update()
+        # allow gui update so port status can be seen
+        # QtWidgets.QApplication.processEvents()
+
+    def emitChunk(self, pnumORtitle, chunk, index=None, wait=True, done=None):
+        '''Hand a chunk of an outport's data to the downstream nodes that
+        take chunks.  If wait is set, blocks while their buffers are full
+        (the main thread, taking the chunks of a forked compute, doesn't).
+        done() is called once all of them have taken it.
+        '''
+        port = self.getOutPort(pnumORtitle)
+        stream = self._streams.get(port.portTitle)
+        if stream is None:
+            stream = ChunkStream(port)
+            self._streams[port.portTitle] = stream
+        stream.put(chunk, index, wait, done)
+
+    def chunkArrived(self, channel, item):
+        # ['chunk', title, chunk, index] from a forked compute, its channel is
+        # given credit for the chunk once the consumers have taken it
+        nbytes = chunkBytes(item[2])
+        self.emitChunk(item[1], item[2], item[3], wait=False,
+                       done=lambda: channel.credit(nbytes))
+
+    def finishStreams(self, assemble=True):
+        '''Wait for the chunk consumers, then set the assembled chunks as the
+        data of each streamed outport that compute() didn't set itself.
+        '''
+        streams = self._streams
+        self._streams = {}
+        for title, stream in streams.items():
+            stream.close()
+            if assemble and not self.getOutPort(title).dataHasChanged():
+                self.setData(title, stream.assemble())
+
+    # RESULTS OF A FORKED COMPUTE
+    def modifyWdg(self, title, kwargs):  # NODE
+        if self._nodeIF:  # not deleted
+            self._nodeIF.modifyWidget_direct(str(title), **kwargs)
+
+    def applyResults(self, results):
+        '''Apply the widget changes and re-queue requests that a forked
+        compute() sent back.  Returns the (retcode, peakRSS, cpuTime) it
+        reported, the retcode is ComputeError if it didn't report one or
+        something failed to apply.
+        '''
+        retcode = Return.ComputeError  # the child died without a return code
+        peak = 0
+        cpu = 0
+        failed = False
+        for o in results:
+            try:
+                if o[0] == 'retcode':
+                    retcode = Return.ComputeError if Return.isError(o[1]) else Return.Success
+                elif o[0] == 'modifyWdg':
+                    self.modifyWdg(o[1], o[2])
+                elif o[0] == 'setReQueue':
+                    self.setReQueue(o[1])
+                elif o[0] == 'peakRSS':
+                    peak = o[1]
+                elif o[0] == 'cpuTime':
+                    cpu = o[1]
+            except:
+                log.error('applyResults(): '+str(self.getName())+' failed to apply '+str(o[0])+'\n'+str(traceback.format_exc()))
+                failed = True
+        if failed:
+            retcode = Return.ComputeError
+        return retcode, peak, cpu
+
+    def applyResultData(self, results):
+        '''Set the outport data that a forked compute() sent back, the
+        segmented arrays are assembled once all of their segments are read.
+        Returns False if any of it failed to apply.
+        '''
+        ok = True
+        segmented = {}  # port: segment proxies
+        for o in results:
+            if o[0] != 'setData':
+                continue
+            try:
+                if type(o[2]) is not DataProxy:
+                    self.setData(o[1], o[2])
+                elif o[2].isSegmented():
+                    segmented.setdefault(o[1], []).append(o[2])
+                else:
+                    self.setData(o[1], o[2].getData())
+            except:
+                log.error('applyResultData(): '+str(self.getName())+' failed to set \''+str(o[1])+'\'\n'+str(traceback.format_exc()))
+                ok = False
+
+        for title, proxies in segmented.items():
+            # the segments are released as they're copied
+            data = DataProxy().getDataFromSegments(proxies)
+            if data is None:
+                log.warn('applyResultData(): segmented proxy object failed to assemble, skipping...')
+                continue
+            self.setData(title, data)
+        return ok
+
+    def recordCompute(self, walltime, peakRSS, memoKey, retcode):
+        '''Keep the statistics of a finished compute, and its outputs for
+        reuse if it succeeded.
+        '''
+        log.info("compute(): Node \'"+str(self.getName())+"\': compute time:"+str(walltime)+" sec.")
+        self.appendWallTime(walltime)
+        self.appendMemUsage(self.portMem(), peakRSS)
+        if (memoKey is not None) and not Return.isError(retcode):
+            Memo.store(memoKey, self)
+
+    def getUpstreamNodes(self):
+        '''A unique list of nodes feeding this node's inports (non-cyclic).
+        '''
+        nodes = []
+        for port in self.inportList:
+            for edge in port.edges():
+                if not edge.isCyclicConnection():
+                    n = edge.sourceNode()
+                    if n not in nodes:
+                        nodes.append(n)
+        return nodes
+
+    def getDownstreamNodes(self):
+        '''A unique list of nodes fed by this node's outports (non-cyclic).
+        '''
+        nodes = []
+        for port in self.outportList:
+            for edge in port.edges():
+                if not edge.isCyclicConnection():
+                    n = edge.destNode()
+                    if n not in nodes:
+                        nodes.append(n)
+        return nodes
+
+    def setHierarchalLevel(self, level):
+        self._hierarchal_level = level
+
+    def getHierarchalLevel(self):
+        return self._hierarchal_level
+
+    def resetHierarchalLevel(self):
+        self._hierarchal_level = -1
+
+    def appendWallTime(self, time):
+        '''Only keep the last 100 wall times.
+        '''
+        self._computeDuration.append(time)
+        if len(self._computeDuration) > 100:
+            self._computeDuration.pop(0)
+
+    def appendMemUsage(self, output_bytes, peak_rss):
+        '''Only keep the last 100 memory measurements.
+        '''
+        self._computeMemory.append((output_bytes, peak_rss))
+        if len(self._computeMemory) > 100:
+            self._computeMemory.pop(0)
+
+    def predictedMemUsage(self):
+        # the most memory (bytes) a compute of this node has needed, the
+        # peak rss of a process node doesn't include the copy of its outputs
+        # made in the main process.
+        if len(self._computeMemory):
+            nbytes = max([o for o, p in self._computeMemory])
+            peak = max([p for o, p in self._computeMemory])
+            if self.nodeCompute_thread and (self.nodeCompute_thread.execType() == GPI_PROCESS):
+                return nbytes + peak
+            return max(nbytes, peak)
+        return 0
+
+    def fusedMacro(self):
+        # the fused macro whose worker computes this node, if any
+        return None
+
+    def supersedeCompute(self):
+        # a newer event arrived, nodes that compute in the background cancel
+        # the running compute and start again
+        pass
+
+    def curWallTime(self):
+        if len(self._computeDuration):
+            return self._computeDuration[-1]
+
+    def maxWallTime(self):
+        # get the most recent time over 'thresh'
+        if len(self._computeDuration):
+            x = np.array(self._computeDuration)
+            x = x[x > self._prog_thresh]
+            if len(x) > 0:
+                return x[-1]
+            #return max(self._computeDuration)
+
+    def avgWallTime(self):
+        if len(self._computeDuration):
+            return sum(self._computeDuration)/len(self._computeDuration)
+
+    def stdWallTime(self):
+        if len(self._computeDuration):
+            avg = self.avgWallTime()  # a little wastefull
+            return math.sqrt(sum( [ (x-avg)**2 for x in self._computeDuration ] )/len(self._computeDuration))
+
+    def predictedWallTime(self):
+        # the expected time (sec) of a compute of this node, 0 if it hasn't
+        # been run
+        return self.avgWallTime() or 0.0
+
+    def portMem(self):
+        # a byte count of all outport memory being held
+        bytes_held = 0
+        for port in self.outportList:
+
+            # numpy arrays have a direct byte count
+            if hasattr(port.data, 'nbytes'):
+                bytes_held += port.data.nbytes
+
+            # try to get an estimate of the object w/ sys
+            else:
+                bytes_held += sys.getsizeof(port.data)
+
+        return bytes_held
+
+
+class NodeScheduler(object):
+    '''The list of nodes to process based on UI and hierarchy changes.
+
+    Nodes are started as soon as none of their upstream nodes are pending or
+    computing, so independent branches of a network can run concurrently.  The
+    number of simultaneous computes is capped by setMaxJobs().
+
+    Each queued node counts its upstream nodes that are still queued or
+    running.  When the count drops to zero the node is either moved to the
+    ready heap or, if it has no event, dropped and its own downstream nodes
+    are released in turn.
+
+    The ready heap is ordered by critical path: the predicted wall time of a
+    node plus the longest chain of queued nodes below it, taken from the
+    wall times of their previous computes.  The nodes that hold up the end
+    of the run are started first; without any timings this falls back to
+    the hierarchy level.
+
+    A ready node that needs memsaver data that has been released is held
+    back again while the upstream nodes that produce it are recomputed.
+
+    If a memory budget is set, a ready node is only started when the memory
+    it used in its previous computes fits alongside GPI and the nodes that
+    are already running.
+
+    When the queue is done and the only new events are on its own nodes (a
+    node called setReQueue() or data came back through a cyclic port), the
+    same nodes are queued again straight away.  The iterations of a loop
+    then don't go back through the graph's event checks.  The loop ends
+    when it converges, is paused or another node gets an event.
+    '''
+
+    def __init__(self):
+        self._paused = False
+        self._last_node_started = '-init-str-'
+        self._maxJobs = 1
+        self._memBudget = 0  # bytes, 0 for no limit
+        self._memHold = None  # why the next node is waiting
+        self._pass = 0  # detects re-entrant calls from APPLOOP nodes
+        self._running = []  # nodes started by this queue that are computing
+        self._cnt = itertools.count()  # heap tie-breaker
+        self._loopStart = 0
+        self.resetQueue()
+
+    def __str__(self):
+        # stringify the status of the queue
+        msg =  type(self).__name__+" object:\n"
+        msg += "\tis paused: "+str(self.isPaused())+"\n"
+        msg += "\tis empty:  "+str(self.isEmpty())+"\n"
+        msg += "\tqueue len: "+str(self.getQueueLen())+"\n"
+        msg += "\tready:     "+str(len(self._ready))+"\n"
+        msg += "\trunning:   "+str(len(self._running))+"\n"
+        msg += "\tmax jobs:  "+str(self._maxJobs)+"\n"
+        msg += "\tmem budget: "+str(self._memBudget)+"\n"
+        msg += "\tlast node:  "+str(self._last_node_started)+"\n"
+        msg += "\titeration:  "+str(self._iteration)+"\n"
+        return msg
+
+    def setMaxJobs(self, val):
+        # the number of nodes allowed to compute at the same time
+        self._maxJobs = max(1, int(val))
+
+    def maxJobs(self):
+        return self._maxJobs
+
+    def setMemBudget(self, nbytes):
+        # the memory that GPI and the running nodes should fit in
+        self._memBudget = max(0, int(nbytes))
+
+    def memBudget(self):
+        return self._memBudget
+
+    def memHoldMessage(self):
+        # a status message if the next node is waiting for memory
+        if self._memHold is None:
+            return None
+        node, need, used = self._memHold
+        return 'waiting for memory: '+node.getName()+' needs ' + \
+            GetHumanReadable_bytes(need)+', '+GetHumanReadable_bytes(used) + \
+            ' of '+GetHumanReadable_bytes(self._memBudget)+' in use'
+
+    def admit(self, node, running):
+        # Check that the node's worker is free and its predicted memory use
+        # fits in the budget.  A node is always admitted if nothing else is
+        # running.
+        if len(running) == 0:
+            return True
+
+        # the nodes of a fused macro share one worker, so they run in turn
+        macro = node.fusedMacro()
+        if (macro is not None) and any([n.fusedMacro() is macro for n in running]):
+            log.debug("admit(): Node(" + node.name + "): held for its macro's worker")
+            return False
+
+        if self._memBudget == 0:
+            return True
+        # the rss of GPI already holds what the nodes computing in it have
+        # allocated so far, forked nodes are counted by their prediction
+        need = node.predictedMemUsage()
+        forked = [n for n in running if n.nodeCompute_thread and (n.nodeCompute_thread.execType() == GPI_PROCESS)]
+        used = Specs.RSS() + sum([n.predictedMemUsage() for n in forked])
+        if used + need <= self._memBudget:
+            return True
+        self._memHold = (node, need, used)
+        log.debug("admit(): Node(" + node.name + "): held, " + self.memHoldMessage())
+        return False
+
+    def setPause(self, val):
+        self._paused = val
+
+    def isPaused(self):
+        return self._paused
+
+    def isEmpty(self):
+        if len(self._queued) > 0:
+            return False
+        return True
+
+    def isNode(self, node):
+        # the items of a node list that can be queued
+        return node is not None
+
+    def queueFinished(self):
+        # called once every queued node has finished
+        pass
+
+    def put(self, node):
+        if self.isNode(node) and (node not in self._queued):
+            self._queued.add(node)
+            self._waiting[node] = 0
+            self._downstream[node] = []
+            self.addPath(node)
+            self.resolve([node])
+
+    def getQueueLen(self):
+        return len(self._queued)
+
+    def resetQueue(self):
+        self._members = set()  # the nodes given to setQueue()
+        self._iteration = 0
+        self.clearQueue()
+
+    def clearQueue(self):
+        self._queued = set()  # waiting or ready
+        self._waiting = {}  # node: number of unfinished upstream nodes
+        self._downstream = {}  # node: queued downstream nodes
+        self._ready = []  # heap of (-path, level, cnt, node)
+        self._paths = {}  # node: critical path (sec)
+
+    def iteration(self):
+        # the number of times a loop has been queued again, 0 if not looping
+        return self._iteration
+
+    def setQueue(self, nlist):
+        self.resetQueue()
+        self._members = set([n for n in nlist if self.isNode(n)])
+        self.queueMembers()
+
+    def queueMembers(self):
+        self.runningNodes()  # flush finished nodes from the last queue
+        self.clearQueue()
+        self._queued = set(self._members)
+
+        # upstream nodes that are queued or running hold a node back
+        holders = self._queued | set(self._running)
+        for node in self._queued:
+            self._waiting[node] = 0
+            self._downstream[node] = []
+        for node in holders:
+            down = [n for n in node.getDownstreamNodes() if n in self._queued]
+            self._downstream[node] = down
+            for n in down:
+                self._waiting[n] += 1
+
+        self._paths = self.criticalPaths(self._queued)
+        self.resolve([n for n in self._queued if self._waiting[n] == 0])
+
+    def resolve(self, nodes):
+        # Nodes whose upstream nodes have all finished are either ready to
+        # run or, without an event, are dropped and release their own
+        # downstream nodes.
+        stack = list(nodes)
+        while len(stack):
+            node = stack.pop()
+            if node not in self._queued:
+                continue
+            if node.isReady():
+                self.pushReady(node)
+            else:
+                self._queued.discard(node)
+                del self._waiting[node]
+                stack += self.release(node)
+
+    def pushReady(self, node):
+        heapq.heappush(self._ready, (-self._paths.get(node, 0.0), node.getHierarchalLevel(), next(self._cnt), node))
+
+    def criticalPaths(self, nodes):
+        # The predicted time (sec) from the start of each of the given nodes
+        # to the end of the longest chain of these nodes below it.
+        nodes = set(nodes)
+        down = {}
+        paths = {}
+        for root in nodes:
+            stack = [root]
+            while len(stack):
+                node = stack[-1]
+                if node in paths:
+                    stack.pop()
+                    continue
+                if node not in down:
+                    down[node] = [n for n in node.getDownstreamNodes() if n in nodes]
+                pending = [n for n in down[node] if n not in paths]
+                if len(pending):
+                    stack += pending
+                    continue
+                stack.pop()
+                paths[node] = node.predictedWallTime() + max([paths[n] for n in down[node]] + [0.0])
+        return paths
+
+    def addPath(self, node):
+        # Set the critical path of a newly queued node and lengthen those of
+        # the queued nodes above it, only the ancestors whose path grows are
+        # revisited.
+        stack = [node]
+        while len(stack):
+            n = stack.pop()
+            down = [self._paths.get(d, 0.0) for d in n.getDownstreamNodes() if d in self._queued]
+            path = n.predictedWallTime() + max(down + [0.0])
+            if (n is not node) and (path <= self._paths.get(n, 0.0)):
+                continue
+            self._paths[n] = path
+            stack += [u for u in n.getUpstreamNodes() if u in self._queued]
+
+    def predictedWallTime(self, nodes=None):
+        # An estimate (sec) of the time to run the given nodes, or the queued
+        # nodes, with the current number of jobs: the longest chain or the
+        # total compute time shared by the jobs, whichever is greater.
+        if nodes is None:
+            paths = self._paths
+        else:
+            paths = self.criticalPaths([n for n in nodes if self.isNode(n)])
+        if len(paths) == 0:
+            return 0.0
+        total = sum([n.predictedWallTime() for n in paths])
+        return max(max(paths.values()), total/self._maxJobs)
+
+    def release(self, node):
+        # returns the downstream nodes that are no longer held back
+        free = []
+        for n in self._downstream.pop(node, []):
+            if n in self._waiting:
+                self._waiting[n] -= 1
+                if self._waiting[n] == 0:
+                    free.append(n)
+        return free
+
+    def removeNode(self, node):
+        # removes the given 'node'
+        self._members.discard(node)
+        if node in self._running:
+            self._running.remove(node)
+            self.resolve(self.release(node))
+        if node in self._queued:
+            self._queued.discard(node)
+            del self._waiting[node]
+            self.resolve(self.release(node))
+            log.debug("removeNode(): Node(" + node.name + \
+                "): Removed node from queue.")
+            return True  # SUCCESS
+        else:
+            log.debug("removeNode(): Node(" + node.name + \
+                "): This node was not found in the queue.")
+            return False  # FAILURE
+
+    def runningNodes(self):
+        # release the downstream nodes of any that have finished
+        done = [n for n in self._running if not n.isProcessingEvent()]
+        if len(done):
+            self._running = [n for n in self._running if n not in done]
+            for node in done:
+                self.resolve(self.release(node))
+        return list(self._running)
+
+    def popReadyNode(self):
+        # the node on the longest critical path that is still ready to run
+        held = []
+        node = None
+        while len(self._ready):
+            n = heapq.heappop(self._ready)[-1]
+            if n not in self._queued:
+                continue  # removed
+            if n.isProcessingEvent():
+                held.append(n)  # still running a previous event
+                continue
+            if not n.isReady():
+                self._queued.discard(n)
+                del self._waiting[n]
+                self.resolve(self.release(n))
+                continue
+            if self.restoreUpstream(n):
+                continue  # re-enters the heap once its inputs are restored
+            node = n
+            break
+        for n in held:
+            self.pushReady(n)
+        return node
+
+    def restoreUpstream(self, node):
+        # Queue the nodes that have released data needed by the given node
+        # and hold it back until they have recomputed.  Returns False if
+        # nothing has to be restored.
+        holders = []
+        for up in node.getReleasedUpstreamNodes():
+            if (up not in self._queued) and (up not in self._running):
+                log.debug("restoreUpstream(): Node(" + up.name + \
+                    "): recompute released data for Node(" + node.name + ").")
+                up.setRestoreEvent()
+                self.put(up)
+            if up in self._downstream:  # queued or running
+                holders.append(up)
+
+        for up in holders:
+            self._downstream[up].append(node)
+            self._waiting[node] += 1
+        return len(holders) > 0
+
+    def nextIteration(self):
+        # Queue the same nodes again if the only new events are on them.
+        # Returns False if the loop (if any) has ended.
+        if len(self._members) == 0:
+            return False
+        for node in self._members:
+            if node._nodeIF and node._nodeIF.reQueueIsSet() and not node.inDisabledState():
+                node.setEventStatus({GPI_REQUEUE_EVENT: None})
+
+        graph = next(iter(self._members)).graph
+        events = [n for n in graph.eventNodes() if n.isReady()]
+        if (len(events) == 0) or not self._members.issuperset(events):
+            if self._iteration:
+                log.info("nextIteration(): loop ended after "+str(self._iteration+1)+" iterations, " + \
+                    GetHumanReadable_time(time.time() - self._loopStart))
+            self._members = set()
+            self._iteration = 0
+            return False
+
+        if self._iteration == 0:
+            self._loopStart = time.time()
+        self._iteration += 1
+        self.queueMembers()
+        return True
+
+    def startNextNode(self):
+        if self.isPaused():
+            log.debug("startNextNode(): blocking for pause.")
+            return 'paused'
+
+        self._pass += 1
+        cur_pass = self._pass
+        self._memHold = None
+        started = False
+        while True:
+            running = self.runningNodes()
+
+            # if queue is done then finalize
+            if len(self._queued) == 0 and len(running) == 0:
+                if not self.isPaused() and self.nextIteration():
+                    continue
+                log.debug("startNextNode(): node queue empty, finished.")
+                self.queueFinished()
+                return 'finished'
+
+            if len(running) >= self._maxJobs:
+                break
+
+            # find the next node whose upstream branch is complete
+            node = self.popReadyNode()
+            if node is None:
+                break
+
+            # wait for running nodes to free memory
+            if not self.admit(node, running):
+                self.pushReady(node)
+                break
+
+            # run next node
+            self._queued.discard(node)
+            del self._waiting[node]
+            self._running.append(node)
+            self._last_node_started = node.getName()
+            node.setEventStatus(None)
+            log.debug("startNextNode(): node: "+node.getName())
+            node.start()
+            started = True
+
+            # a node that finished synchronously (e.g. GPI_APPLOOP) has
+            # already re-entered the queue, let that call take over.
+            if cur_pass != self._pass:
+                return 'started'
+
+        if started:
+            return 'started'
+        log.debug("startNextNode(): waiting on "+str(len(self._running))+" running node(s).")
+        return 'waiting'
+
+
+class EngineTask(object):
+    '''Stands in for the GPIFunctor of a node run by the Engine.  Computes run
+    in the calling thread, so the NodeAPI calls go straight to the node,
+    except for GPI_PROCESS nodes which are forked (see EngineNode.fork()).  In
+    the fork the NodeAPI calls are sent back on the task's channel.
+    '''
+
+    def __init__(self, execType=GPI_APPLOOP, channel=None):
+        self._execType = execType
+        self._proxy = channel
+        self._proc = None
+        self._start = 0
+        self._memoKey = None
+
+    def execType(self):
+        return self._execType
+
+    def addToQueue(self, item):
+        if self._proxy is None:
+            log.error('addToQueue(): engine tasks are not queued, '+str(item[0])+' dropped.')
+            return
+        self._proxy.append(item)
+
+    def keepData(self, title, data):
+        return False
+
+    def isCancelled(self):
+        return False
+
+    def isForked(self):
+        return self._proc is not None
+
+
+class EnginePort(object):
+    '''The data and connections of a port, without a canvas item.'''
+
+    PortType = None
+
+    def __init__(self, node, title, portNum, intype=None, menuWidget=None):
+        self._id = None
+        self.setID()
+
+        self.node = node
+        self.menuWidget = menuWidget  # a reference to a module menu widget
+        self.edgeList = []
+
+        self._GPIType = intype
+        self._obligation = None  # inport use only
+        self._data = None
+
+        self.portNum = portNum
+        self.portTitle = title
+        if title is None:
+            self.portTitle = str(portNum)
+
+    def setID(self, value=None):
+        if value is None:
+            self._id = id(self)
+        else:
+            self._id = value
+
+    def getID(self):
+        return self._id
+
+    def getName(self):
+        return self.portTitle
+
+    def getNode(self):
+        return self.node
+
+    def getNodeID(self):
+        return self.node.getID()
+
+    def isWidgetPort(self):
+        return self.menuWidget is not None
+
+    def GPIType(self):
+        return self._GPIType
+
+    def porttype(self):
+        return self.PortType
+
+    def allowsCyclicConn(self):
+        return False
+
+    def isMemSaver(self):
+        return False
+
+    def addEdge(self, edge):
+        self.edgeList.append(edge)
+
+    def detachEdge(self, edge):
+        if edge in self.edgeList:
+            self.edgeList.remove(edge)
+
+    def edges(self):
+        return self.edgeList
+
+    def checkDataType(self, indata):
+        return self._GPIType.matchesData(indata)
+
+    def update(self):
+        pass  # nothing to draw
+
+    def updateToolTip(self):
+        pass
+
+
+class EngineInPort(EnginePort):
+
+    PortType = InPortTYPE
+
+    def __init__(self, node, title, portNum, intype=None, obligation=REQUIRED, menuWidget=None, cyclic=False):
+        super(EngineInPort, self).__init__(node, title, portNum, intype, menuWidget)
+        self._obligation = obligation
+        self._cyclic = cyclic
+
+    def allowsCyclicConn(self):
+        return self._cyclic
+
+    def getUpstreamData(self):
+        if len(self.edgeList) > 0:
+            return self.edgeList[0].sourcePort().data
+        return None
+
+    def getUpstreamPort(self):
+        if len(self.edgeList) > 0:
+            return self.edgeList[0].sourcePort()
+        return None
+
+    def incomingDataTypeMatches(self):
+        indata = self.getUpstreamData()
+        if indata is not None:
+            return self.checkDataType(indata)
+        return False
+
+    def setREQUIRED(self):
+        self._obligation = REQUIRED
+        return self
+
+    def setOPTIONAL(self):
+        self._obligation = OPTIONAL
+        return self
+
+    def isOPTIONAL(self):
+        return self._obligation == OPTIONAL
+
+    def isREQUIRED(self):
+        return self._obligation == REQUIRED
+
+
+class EngineOutPort(EnginePort):
+
+    PortType = OutPortTYPE
+
+    def __init__(self, node, title, portNum, intype=None, obligation=None, menuWidget=None):
+        super(EngineOutPort, self).__init__(node, title, portNum, intype, menuWidget)
+        self.data_changed = True
+
+    @property
+    def data(self):
+        return self._data
+
+    def setDataCalled(self, called=True):
+        self.data_changed = called
+
+    def dataHasChanged(self):
+        return self.data_changed
+
+    def isReleased(self):
+        return False
+
+    def setReleased(self, val):
+        pass  # memsaver ports aren't released by the engine
+
+    def setWidgetData(self):  # widget-ports
+        val = self.menuWidget.get_val()
+        if self._data != val:
+            if self.setData(val):
+                return True
+        return False
+
+    def setData(self, out):
+        # enforce port type
+        if self.checkDataType(out):
+            self._data = self._GPIType.setDataAttr(out)
+            self.setDataCalled()
+            return True
+        elif out is None:
+            self._data = None
+        else:
+            log.warn("setData(\'"+stw(self.portTitle)+"\',...): OutPort type doesn't match data, unchanged.")
+        self.setDataCalled(False)
+        return False
+
+    def getDownstreamNodes(self):
+        return [[e.destNode(), e.destPort().portTitle] for e in self.edgeList]
+
+    def setDownstreamEvents(self):
+        for nodeObj in self.getDownstreamNodes():
+            nodeObj[0].setEventStatus({GPI_PORT_EVENT: nodeObj[1]})
+
+
+class EngineEdge(object):
+    '''A connection from an outport to an inport.'''
+
+    def __init__(self, sourcePort, destPort):
+        self.source = sourcePort
+        self.dest = destPort
+        self.source.addEdge(self)
+        self.dest.addEdge(self)
+
+    def sourcePort(self):
+        return self.source
+
+    def destPort(self):
+        return self.dest
+
+    def sourceNode(self):
+        return self.source.getNode()
+
+    def destNode(self):
+        return self.dest.getNode()
+
+    def isCyclicConnection(self):
+        return self.source.allowsCyclicConn() or self.dest.allowsCyclicConn()
+
+    def getConnectionTuple(self):
+        return (self.sourceNode(), self.destNode())
+
+    def detachSelf(self):
+        self.source.detachEdge(self)
+        self.dest.detachEdge(self)
+
+
+class EngineNode(NodeState):
+    '''A node instance without a canvas item or state machine.  start()
+    validates and computes the node before it returns, the state is kept as a
+    plain string.
+    '''
+
+    def __init__(self, engine, nodeCatItem):
+        self.item = nodeCatItem
+        self.graph = engine
+        self.name = nodeCatItem.name
+        self._moduleName = nodeCatItem.name
+        self._ext_filename = nodeCatItem.editable_path
+
+        self._id = None
+        self.setID()
+
+        self.nodeCompute_thread = EngineTask()
+        self._computeDuration = []
+        self._computeMemory = []  # (output bytes, peak rss bytes)
+        self._prog_thresh = 1  # sec
+        self._restoring = False
+        self._streams = {}  # outport title: ChunkStream
+        self._hierarchal_level = -1
+        self._computeStart = 0
+
+        self.inportList = []
+        self.outportList = []
+
+        # event status
+        self._event_type = None
+        self._events = EventManager()
+        self._events_handoff = None
+        self._event_pending = False
+        self._requeue = False
+
+        # idle, check, compute, v_error, c_error or i_error
+        self._state = 'idle'
+
+        self._nodeIF_scrollArea = None
+        self._nodeIF = None  # must exist while the node menu is built
+        self._nodeIF = nodeCatItem.description()(self)
+        self._nodeIF.updateTitle()
+
+        if Return.isError(self._nodeIF.initUI_return()):
+            log.error(Cl.FAIL+str(self.getName())+Cl.ESC+": initUI() failed.")
+            self._state = 'i_error'
+
+    def __str__(self):
+        return 'EngineNode('+str(self.getName())+', '+self._state+')'
+
+    # the NodeAPI expects these of a canvas item
+    def update(self, *args):
+        pass
+
+    def boundingRect(self):
+        return None
+
+    def updateOutportPosition(self):
+        pass
+
+    def isMarkedForDeletion(self):
+        return False
+
+    def loadNodeIFSettings(self, s):
+        self._nodeIF.loadSettings(s)
+
+    def getParmList(self):
+        return self._nodeIF.parmList
+
+    def addInPort(self, title=None, ptype=None, obligation=REQUIRED, menuWidget=None, cyclic=False, **kwargs):
+        if self.titleExists(title) and (menuWidget is None):
+            log.error("addInPort(): Port title \'" + str(title) \
+                + "\' is already in use! Aborting.")
+            return
+        type_cls = self.findGPIType(ptype)
+        type_cls.setTypeParms(**kwargs)
+        port = EngineInPort(self, title, len(self.inportList), intype=type_cls,
+                            obligation=obligation, menuWidget=menuWidget, cyclic=cyclic)
+        self.inportList.append(port)
+
+    def addOutPort(self, title=None, ptype=None, obligation=REQUIRED, menuWidget=None, **kwargs):
+        if self.titleExists(title) and (menuWidget is None):
+            log.error("addOutPort(): Port title \'" + str(title) \
+                + "\' is already in use! Aborting.")
+            return
+        type_cls = self.findGPIType(ptype)
+        type_cls.setTypeParms(**kwargs)
+        port = EngineOutPort(self, title, len(self.outportList), intype=type_cls,
+                             obligation=obligation, menuWidget=menuWidget)
+        self.outportList.append(port)
+
+    def removePortByRef(self, port):
+        for edge in list(port.edges()):
+            edge.detachSelf()
+        if port in self.inportList:
+            self.inportList.remove(port)
+        elif port in self.outportList:
+            self.outportList.remove(port)
+
+    def getReleasedUpstreamNodes(self):
+        return []
+
+    # STATE
+    def inIdleState(self):
+        return self._state == 'idle'
+
+    def inDisabledState(self):
+        return False
+
+    def inInitUIErrorState(self):
+        return self._state == 'i_error'
+
+    def inValidateErrorState(self):
+        return self._state == 'v_error'
+
+    def inComputeErrorState(self):
+        return self._state == 'c_error'
+
+    def inErrorState(self):
+        return self._state in ('i_error', 'v_error', 'c_error')
+
+    def isProcessingEvent(self):
+        return self._state in ('check', 'compute')
+
+    def inPortsAreValid(self):
+        # check that all required ports have data and that the data matches
+        # the requested type, widget-inports take on the upstream value.
+        valid = True
+        for inport in self.inportList:
+            if inport.getUpstreamData() is None:
+                if inport.isREQUIRED():
+                    log.debug("inPortsAreValid(): inport is required, but empty, skipping compute()")
+                    valid = False
+            elif not inport.incomingDataTypeMatches():
+                # as on the canvas, the connection is dropped
+                inport.edgeList[0].detachSelf()
+                log.debug("inPortsAreValid(): incoming data doesn't match, skipping compute()")
+                valid = False
+            elif inport.isWidgetPort():
+                inport.menuWidget.setValueQuietly(inport.getUpstreamData())
+        return valid
+
+    def start(self):
+        '''Check the inports and, if they are valid, run validate() and
+        compute().  Returns when the node is back in idle or an error state.
+        '''
+        self._state = 'check'
+        try:
+            if not self.inPortsAreValid():
+                self._state = 'idle'
+                self._nodeIF.blockWdgSignals(False)
+                return
+        except:
+            log.error("start(): "+str(self.getName())+" inport check failed.\n"+str(traceback.format_exc()))
+            self._state = 'c_error'
+            self.graph.nodeFailed(self)
+            return
+
+        self._state = 'compute'
+        self.resetOutportStatus()
+        self._computeStart = time.time()
+        retcode = self.compute()
+        if self.nodeCompute_thread.isForked():
+            return  # the engine calls collect() when it's done
+        self.computed(retcode)
+
+    def computed(self, retcode):
+        # post compute, the node goes back to idle or an error state
+        self.graph.nodeComputed(self, time.time() - self._computeStart)
+
+        try:
+            self._nodeIF.post_compute_widget_update()
+            self.setWidgetOutports()
+        except:
+            log.error("start(): "+str(self.getName())+" post compute failed.\n"+str(traceback.format_exc()))
+            retcode = Return.ComputeError
+
+        if Return.isComputeError(retcode):
+            log.error(Cl.FAIL+str(self.getName())+Cl.ESC+": compute() failed.")
+            self._state = 'c_error'
+        elif Return.isValidateError(retcode):
+            log.error(Cl.FAIL+str(self.getName())+Cl.ESC+": validate() failed.")
+            self._state = 'v_error'
+        else:
+            self._state = 'idle'
+
+        # allow new UI signals to trigger
+        self._nodeIF.blockWdgSignals(False)
+        if self.inErrorState():
+            self.graph.nodeFailed(self)
+
+    def compute(self):
+        # validate(), then reuse memoized outputs or compute().
+        st = time.time()
+        self.nodeCompute_thread = EngineTask()
+        try:
+            ret = self._nodeIF.validate()
+        except:
+            log.error('ENGINE: \''+str(self.getName())+'\' validate() failed.\n'+str(traceback.format_exc()))
+            ret = Return.ValidateError
+        if Return.isError(ret):
+            self.appendWallTime(time.time() - st)
+            return Return.ValidateError
+
+        key = Memo.key(self)
+        if key is not None:
+            outputs = Memo.lookup(key, self)
+            if outputs is not None:
+                log.info("compute(): Node \'"+str(self.getName())+"\': reusing memoized outputs.")
+                for title, data in outputs.items():
+                    self.setData(title, data)
+                return Return.Success
+
+        if (self._nodeIF.execType() == GPI_PROCESS) and not Specs.inWindows():
+            self.fork(st, key)
+            return None
+
+        Specs.resetPeakRSS()
+        rss = Specs.RSS()
+        try:
+            ret = self._nodeIF.compute()
+        except:
+            log.error('ENGINE: \''+str(self.getName())+'\':\''+str(self._nodeIF.getLabel())+'\' compute() failed.\n'+str(traceback.format_exc()))
+            ret = Return.ComputeError
+        retcode = Return.Success
+        if Return.isError(ret):
+            retcode = Return.ComputeError
+        self.finishStreams(not Return.isError(retcode))
+        self.recordCompute(time.time() - st, max(0, Specs.peakRSS() - rss), key, retcode)
+        return retcode
+
+    def fork(self, st, key):
+        # start compute() in a child process, its NodeAPI calls come back on
+        # the task's channel
+        self._nodeIF.bufferParmSettings()
+        channel = ResultChannel()
+        channel.handle('chunk', lambda item: self.chunkArrived(channel, item))
+        task = EngineTask(GPI_PROCESS, channel)
+        task._start = st
+        task._memoKey = key
+        self.nodeCompute_thread = task
+        Segments.startCompute(task, self.getID())
+        task._proc = multiprocessing_context.Process(target=self.computeChild,
+            name='GPIEngine-'+str(self.getName()))
+        task._proc.start()
+        channel.closeWriter()
+
+    def computeChild(self):
+        # CHILD PROCESS
+        channel = self.nodeCompute_thread._proxy
+        Specs.resetPeakRSS()
+        rss = Specs.RSS()
+        try:
+            ret = self._nodeIF.compute()
+        except:
+            log.error('ENGINE: \''+str(self.getName())+'\':\''+str(self._nodeIF.getLabel())+'\' compute() failed.\n'+str(traceback.format_exc()))
+            ret = Return.ComputeError
+        channel.append(['retcode', ret])
+        channel.append(['peakRSS', max(0, Specs.peakRSS() - rss)])
+        Segments.releaseUnsent()
+
+    def channel(self):
+        # the results of a forked compute that is still running
+        task = self.nodeCompute_thread
+        if task.isForked() and self.isProcessingEvent():
+            return task._proxy
+
+    def collect(self):
+        '''Read what a forked compute has sent, once the child has exited
+        its results are set on the node.  Returns True when the node is done.
+        '''
+        task = self.nodeCompute_thread
+        task._proxy.drain()
+        if not task._proxy.isClosed():
+            return False
+        task._proc.join()
+
+        retcode, peak, cpu = self.applyResults(task._proxy)
+        if not self.applyResultData(task._proxy):
+            retcode = Return.ComputeError
+        task._proxy.close()
+        Segments.endCompute(task)
+
+        self.finishStreams(not Return.isError(retcode))
+        self.recordCompute(time.time() - task._start, peak, task._memoKey, retcode)
+        self.computed(retcode)
+        return True
+
+
+class Engine(object):
+    '''Loads and runs networks without a canvas.  Nodes are started longest
+    critical path first by a NodeScheduler.  GPI_PROCESS nodes are forked and
+    up to setMaxJobs() of them run at the same time, the other nodes compute
+    in the main thread while they do.
+
+        engine = Engine()
+        if engine.loadNetwork('recon.net'):
+            sys.exit(engine.run())
+    '''
+
+    def __init__(self, library=None):
+        self._library = library  # the node and type catalog, made on demand
+        self._nodes = []
+        self._eventNodes = set()
+        self._hierarchy = DynamicTopologicalOrder()
+        self._queue = NodeScheduler()
+        self._failed = []  # nodes that ended in an error state
+        self._computed = []  # (node, sec) in the order of the last run
+        self._loadedVals = {}  # (node, widget title): value before it was set
+        self._walltime = 0
+
+    def __str__(self):
+        return 'Engine('+str(len(self._nodes))+' nodes)'
+
+    def setMaxJobs(self, val):
+        # the number of nodes allowed to compute at the same time
+        self._queue.setMaxJobs(val)
+
+    def library(self):
+        if self._library is None:
+            # the menus are only needed on the canvas
+            from .library import Library
+            self._library = Library(None, menus=False)
+        return self._library
+
+    # the canvas IF used by the nodes and their menus
+    def scene(self):
+        return self
+
+    def update(self, *args):
+        pass
+
+    def makeOnlyTheseNodesSelected(self, nodes):
+        pass
+
+    def inIdleState(self):
+        # widget events are picked up by run(), don't signal a check
+        return False
+
+    def addEventNode(self, node):
+        self._eventNodes.add(node)
+
+    def removeEventNode(self, node):
+        self._eventNodes.discard(node)
+
+    def eventNodes(self):
+        return set(self._eventNodes)
+
+    def nodeFailed(self, node):
+        # stop where the canvas would pause, nothing else is started
+        self._failed.append(node)
+        self._queue.resetQueue()
+
+    def nodeComputed(self, node, sec):
+        self._computed.append((node, sec))
+
+    # NODES
+    def getAllNodes(self):
+        return list(self._nodes)
+
+    def getNodeByID(self, nid):
+        for node in self._nodes:
+            if node.getID() == nid:
+                return node
+
+    def findNodeByLabel(self, lab):
+        # the first node with the given label, or name if it has no label
+        for node in self._nodes:
+            if node.getNodeLabel() == lab:
+                return node
+        for node in self._nodes:
+            if (node.getNodeLabel() == '') and (node.getNameFromItem() == lab):
+                return node
+
+    def findNodeByNameAndLabel(self, name, lab):
+        # return the first occurrence of a Node with the given name and label
+        for node in self._nodes:
+            if node.getNodeLabel() == lab:
+                if node.getNameFromItem() == name:
+                    return node
+
+    def newNode_byKey(self, key):
+        item = self.library().findNode_byKey(key)
+        if item is None:
+            return None
+        return self.newNode_byNodeCatalogItem(item)
+
+    def newNode_byName(self, name):
+        item = self.library().findNode_byName(name)
+        if item is None:
+            return None
+        log.warn('newNode_byName(): using \''+str(item.fullpath)+'\' for \''+str(name)+'\'.')
+        return self.newNode_byNodeCatalogItem(item)
+
+    def newNode_byNodeCatalogItem(self, item):
+        item.reload()
+        if not item.valid():
+            return None
+        node = EngineNode(self, item)
+        self._nodes.append(node)
+        if node.inInitUIErrorState():
+            self._failed.append(node)
+        return node
+
+    def connectPorts(self, outport, inport):
+        if len(inport.edges()) > 0:
+            log.debug("connectPorts(): Inport occupied, connection dropped.")
+            return None
+        return EngineEdge(outport, inport)
+
+    def calcNodeHierarchy(self):
+        # level each node by its position in the topological order, island
+        # nodes come first.
+        pairs = set()
+        for node in self._nodes:
+            for port in node.outportList:
+                for edge in port.edges():
+                    if not edge.isCyclicConnection():
+                        pairs.add(edge.getConnectionTuple())
+        skipped = self._hierarchy.reset(pairs)
+        if len(skipped):
+            log.warn('calcNodeHierarchy(): '+str(len(skipped))+' connection(s) make a loop, not ordered.')
+        for node in self._nodes:
+            node.setHierarchalLevel(self._hierarchy.index(node))
+
+    def getDownstreamClosure(self, nodes):
+        # the given nodes and every node downstream of them
+        closure = set(nodes)
+        stack = list(nodes)
+        while len(stack):
+            for node in stack.pop().getDownstreamNodes():
+                if node not in closure:
+                    closure.add(node)
+                    stack.append(node)
+        return closure
+
+    # LOADING
+    def loadNetwork(self, path):
+        '''Instantiate the nodes and connections of a .net file.  Returns
+        False if the network couldn't be loaded as a whole.
+        '''
+        from .network import Network
+        network = Network(None).loadNetworkFromFile(path)
+        if network is None:
+            return False
+        if not network['nodes']:
+            log.error("network description contains no node information!!!")
+            return False
+        return self.deserializeGraphData(network['nodes'])
+
+    def deserializeGraphData(self, graph_settings):
+        # the input and output nodes of each macro only pass data through,
+        # their connections are joined when the network is connected.
+        passing = set()
+        for s in graph_settings['macroNodes']:
+            passing.add(s['src_settings']['id'])
+            passing.add(s['sink_settings']['id'])
+        if len(passing):
+            log.info('deserializeGraphData(): '+str(len(graph_settings['macroNodes']))+' macro node(s) expanded.')
+
+        # nodes by the id they were saved with
+        buf = {}
+        skipped_mods = []
+        for s in graph_settings['nodes']:
+            if s['name'] == '__GPIMacroNode__':
+                continue
+
+            node = self.newNode_byKey(s['key'])
+            if node is None:
+                log.warn('Failed to find node \''+stw(s['name']) + '\' by scope.')
+                node = self.newNode_byName(s['name'])
+
+            if node is None:
+                log.error('Node \''+stw(s['name']) + '\' failed to load, skipping.')
+                skipped_mods.append(str(s['name']))
+                continue
+
+            buf[s['id']] = node
+            if 'walltimes' in s:
+                for t in s['walltimes']:
+                    node.appendWallTime(float(t))
+            elif 'walltime' in s:
+                try:
+                    node.appendWallTime(float(s['walltime']))
+                except (TypeError, ValueError):
+                    pass
+            node.loadNodeIFSettings(s['widget_settings'])
+
+        # each connection is stored by both of its nodes
+        upstream = {}  # (node id, inport): (node id, outport)
+        for s in graph_settings['nodes']:
+            for port in s['ports']:
+                for c in port['connections']:
+                    upstream[(c['dest']['nodeID'], c['dest']['portName'])] = (c['src']['nodeID'], c['src']['portName'])
+
+        for (dstID, inportName), (srcID, outportName) in upstream.items():
+            if dstID in passing:
+                continue
+            # follow the data back through the macro inputs and outputs,
+            # 'outN' passes on what arrives at 'inN'
+            while srcID in passing:
+                nxt = upstream.get((srcID, 'in'+outportName[len('out'):]))
+                if nxt is None:
+                    break
+                srcID, outportName = nxt
+            src = buf.get(srcID)
+            dst = buf.get(dstID)
+            if (src is None) or (dst is None):
+                continue
+            outport = src.getOutPort(outportName)
+            inport = dst.getInPort(inportName)
+            if (outport is None) or (inport is None):
+                log.warn("Connection not found.  Skip connection.")
+                continue
+            self.connectPorts(outport, inport)
+
+        for node in buf.values():
+            node.setEventStatus({GPI_INIT_EVENT: None})
+
+        self.calcNodeHierarchy()
+
+        if len(skipped_mods):
+            log.error("Failed to load the following modules: ")
+            for name in skipped_mods:
+                log.error("\t" + name)
+            return False
+        return True
+
+    def setStringArgs(self, args):
+        '''Set the 'string' widget of each String node by label, from a
+        {label: string} dict (e.g. the -s command-line args).
+        '''
+        for lab, arg in args.items():
+            node = self.findNodeByNameAndLabel('String', lab)
+            if node:
+                node._nodeIF.modifyWidget_direct('string', val=arg)
+                node.setEventStatus({GPI_WIDGET_EVENT: 'string'})
+            else:
+                log.warn('String node label: \''+str(lab)+'\' not found, skipping.')
+
+    def setWidgetArgs(self, args):
+        '''Set widget values from a {(node, widget title): value} dict.  Any
+        widget set by an earlier call that isn't in args is put back to the
+        value it had before.  Only widgets whose value changes get an event,
+        so the nodes that don't depend on them keep their outputs.
+        '''
+        vals = dict(self._loadedVals)
+        vals.update(args)
+        for (node, title), val in vals.items():
+            cur = node._nodeIF.getVal(title)
+            if (node, title) not in self._loadedVals:
+                self._loadedVals[(node, title)] = cur
+            try:
+                same = bool(cur == val)
+            except Exception:
+                same = False
+            if not same:
+                node._nodeIF.modifyWidget_direct(title, val=val)
+                node.setEventStatus({GPI_WIDGET_EVENT: title})
+
+    def retryFailed(self):
+        '''Clear the failures of the last run, the failed nodes are computed
+        again by the next run.  Nodes that failed to initialize stay failed.
+        '''
+        failed = self._failed
+        self._failed = [n for n in failed if n.inInitUIErrorState()]
+        for node in failed:
+            if not node.inInitUIErrorState():
+                node.setEventStatus({GPI_REQUEUE_EVENT: None})
+
+    # RUNNING
+    def run(self):
+        '''Compute the nodes that have events, and the nodes downstream of
+        them, until no events are left.  Returns 0 on success or 1 if a node
+        failed (where the canvas would have paused).
+        '''
+        st = time.time()
+        self._computed = []
+        while True:
+            # wait for the forked nodes, the failures stop new nodes from
+            # starting but the running ones are allowed to finish
+            forked = [n for n in self._queue.runningNodes() if n.channel() is not None]
+            if len(forked):
+                ready = multiprocessing.connection.wait([n.channel() for n in forked])
+                done = [n for n in forked if (n.channel() in ready) and n.collect()]
+                if len(done) and not len(self._failed):
+                    self._queue.startNextNode()
+                continue
+            if len(self._failed):
+                break
+
+            nodes = [n for n in self._eventNodes if n.isReady()]
+            if len(nodes):
+                # nodes that compute in the main thread are released as
+                # soon as they return, forked nodes when they're collected
+                self._queue.setQueue(self.getDownstreamClosure(nodes))
+                self._queue.startNextNode()
+                continue
+
+            # if the queue is done then check for re-queue nodes
+            cnt = 0
+            for node in self._nodes:
+                if node._nodeIF.reQueueIsSet():
+                    node.setEventStatus({GPI_REQUEUE_EVENT: None})
+                    cnt += 1
+            if cnt == 0:
+                break
+
+        self._walltime = time.time() - st
+        if len(self._failed):
+            for node in self._failed:
+                log.error('run(): '+str(node)+' failed.')
+            log.dialog('Engine Wall Time: '+GetHumanReadable_time(self._walltime)+', a node failed.')
+            return 1
+        log.dialog('Engine Wall Time: '+GetHumanReadable_time(self._walltime)+', ' + \
+            GetHumanReadable_bytes(self.totalPortMem())+' held in outports.')
+        return 0
+
+    def walltime(self):
+        return self._walltime
+
+    def failedNodes(self):
+        return list(self._failed)
+
+    def computedNodes(self):
+        # the (node, sec) computed by the last run
+        return list(self._computed)
+
+    def totalPortMem(self):
+        return sum([node.portMem() for node in self._nodes])
+
+
+
+if __name__ == '__main__':
+
+    class _Graph(object):
+        def __init__(self):
+            self.nodes = []
+        def eventNodes(self):
+            return [n for n in self.nodes if n.event]
+
+    class _Node(object):
+        # the parts of a node the scheduler looks at
+        def __init__(self, graph, name, wall, up=()):
+            self.graph = graph
+            self.name = name
+            self.wall = wall
+            self.up = list(up)
+            self.down = []
+            self.event = True
+            self.busy = False
+            self._nodeIF = None
+            graph.nodes.append(self)
+            for n in self.up:
+                n.down.append(self)
+        def getName(self): return self.name
+        def getUpstreamNodes(self): return list(self.up)
+        def getDownstreamNodes(self): return list(self.down)
+        def getReleasedUpstreamNodes(self): return []
+        def getHierarchalLevel(self): return len(self.up)
+        def predictedWallTime(self): return self.wall
+        def fusedMacro(self): return None
+        def isReady(self): return self.event
+        def isProcessingEvent(self): return self.busy
+        def setEventStatus(self, val): self.event = False
+        def start(self):
+            self.busy = True
+            started.append(self.name)
+
+    print("test NodeScheduler")
+
+    # a and b feed c, b is on the longer critical path
+    g = _Graph()
+    a = _Node(g, 'a', 1.0)
+    b = _Node(g, 'b', 5.0)
+    c = _Node(g, 'c', 1.0, up=[a, b])
+
+    print("ordering, one job")
+    started = []
+    q = NodeScheduler()
+    q.setQueue([c, a, b])
+    assert q.predictedWallTime() == 7.0
+    assert q.startNextNode() == 'started'
+    assert started == ['b']
+    assert q.startNextNode() == 'waiting'  # the one job is taken
+    b.busy = False
+    assert q.startNextNode() == 'started'
+    assert started == ['b', 'a']
+    a.busy = False
+    assert q.startNextNode() == 'started'
+    assert started == ['b', 'a', 'c']
+    c.busy = False
+    assert q.startNextNode() == 'finished'
+
+    print("jobs cap")
+    for n in (a, b, c):
+        n.event = True
+    started = []
+    q = NodeScheduler()
+    q.setMaxJobs(2)
+    q.setQueue([a, b, c])
+    assert q.predictedWallTime() == 6.0
+    assert q.startNextNode() == 'started'
+    assert started == ['b', 'a']  # both branches, c is held back
+    assert len(q.runningNodes()) == 2
+    a.busy = False
+    assert q.startNextNode() == 'waiting'  # c still waits on b
+    b.busy = False
+    assert q.startNextNode() == 'started'
+    assert started == ['b', 'a', 'c']
+    c.busy = False
+    assert q.startNextNode() == 'finished'
+
+    print("nodes without an event")
+    # they are dropped, their downstream nodes still run
+    for n in (a, c):
+        n.event = True
+    started = []
+    q = NodeScheduler()
+    q.setMaxJobs(0)  # at least one
+    assert q.maxJobs() == 1
+    q.setQueue([a, b, c])
+    assert q.startNextNode() == 'started'
+    a.busy = False
+    assert q.startNextNode() == 'started'
+    c.busy = False
+    assert q.startNextNode() == 'finished'
+    assert started == ['a', 'c']
+
+    print("ok")
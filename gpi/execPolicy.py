@@ -0,0 +1,148 @@
+#    Copyright (C) 2014  Dignity Health
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL PURPOSES
+#    AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+#    SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+#    PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+#    USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT
+#    LIMITED TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR
+#    MAKES NO WARRANTY AND HAS NO LIABILITY ARISING FROM ANY USE OF THE
+#    SOFTWARE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+
+'''Execution type selection for nodes whose execType() is GPI_AUTO.
+
+Each compute of an auto node is measured: its wall time, the cpu time of the
+thread that ran compute() and the bytes at its inports and outports.  The
+next compute is run:
+
+    - in the app-loop if it is too short to be noticed in the GUI,
+    - as a process if it keeps the interpreter busy (the cpu time of its
+      thread is close to its wall time, so it holds the GIL) for longer than
+      a process and the copy of its data would take,
+    - otherwise in a thread, which is also where an unmeasured node starts.
+
+The choice and the reason for it are kept for each compute, see
+ExecPolicy.decisions().
+'''
+
+import sys
+import time
+import weakref
+import collections
+import numpy as np
+
+from .defines import GPI_APPLOOP, GPI_THREAD, GPI_PROCESS, GetHumanReadable_time
+from .defines import GetHumanReadable_bytes
+from .logger import manager
+
+# start logger for this module
+log = manager.getLogger(__name__)
+
+AUTO_APPLOOP_TIME = 0.05  # sec, computes this short run in the app-loop
+AUTO_GIL_RATIO = 0.5  # cpu/wall time above which compute() holds the GIL
+AUTO_PROCESS_TIME = 0.05  # sec, the cost of starting a process compute
+AUTO_COPY_RATE = 1.0e9  # bytes/sec, port data moved to and from a process
+AUTO_HISTORY = 10  # computes and decisions kept per node
+
+EXEC_NAMES = {GPI_APPLOOP: 'App-Loop', GPI_THREAD: 'Thread', GPI_PROCESS: 'Process'}
+
+
+def dataBytes(data):
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    return sys.getsizeof(data)
+
+
+class ExecRun(object):
+    '''The measurements of one compute.'''
+
+    def __init__(self, execType, wall, cpu, inBytes, outBytes):
+        self.execType = execType
+        self.wall = wall  # sec
+        self.cpu = cpu  # sec, of the thread that ran compute()
+        self.inBytes = inBytes
+        self.outBytes = outBytes
+
+
+class ExecPolicy(object):
+    '''Chooses the execution type of each compute of an auto node from the
+    measurements of its previous computes.
+    '''
+
+    def __init__(self):
+        self._runs = weakref.WeakKeyDictionary()  # node: deque of ExecRun
+        self._decisions = weakref.WeakKeyDictionary()  # node: deque of (time, execType, reason)
+
+    def __str__(self):
+        msg = 'ExecPolicy: '+str(len(self._runs))+' measured nodes'
+        for node, decisions in list(self._decisions.items()):
+            t, et, reason = decisions[-1]
+            msg += '\n\t'+str(node.getName())+': '+EXEC_NAMES[et]+', '+reason
+        return msg
+
+    def inputBytes(self, node):
+        return sum([dataBytes(port.getUpstreamData()) for port in node.inportList])
+
+    def record(self, node, execType, wall, cpu, inBytes, outBytes):
+        runs = self._runs.get(node)
+        if runs is None:
+            runs = collections.deque(maxlen=AUTO_HISTORY)
+            self._runs[node] = runs
+        runs.append(ExecRun(execType, wall, cpu, inBytes, outBytes))
+
+    def choose(self, node):
+        '''Returns the execution type for the node's next compute and keeps
+        the decision.
+        '''
+        execType, reason = self.decide(self._runs.get(node))
+        decisions = self._decisions.get(node)
+        if decisions is None:
+            decisions = collections.deque(maxlen=AUTO_HISTORY)
+            self._decisions[node] = decisions
+        decisions.append((time.time(), execType, reason))
+        log.info("choose(): Node \'"+str(node.getName())+"\': "+EXEC_NAMES[execType]+", "+reason)
+        return execType
+
+    def decide(self, runs):
+        # returns (execType, reason) for the given measurements
+        if not runs:
+            return GPI_THREAD, 'not measured yet'
+
+        n = len(runs)
+        wall = sum([r.wall for r in runs])/n
+        cpu = sum([r.cpu for r in runs])/n
+        nbytes = sum([r.inBytes + r.outBytes for r in runs])/n
+
+        if wall < AUTO_APPLOOP_TIME:
+            return GPI_APPLOOP, 'compute() takes '+GetHumanReadable_time(wall)
+
+        ratio = min(1.0, cpu/wall)
+        cost = AUTO_PROCESS_TIME + nbytes/AUTO_COPY_RATE
+        if ratio < AUTO_GIL_RATIO:
+            return GPI_THREAD, 'the GIL is free for '+str(int(100*(1-ratio)))+'% of compute()'
+        if cpu > cost:
+            return GPI_PROCESS, 'holds the GIL for '+GetHumanReadable_time(cpu) + \
+                ', a process costs ~'+GetHumanReadable_time(cost)
+        return GPI_THREAD, 'a process costs ~'+GetHumanReadable_time(cost) + \
+            ' to move '+GetHumanReadable_bytes(nbytes)
+
+    def decisions(self, node):
+        '''A list of (time, execType, reason) for the node's recent computes.
+        '''
+        return list(self._decisions.get(node, []))
+
+
+Policy = ExecPolicy()
@@ -25,50 +25,27 @@
 
 import gc
 import time
+import threading
 import numpy as np # for 32bit-Pipe hack
 import traceback
-import multiprocessing
-import platform
 
 import gpi
 from gpi import QtCore
-from .dataproxy import DataProxy, ProxyType
-from .defines import GPI_PROCESS, GPI_THREAD, GPI_APPLOOP
+from .dataproxy import DataProxy, ProxyType, Segments
+from .defines import GPI_PROCESS, GPI_THREAD, GPI_APPLOOP, GPI_AUTO
+from .engine import Return
+from .execPolicy import Policy
 from .logger import manager
+from .memo import Memo
 from .sysspecs import Specs
+from .channel import ResultChannel
+from .workerPool import Pool, multiprocessing_context, placeholder
 
 # start logger for this module
 log = manager.getLogger(__name__)
 
-# Python 3.8 - need to explicitly declare fork for MacOS
-if platform.system() == 'Windows':
-    multiprocessing_context = multiprocessing.get_context('spawn')
-else:
-    multiprocessing_context = multiprocessing.get_context('fork')
-
-class ReturnCodes(object):
-
-    # Return codes from the functor have specific meaning to the node internals.
-    InitUIError = 2
-    ValidateError = 1
-    Success = 0
-    ComputeError = -1
-
-    def isComputeError(self, ret):
-        return ret == self.ComputeError
-    def isValidateError(self, ret):
-        return ret == self.ValidateError
-    def isInitUIError(self, ret):
-        return ret == self.InitUIError
-
-    # Return codes from the nodeAPI (i.e. compute(), validate() and initUI())
-    # are either success or failure for each function.
-    def isSuccess(self, ret):
-        return (ret is None) or (ret == 0)
-    def isError(self, ret):
-        return (ret is not None) and (ret != 0)
-
-Return = ReturnCodes() # make a global copy
+# time a cancelled process has to return from compute() before it's stopped
+CANCEL_GRACE = 0.5  # sec
 
 def ExecRunnable(runnable):
     tp = QtCore.QThreadPool.globalInstance()
@@ -77,6 +54,16 @@ def ExecRunnable(runnable):
     #print 'maxThreadCount: ', tp.maxThreadCount()
     tp.start(runnable)
 
+def WatchFd(fd, slot):
+    # call slot from the event loop whenever fd is readable
+    notifier = QtCore.QSocketNotifier(fd, QtCore.QSocketNotifier.Read)
+    notifier.activated.connect(slot)
+    return notifier
+
+def UnwatchFd(notifier):
+    notifier.setEnabled(False)
+    notifier.deleteLater()
+
 class GPIRunnable(QtCore.QRunnable):
     def __init__(self, func):
         super(GPIRunnable, self).__init__()
@@ -89,6 +76,7 @@ class GPIFunctor(QtCore.QObject):
 
     finished = gpi.Signal(int)
     terminated = gpi.Signal()
+    cancelled = gpi.Signal()
     applyQueuedData_finished = gpi.Signal()
     _setData_finished = gpi.Signal()
 
@@ -108,11 +96,13 @@ class GPIFunctor(QtCore.QObject):
         self.applyQueuedData_finished.connect(self.finalMatter)
         self._ap_st_time = 0
 
-        # flag for segmented types that need reconstitution on this side
-        self._segmentedDataProxy = False
+        # auto nodes are given a type for each compute
+        self._execType = node._nodeIF.execType()
+        self._auto = (self._execType == GPI_AUTO)
+        if self._auto:
+            self._execType = Policy.choose(node)
 
         # For Windows just make them all apploops for now to be safe
-        self._execType = node._nodeIF.execType()
         if Specs.inWindows() and (self._execType == GPI_PROCESS):
         # if (self._execType == GPI_PROCESS):
             log.info("init(): <<< WINDOWS Detected >>> Forcing GPI_PROCESS -> GPI_THREAD")
@@ -121,26 +111,48 @@ class GPIFunctor(QtCore.QObject):
 
         self._label = node._nodeIF.getLabel()
         self._isTerminated = False
+        self._isDiscarded = False
+        self._isReturned = False
         self._compute_start = 0
+        self._memoKey = None
+
+        # measured for auto nodes (see execPolicy.py)
+        self._cpuTime = 0
+        self._inBytes = 0
+
+        # memory used by compute(), the rss is measured from its start
+        self._peakRSS = 0
 
-        self._manager = None
         self._proxy = None
         self._proc = None
+        self._macro = None
         if self._execType == GPI_PROCESS:
             log.debug("init(): set as GPI_PROCESS: "+str(self._title))
-            self._manager = multiprocessing_context.Manager()
-            self._proxy = self._manager.list()
-            self._proc = PTask(self._func, self._title, self._label, self._proxy)
+            # a forked compute shares the cancel flag (see cancel())
+            self._cancel = multiprocessing_context.Event()
+            if Pool.enabled():
+                # results come back on the worker's own pipe
+                self._macro = node.fusedMacro()
+                self._proxy = ResultChannel(pipe=False)
+                self._proc = WTask(node, self._title, self._label, self._proxy, self._macro)
+            else:
+                self._proxy = ResultChannel()
+                self._proc = PTask(self._func, self._title, self._label, self._proxy)
+
+            # chunks are passed on as they arrive
+            self._proxy.handle('chunk', self.chunkArrived)
 
             # apply data in a thread to make the GUI more responsive
             self._applyData_thread = GPIRunnable(self.applyQueuedData_setData)
 
         elif self._execType == GPI_THREAD:
             log.debug("init(): set as GPI_THREAD: "+str(self._title))
+            self._cancel = threading.Event()
             self._proc = TTask(self._func, self._title, self._label, self._proxy)
 
         else:  # default to GPI_APPLOOP
             log.debug("init(): set as GPI_APPLOOP: "+str(self._title))
+            self._cancel = threading.Event()
             self._proc = ATask(self._func, self._title, self._label, self._proxy)
 
         self._proc.finished.connect(self.computeFinished)
@@ -153,15 +165,68 @@ class GPIFunctor(QtCore.QObject):
 
     def terminate(self):
         self._isTerminated = True
+        self._node.finishStreams(assemble=False)
+        self.discardQueuedData()
         self.cleanup()
         self._proc.terminate()
         # self.wait() # so that something is waiting
         self.computeTerminated()
 
+    def cancel(self):
+        '''Ask compute() to stop because a newer event has superseded it (see
+        NodeAPI.isCancelled()).  Its results are discarded and 'cancelled' is
+        emitted once it has stopped.  A process still computing after
+        CANCEL_GRACE is stopped.  Returns False if the compute can't be
+        cancelled (e.g. its results are already being applied).
+        '''
+        if (self._execType == GPI_APPLOOP) or self._isReturned or self.isCancelled():
+            return False
+        log.info("cancel(): Node \'"+str(self._title)+"\': compute() superseded.")
+        self._cancel.set()
+
+        if self._execType == GPI_PROCESS:
+            if isinstance(self._proc, WTask):
+                # the worker was forked before this compute, it has its own flag
+                self._proc.cancel()
+            QtCore.QTimer.singleShot(int(CANCEL_GRACE*1000), self.cancelTimeout)
+        return True
+
+    def isCancelled(self):
+        return self._cancel.is_set()
+
+    def cancelTimeout(self):
+        if self._isDiscarded or self._isTerminated:
+            return
+        log.info("cancelTimeout(): Node \'"+str(self._title)+"\': stopping the superseded process.")
+        self._proc.terminate()
+        self.computeCancelled()
+
+    def computeCancelled(self):
+        # discard whatever the cancelled compute produced
+        if self._isDiscarded:
+            return
+        self._isDiscarded = True
+        self._node.finishStreams(assemble=False)
+        self.discardQueuedData()
+        self.cleanup()
+        self.cancelled.emit()
+
+    def discardQueuedData(self):
+        # release the shared memory of outputs that won't be applied
+        if self._proxy is None:
+            return
+        for o in self._proxy:
+            if (o[0] == 'setData') and (type(o[2]) is DataProxy):
+                o[2].discard()
+
     def cleanup(self):
-        # make sure the proxy manager for processes is shutdown.
-        if self._manager:
-            self._manager.shutdown()
+        # make sure the result pipe for processes is closed.
+        if self._proxy is not None:
+            self._proxy.close()
+
+        # stop measuring a compute that was cancelled or terminated
+        Specs.endPeakRSS(self)
+        Segments.endCompute(self)
 
         # try to minimize leftover memory from the segmented array transfers
         # force cleanup of mmap
@@ -192,7 +257,26 @@ class GPIFunctor(QtCore.QObject):
             self.finished.emit(1) # validate error
             return
 
+        # MEMO
+        # an identical compute has already been done, reuse its outputs
+        # (the inputs of a fused node may only be placeholders)
+        self._memoKey = None
+        if self._macro is None:
+            self._memoKey = Memo.key(self._node)
+        if self._memoKey is not None:
+            outputs = Memo.lookup(self._memoKey, self._node)
+            if outputs is not None:
+                log.info("start(): Node \'"+str(self._title)+"\': reusing memoized outputs.")
+                for title, data in outputs.items():
+                    self._node.setData(title, data)
+                self._retcode = 0
+                self.finished.emit(self._retcode)
+                return
+
         # COMPUTE
+        if self._auto:
+            self._inBytes = Policy.inputBytes(self._node)
+
         if self._execType == GPI_PROCESS:
             log.debug("start(): buffer process parms")
             self._node._nodeIF.bufferParmSettings()
@@ -202,8 +286,37 @@ class GPIFunctor(QtCore.QObject):
             # and terminate within child process and cause a fork error.
             log.debug('start(): garbage collect before spawning GPI_PROCESS')
             gc.collect()
-            
+
+            # the process may write to the node's arena until it's applied
+            Segments.startCompute(self, self._node.getID())
+
+        else:
+            # process nodes measure their own peak
+            Specs.startPeakRSS(self)
+
         log.debug("start(): call task.start()")
+        try:
+            self._proc.start()
+        except (RuntimeError, OSError):
+            if not isinstance(self._proc, WTask):
+                raise
+            self.startWithoutPool()
+
+    def startWithoutPool(self):
+        # the warm worker couldn't be started, fork the compute instead (the
+        # members of a fused macro can't be, their inputs are in the worker)
+        if self._macro is not None:
+            log.error("start(): Node \'"+str(self._title)+"\': the fused macro's worker failed to start.\n"+str(traceback.format_exc()))
+            Segments.endCompute(self)
+            self._node.appendWallTime(time.time() - self._compute_start)
+            self.finished.emit(Return.ComputeError)
+            return
+
+        log.warn("start(): Node \'"+str(self._title)+"\': the warm worker failed to start, forking the compute instead.\n"+str(traceback.format_exc()))
+        self._proxy = ResultChannel()
+        self._proxy.handle('chunk', self.chunkArrived)
+        self._proc = PTask(self._func, self._title, self._label, self._proxy)
+        self._proc.finished.connect(self.computeFinished)
         self._proc.start()
 
     def wait(self):
@@ -221,76 +334,57 @@ class GPIFunctor(QtCore.QObject):
         # to a queue that is processed after compute()
         self._proc._proxy.append(item)
 
+    def keepData(self, title, data):
+        # only the worker of a fused macro keeps outport data (see FusedTask)
+        return False
+
+    def chunkArrived(self, item):
+        # ['chunk', title, chunk, index] from a GPI_PROCESS, on the GUI
+        # thread so it mustn't wait for the consumers
+        try:
+            self._node.chunkArrived(self._proxy, item)
+        except:
+            log.error("chunkArrived() failed. "+str(traceback.format_exc()))
+
     def computeTerminated(self):
         self.terminated.emit()
 
     def computeFinished(self):
-        if self._execType == GPI_PROCESS:
+        self._isReturned = True
+        if self.isCancelled():
+            self.computeCancelled()
+
+        elif self._execType == GPI_PROCESS:
             self.applyQueuedData()
 
         else:
             self._retcode = 0 # success
             if Return.isError(self._proc._retcode):
                 self._retcode = Return.ComputeError
+            self._cpuTime = self._proc._cpuTime
             self.finalMatter()
 
     def finalMatter(self):
-        log.info("computeFinished():Node \'"+str(self._title)+"\': compute time:"+str(time.time() - self._compute_start)+" sec.")
-        self._node.appendWallTime(time.time() - self._compute_start)
+        Segments.endCompute(self)
+        self._node.finishStreams(not Return.isError(self._retcode))
+        walltime = time.time() - self._compute_start
+        if self._execType != GPI_PROCESS:
+            # nothing is recorded if other nodes computed in this process
+            self._peakRSS = Specs.endPeakRSS(self) or 0
+        self._node.recordCompute(walltime, self._peakRSS, self._memoKey, self._retcode)
+        if self._auto and not Return.isError(self._retcode):
+            Policy.record(self._node, self._execType, walltime, self._cpuTime, self._inBytes, self._node.portMem())
         self.finished.emit(self._retcode) # success
 
     def applyQueuedData_setData(self):
+        # the outputs, set on the node as they would be by compute()
+        if not self._node.applyResultData(self._proxy):
+            self._retcode = Return.ComputeError
 
+        # the data stayed in the fused macro's worker
         for o in self._proxy:
-            try:
-                log.debug("applyQueuedData_setData(): apply object "+str(o[0])+', '+str(o[1]))
-                if o[0] == 'setData':
-                    # DataProxy is used for complex data types like numpy
-                    if type(o[2]) is DataProxy:
-
-                        # segmented types must be gathered before reassembly
-                        if o[2].isSegmented():
-                            log.debug("seg proxy is True")
-                            self._segmentedDataProxy = True
-                        else:
-                            log.debug("o[2].getData()")
-                            self._node.setData(o[1], o[2].getData())
-
-                    # all other simple types get set directly
-                    else:
-                        log.debug("direct setData()")
-                        self._node.setData(o[1], o[2])
-            except:
-                log.error("applyQueuedData() failed. "+str(traceback.format_exc()))
-                self._retcode = Return.ComputeError
-                self._setData_finished.emit()
-
-        # Assemble Segmented Data
-        if self._segmentedDataProxy:
-            log.warn("Using segmented data proxy...")
-            # group all segmented types
-            oportData = [ o for o in self._proxy if (o[0] == 'setData') and (type(o[2]) is DataProxy) ]
-            # take only those that are segmented
-            oportData = [ o for o in oportData if o[2].isSegmented() ]
-            # consolidate all outports with large data
-            largeports = set([ o[1] for o in oportData ])
-
-            for port in largeports:
-                log.info("applyQueuedData(): ------ APPENDING SEGMENTED PROXY OBJECTS")
-
-                # gather port segs
-                curport = [o for o in oportData if o[1] == port]
-
-                # gather all DataProxy segs
-                segs = [ o[2] for o in curport ]
-                buf = DataProxy().getDataFromSegments(segs)
-
-                # if the pieces fail to assemble move on
-                if buf is None:
-                    log.warn("applyQueuedData(): segmented proxy object failed to assemble, skipping...")
-                    continue
-
-                self._node.setData(port, buf)
+            if o[0] == 'keptData':
+                self._node.setData(o[1], placeholder(o[2], o[3]))
 
         # run self.applyQueuedData_finalMatter()
         self._setData_finished.emit()
@@ -307,23 +401,7 @@ class GPIFunctor(QtCore.QObject):
             self.computeTerminated()
             return
 
-        self._segmentedDataProxy = False
-        for o in self._proxy:
-            try:
-                log.debug("applyQueuedData(): apply object "+str(o[0])+', '+str(o[1]) )
-                if o[0] == 'retcode':
-                    self._retcode = o[1]
-                    if Return.isError(self._retcode):
-                        self._retcode = Return.ComputeError
-                    else:
-                        self._retcode = 0 # squash Nones
-                if o[0] == 'modifyWdg':
-                    self._node.modifyWdg(o[1], o[2])
-                if o[0] == 'setReQueue':
-                    self._node.setReQueue(o[1])
-            except:
-                log.error("applyQueuedData() failed. "+str(traceback.format_exc()))
-                self._retcode = Return.ComputeError
+        self._retcode, self._peakRSS, self._cpuTime = self._node.applyResults(self._proxy)
 
         # transfer all setData() calls to a thread
         log.debug("applyQueuedData(): run _applyData_thread")
@@ -337,7 +415,7 @@ class GPIFunctor(QtCore.QObject):
         elapsed = (time.time() - self._ap_st_time)
         log.info("applyQueuedData(): time (total queue): "+str(elapsed)+" sec")
 
-        # shutdown the proxy manager
+        # close the result pipe
         self.cleanup()
 
         # start self.finalMatter
@@ -345,10 +423,11 @@ class GPIFunctor(QtCore.QObject):
 
 
 class PTask(multiprocessing_context.Process, QtCore.QObject):
-    '''A forked process node task. Memmaps are used to communicate data.
+    '''A forked process node task. Results are sent back on a ResultChannel,
+    large arrays through memmaps.
 
-    NOTE: The process-type has to be checked periodically to see if its alive,
-    from the spawning process.
+    NOTE: The spawning process is woken by the event loop when results arrive
+    on the channel or when the process sentinel signals that it has exited.
     '''
 
     finished = gpi.Signal()
@@ -362,16 +441,14 @@ class PTask(multiprocessing_context.Process, QtCore.QObject):
         self._label = label
         self._proxy = proxy
         self._cnt = 0
-
-        # Since we don't know when the process finishes
-        # probe at regular intervals.
-        # -it would be nicer to have the process check-in with the GPI
-        #  main proc when its done.
-        self._timer = QtCore.QTimer()
-        self._timer.timeout.connect(self.checkProcess)
-        self._timer.start(10)  # 10msec update
+        self._dataNotifier = None
+        self._exitNotifier = None
 
     def run(self):
+        Specs.resetPeakRSS()
+        rss = Specs.RSS()
+        cpu = time.thread_time()
+
         # This try/except is only good for catching compute() exceptions
         # not run() terminations.
         try:
@@ -379,9 +456,28 @@ class PTask(multiprocessing_context.Process, QtCore.QObject):
         except:
             log.error('PROCESS: \''+str(self._title)+'\':\''+str(self._label)+'\' compute() failed.\n'+str(traceback.format_exc()))
             self._proxy.append(['retcode', Return.ComputeError])
+        self._proxy.append(['peakRSS', max(0, Specs.peakRSS() - rss)])
+        self._proxy.append(['cpuTime', time.thread_time() - cpu])
+        Segments.releaseUnsent()
+
+    def start(self):
+        super(PTask, self).start()
+        self._proxy.closeWriter()
+
+        # the sentinel becomes readable when the process exits
+        self._dataNotifier = WatchFd(self._proxy.fileno(), self.readResults)
+        self._exitNotifier = WatchFd(self.sentinel, self.checkProcess)
+
+    def stopWatching(self):
+        if self._dataNotifier is not None:
+            UnwatchFd(self._dataNotifier)
+            self._dataNotifier = None
+        if self._exitNotifier is not None:
+            UnwatchFd(self._exitNotifier)
+            self._exitNotifier = None
 
     def terminate(self):
-        self._timer.stop()
+        self.stopWatching()
         super(PTask, self).terminate()
 
     def wait(self):
@@ -396,11 +492,18 @@ class PTask(multiprocessing_context.Process, QtCore.QObject):
                 return True
         return False
 
-    def checkProcess(self):
-        if self.is_alive():
-            return
-        # else if its not alive:
-        self._timer.stop()
+    def readResults(self, *args):
+        # keep the pipe clear so the process doesn't block on a full buffer
+        self._proxy.drain()
+        if self._proxy.isClosed() and (self._dataNotifier is not None):
+            UnwatchFd(self._dataNotifier)
+            self._dataNotifier = None
+
+    def checkProcess(self, *args):
+        self.stopWatching()
+        self.join()
+        # everything the process sent is already in the pipe
+        self._proxy.drain()
         if self.retcodeExists():
             # we assume its termination was deliberate.
             self.finished.emit()
@@ -408,6 +511,75 @@ class PTask(multiprocessing_context.Process, QtCore.QObject):
             self.terminated.emit()
 
 
+class WTask(QtCore.QObject):
+    '''A process node task that runs on the node's warm worker from the
+    WorkerPool instead of a new fork (or on its macro's worker if the macro
+    is fused).  The worker stays alive, so its 'done' message marks the end
+    of compute() and its sentinel is only watched for crashes.
+    '''
+
+    finished = gpi.Signal()
+    terminated = gpi.Signal()
+
+    def __init__(self, node, title, label, proxy, macro=None):
+        super(WTask, self).__init__()
+        self._node = node
+        self._title = title
+        self._label = label
+        self._proxy = proxy
+        self._macro = macro
+        self._worker = None
+        self._notifiers = []
+
+    def start(self):
+        self._worker = Pool.dispatch(self._node, self._proxy, self._macro)
+        self._notifiers = [WatchFd(self._proxy.fileno(), self.checkProcess),
+                           WatchFd(self._worker.sentinel(), self.checkProcess)]
+
+    def stopWatching(self):
+        for notifier in self._notifiers:
+            UnwatchFd(notifier)
+        self._notifiers = []
+
+    def terminate(self):
+        # kill the worker along with its compute, the next compute forks a new one
+        self.stopWatching()
+        Pool.release(self._node)
+
+    def cancel(self):
+        self._worker.cancel()
+
+    def wait(self):
+        while self.isRunning():
+            time.sleep(0.01)
+
+    def isRunning(self):
+        return (self._worker is not None) and self._worker.isBusy() and self._worker.isAlive()
+
+    def retcodeExists(self):
+        for o in self._proxy:
+            if o[0] == 'retcode':
+                return True
+        return False
+
+    def checkProcess(self, *args):
+        status = self._worker.poll(self._proxy)
+        if status is None:
+            return
+        self.stopWatching()
+        if status == 'done':
+            self.finished.emit()
+            return
+
+        # the worker died
+        log.warn("WTask: worker for '"+str(self._title)+"' exited during compute().")
+        Pool.release(self._node)
+        if self.retcodeExists():
+            self.finished.emit()
+        else:
+            self.terminated.emit()
+
+
 class TTask(QtCore.QThread):
     '''A QThread based node runner.  Data is communicated directly.
 
@@ -423,6 +595,7 @@ class TTask(QtCore.QThread):
         self._label = label
         self._proxy = proxy
         self._retcode = None
+        self._cpuTime = 0
 
         # allow thread to terminate immediately
         # NOTE: doesn't seem to work
@@ -437,12 +610,14 @@ class TTask(QtCore.QThread):
     def run(self):
         # This try/except is only good for catching compute() exceptions
         # not run() terminations.
+        cpu = time.thread_time()
         try:
             self._retcode = self._func()
             log.info("TTask _func() finished")
         except:
             log.error('THREAD: \''+str(self._title)+'\':\''+str(self._label)+'\' compute() failed.\n'+str(traceback.format_exc()))
             self._retcode = Return.ComputeError
+        self._cpuTime = time.thread_time() - cpu
 
 
 class ATask(QtCore.QObject):
@@ -463,15 +638,18 @@ class ATask(QtCore.QObject):
         self._label = label
         self._proxy = proxy
         self._cnt = 0
+        self._cpuTime = 0
 
     def run(self):
         # This try/except is only good for catching compute() exceptions
         # not run() terminations.
+        cpu = time.thread_time()
         try:
             self._retcode = self._func()
         except:
             log.error('APPLOOP: \''+str(self._title)+'\':\''+str(self._label)+'\' compute() failed.\n'+str(traceback.format_exc()))
             self._retcode = Return.ComputeError
+        self._cpuTime = time.thread_time() - cpu
 
     def terminate(self):
         pass  # can't happen b/c blocking mainloop
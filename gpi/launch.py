@@ -37,8 +37,15 @@ if sys.platform == 'darwin':
 # gpi
 from gpi import QtGui, QtWidgets, QtCore, Signal
 from gpi.cmd import Commands
+from gpi.config import Config
+from gpi.dataproxy import Segments
 from gpi.defines import PLOGO_PATH, ICON_PATH
+from gpi.logger import manager
 from gpi.mainWindow import MainCanvas
+from gpi.sysspecs import Specs
+
+# start logger for this module
+log = manager.getLogger(__name__)
 
 INCLUDE_EULA=False
 
@@ -166,10 +173,85 @@ THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
         # tell Qt to quit right away.
         QtCore.QCoreApplication.instance().quit()
 
+def loadHeadless():
+    '''Loads the command-line networks into a headless engine.  Returns None
+    if a network fails to load.'''
+    from gpi.engine import Engine
+
+    if Commands.modCount() or Commands.fileCount():
+        log.warn('--nogui only runs networks, the other files are skipped.')
+
+    engine = Engine()
+    for path in Commands.nets():
+        if not engine.loadNetwork(path):
+            log.error('\''+str(path)+'\' failed to load, exiting.')
+            return None
+    engine.setStringArgs(dict([(lab, Commands.stringNodeArg(lab)) for lab in Commands.stringNodeLabels()]))
+    return engine
+
+def jobCount():
+    # the cmd-line takes precedence over the config file
+    jobs = Commands.jobs()
+    if jobs is None:
+        return Config.JOBS
+    if jobs == 0:
+        return max(1, Specs.NUM_CPUS())
+    return jobs
+
+def runHeadless():
+    '''Runs the command-line networks on the headless engine.  Returns the
+    exit code.'''
+    engine = loadHeadless()
+    if engine is None:
+        return 1
+    engine.setMaxJobs(jobCount())
+    return engine.run()
+
+def runBatch():
+    '''Runs the command-line networks once for each case in the --batch
+    manifest.  Returns the exit code.'''
+    from gpi.batch import BatchRunner, readManifest
+
+    cases = readManifest(Commands.batch())
+    if cases is None:
+        return 1
+    engine = loadHeadless()
+    if engine is None:
+        return 1
+
+    # the cases run in parallel, the nodes of each case one at a time
+    runner = BatchRunner(engine, jobCount(), Commands.timeout())
+    retcode = runner.run(cases)
+    if Commands.summary():
+        if not runner.writeSummary(Commands.summary()):
+            return 1
+    else:
+        log.dialog('Batch Summary:\n'+runner.summary())
+    return retcode
+
+def runServer():
+    '''Keeps the command-line networks loaded and runs the jobs sent to the
+    --serve socket.  Returns the exit code.'''
+    from gpi.server import GPIServer
+
+    if Commands.modCount() or Commands.fileCount():
+        log.warn('--serve only runs networks, the other files are skipped.')
+
+    server = GPIServer(Commands.serve())
+    for path in Commands.nets():
+        if not server.loadNetwork(path):
+            log.error('\''+str(path)+'\' failed to load, exiting.')
+            return 1
+    return server.serve()
+
 def launch():
     '''Starts the main application loop, parses any user config and commandline
     args.'''
 
+    # the node menus are still widgets, but headless runs never show them
+    if Commands.headless(sys.argv):
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
     # start main application
     # for debugging force widgetcount
     #app = QtWidgets.QApplication(sys.argv+['-widgetcount'])
@@ -185,6 +267,17 @@ def launch():
         Commands.parse(app.arguments())
     #print Commands
 
+    # free the shared memory of sessions that didn't exit cleanly
+    Segments.reclaimOrphans()
+
+    # run the networks without a canvas or event loop
+    if Commands.batch():
+        sys.exit(runBatch())
+    if Commands.serve():
+        sys.exit(runServer())
+    if Commands.noGUI():
+        sys.exit(runHeadless())
+
     # start a mainwindow widget instance
     widget = MainCanvas()
 
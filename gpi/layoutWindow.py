@@ -282,6 +282,19 @@ class LayoutMaster(QtWidgets.QWidget):
             labelGroup.setToolTip(
                 "Displays the Label on the Canvas (Double Click)")
 
+        if self._isMacroWdg:
+            # run the collapsed macro's process nodes in one worker
+            self.wdgfuse = QtWidgets.QCheckBox('Run nodes in one process')
+            fuseGroup = HidableGroupBox("Execution")
+            fuseLayout = QtWidgets.QVBoxLayout()
+            fuseLayout.addWidget(self.wdgfuse)
+            fuseGroup.setLayout(fuseLayout)
+            hbox.addWidget(fuseGroup)
+            fuseGroup.set_collapsed(True)
+            fuseGroup.setToolTip(
+                "While the macro is collapsed, its process nodes share one\n"
+                "worker and the data passed between them stays in it.")
+
         self.setLayout(hbox)
 
     def getSettings(self):
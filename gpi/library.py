@@ -377,7 +377,7 @@ class Library(object):
     drop or menu contexts.
     '''
 
-    def __init__(self, parent):
+    def __init__(self, parent, menus=True):
         self._parent = parent  # must be a Qt parent for signalling
         self._known_GPI_nodes = Catalog()  # list of all modules within each lib
         self._known_GPI_networks = Catalog()  # all networks in each lib
@@ -385,15 +385,19 @@ class Library(object):
         self.extTypes = dict()
         self._listwdg = None  # for searching node list
 
-        self.generateNewNodeListWindow()
+        # the headless engine only needs the catalogs
+        self._menus = menus
+        if self._menus:
+            self.generateNewNodeListWindow()
 
         self._lib_menus = {}  # third level menu (holds second lev list)
         self._lib_second = {}  # second level menu (holds node list)
         self._lib_menu = []  # third level menu list
 
         self.scanGPIModulesIn_LibraryPath(recursion_depth=3)
-        self.generateLibMenus()
-        self.generateNewNodeList()
+        if self._menus:
+            self.generateLibMenus()
+            self.generateNewNodeList()
 
     def showNewNodeListWindow(self):
         self._list_win.show()
@@ -29,12 +29,14 @@ from gpi import QtCore, QtGui, QtWidgets
 # gpi
 from .defaultTypes import GPITYPE_PASS
 from .defines import MacroNodeEdgeType, EdgeNodeType, PortEdgeType, GPI_APPLOOP
+from .defines import GPI_REQUEUE_EVENT
 from .defines import printMouseEvent, getKeyboardModifiers, OPTIONAL
 from .defines import isMacroChildNode
 from .layoutWindow import LayoutMaster
 from .logger import manager
 from .nodeAPI import NodeAPI
 from .node import Node, node_font
+from .workerPool import Pool, isPlaceholder
 
 # start logger for this module
 log = manager.getLogger(__name__)
@@ -491,6 +493,9 @@ class MacroNode(object):
         # for load/paste
         self._destined_collapse = False
 
+        # run the process nodes in one worker while collapsed
+        self._fused = False
+
         # connected node groups
         self._src_cn = []
         self._sink_cn = []
@@ -538,6 +543,7 @@ class MacroNode(object):
         s['id'] = self.getID()
         s['label'] = self._label
         s['collapse'] = self.isCollapsed()
+        s['fused'] = self.isFused()
         s['layoutWindow'] = self._layoutWindow.getSettings()
 
         s['src_settings'] = self._src.getSettings()
@@ -575,6 +581,7 @@ class MacroNode(object):
         self.setLabel(s['label'])
 
         self.newLayoutWindowFromSettings(s['layoutWindow'], nodeList)
+        self.setFusedWdg(s.get('fused', False))
 
         if s['collapse']:
             x = s['face_settings']['pos'][0] + pos[0]
@@ -751,6 +758,7 @@ class MacroNode(object):
         layoutwindow.loadSettings(s, nodeList)
         layoutwindow.setWindowTitle('Macro')
         layoutwindow.wdglabel.textChanged.connect(self.setLabel)
+        layoutwindow.wdgfuse.toggled.connect(self.setFused)
 
         self._scrollArea_layoutWindow = QtWidgets.QScrollArea()
         self._scrollArea_layoutWindow.setWidget(layoutwindow)
@@ -767,6 +775,7 @@ class MacroNode(object):
         layoutwindow = LayoutMaster(self._graph, config=config, macro=True, labelWin=True)
         layoutwindow.setWindowTitle('Macro')
         layoutwindow.wdglabel.textChanged.connect(self.setLabel)
+        layoutwindow.wdgfuse.toggled.connect(self.setFused)
 
         self._scrollArea_layoutWindow = QtWidgets.QScrollArea()
         self._scrollArea_layoutWindow.setWidget(layoutwindow)
@@ -797,6 +806,36 @@ class MacroNode(object):
         '''
         self._layoutWindow.wdglabel.setText(lab)
 
+    def setFused(self, val):
+        '''Run the encapsulated process nodes in one worker while the macro is
+        collapsed.
+        '''
+        val = bool(val)
+        if val == self._fused:
+            return
+        self._fused = val
+        if not val:
+            self.releaseWorker()
+
+    def setFusedWdg(self, val):
+        self._layoutWindow.wdgfuse.setChecked(val)
+
+    def isFused(self):
+        return self._fused
+
+    def releaseWorker(self):
+        '''Stop the macro's worker.  The nodes with outputs that were only
+        kept in the worker are computed again.
+        '''
+        stale = [n for n in self._encap_nodes if any([isPlaceholder(p.data) for p in n.outportList])]
+        for node in self._encap_nodes:
+            Pool.release(node)
+
+        for node in stale:
+            node.setEventStatus({GPI_REQUEUE_EVENT: None})
+        if stale and self._graph.inIdleState():
+            self._graph._switchSig.emit('check')
+
     def getEncapsulatedNodes(self):
         return self._encap_nodes
 
@@ -1153,6 +1192,10 @@ class MacroNode(object):
 
     def expandMacro(self):
 
+        # the nodes only share a worker while collapsed
+        if self.isFused():
+            self.releaseWorker()
+
         # before expansion save the face position for load/paste purposes
         self._face_colpos = self._face.getPos()
 
@@ -202,6 +202,8 @@ class MainCanvas(QtWidgets.QMainWindow):
             msg = curState['title']+": "+curState['msg']  # base message
             if 'walltime' in curState:
                 msg += ' (Elapsed: '+ str(curState['walltime']) +')'
+            if 'predicted' in curState:
+                msg += ' (Predicted: '+ str(curState['predicted']) +')'
             self._statusLabel.setText(msg)  # quickly show this incase mem calc is too long
 
             # only do this calc if in Idle
@@ -0,0 +1,395 @@
+#    Copyright (C) 2014  Dignity Health
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL PURPOSES
+#    AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+#    SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+#    PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+#    USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT
+#    LIMITED TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR
+#    MAKES NO WARRANTY AND HAS NO LIABILITY ARISING FROM ANY USE OF THE
+#    SOFTWARE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+
+'''Memoization of node outputs.
+
+A compute() is identified by a digest of the source file defining the node,
+its widget settings and a fingerprint of the data at each of its inports.
+When the same compute comes up again the outport data it produced is set
+directly instead of running compute().  Outputs are held in memory (Memo)
+and, to be reused by later sessions, in a directory on disk (Disk).
+'''
+
+import os
+import sys
+import pickle
+import shutil
+import hashlib
+import inspect
+import weakref
+import tempfile
+import collections
+import numpy as np
+
+from .cmd import Commands
+from .logger import manager
+
+# start logger for this module
+log = manager.getLogger(__name__)
+
+# the file in each disk cache entry that maps port titles to data files
+DISK_INDEX_FILE = 'index.pickle'
+
+
+def _nbytes(data):
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    return sys.getsizeof(data)
+
+
+class MemoEntry(object):
+    '''The outport data from one compute.'''
+
+    def __init__(self, nodeClass, outputs):
+        self.nodeClass = nodeClass  # the node definition that made them
+        self.outputs = outputs  # {port title: data}
+        self.nbytes = sum([_nbytes(d) for d in outputs.values()])
+
+
+class MemoCache(object):
+    '''An LRU of node outputs, limited by the total bytes held.'''
+
+    def __init__(self):
+        self._db = collections.OrderedDict()  # key: MemoEntry
+        self._nbytes = 0
+        self._maxBytes = None
+        self._hits = 0
+        self._misses = 0
+
+        # fingerprints of read-only arrays that own their data, by identity
+        self._fingerprints = {}  # id: (weakref, digest)
+
+        # digests of node source files
+        self._codeHashes = {}  # (path, mtime, class name): digest
+
+    def __str__(self):
+        msg = 'MemoCache: '+str(len(self._db))+' entries, '
+        msg += str(self._nbytes)+' of '+str(self.maxBytes())+' bytes, '
+        msg += str(self._hits)+' hits, '+str(self._misses)+' misses'
+        return msg
+
+    def maxBytes(self):
+        if self._maxBytes is None:
+            from .config import Config
+            self._maxBytes = Config.MEMO_SIZE
+        return self._maxBytes
+
+    def setMaxBytes(self, val):
+        self._maxBytes = max(0, int(val))
+        self.trim()
+
+    def enabled(self):
+        return self.maxBytes() > 0
+
+    def clear(self):
+        self._db.clear()
+        self._nbytes = 0
+
+    def fingerprint(self, data):
+        '''A digest of the data content.  Raises an exception if the data
+        can't be serialized.
+        '''
+        if isinstance(data, np.ndarray):
+            # read-only arrays that own their data can't change, so they're
+            # only hashed once
+            frozen = self.frozen(data)
+            if frozen:
+                fp = self._fingerprints.get(id(data))
+                if (fp is not None) and (fp[0]() is data):
+                    return fp[1]
+
+            h = hashlib.blake2b(digest_size=16)
+            h.update(str((type(data), data.dtype.str, data.shape)).encode())
+            h.update(np.ascontiguousarray(data).data)
+            digest = h.digest()
+
+            if frozen:
+                i = id(data)
+                ref = weakref.ref(data, lambda r: self._fingerprints.pop(i, None))
+                self._fingerprints[i] = (ref, digest)
+            return digest
+
+        return hashlib.blake2b(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), digest_size=16).digest()
+
+    @staticmethod
+    def frozen(data):
+        # A read-only view can still change through a writable base, and
+        # memmaps and shared memory segments can be rewritten by another
+        # process, so the whole chain must be read-only arrays.
+        while isinstance(data, np.ndarray) and not data.flags.writeable:
+            if data.base is None:
+                return True
+            data = data.base
+        return False
+
+    def codeHash(self, cls):
+        '''A digest of the source file that defines the node class.  Changes
+        to other modules the node imports are not detected.
+        '''
+        path = inspect.getsourcefile(cls) or inspect.getfile(cls)
+        stamp = (path, os.path.getmtime(path), cls.__qualname__)
+        digest = self._codeHashes.get(stamp)
+        if digest is None:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(cls.__qualname__.encode())
+            with open(path, 'rb') as f:
+                h.update(f.read())
+            digest = h.digest()
+            self._codeHashes[stamp] = digest
+        return digest
+
+    def key(self, node):
+        '''The memo key for the node's next compute, or None if the node
+        can't be memoized.
+        '''
+        if Commands.noCache() or not (self.enabled() or Disk.enabled()):
+            return None
+        nodeIF = node._nodeIF
+        if not nodeIF.memoize():
+            return None
+
+        try:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(self.codeHash(type(nodeIF)))
+            h.update(pickle.dumps(nodeIF.getSettings()['parms'], protocol=pickle.HIGHEST_PROTOCOL))
+            for port in node.inportList:
+                h.update(port.portTitle.encode())
+                h.update(self.fingerprint(port.getUpstreamData()))
+            return h.hexdigest()
+        except Exception as e:
+            log.debug('key(): '+str(node.getName())+' can\'t be memoized: '+str(e))
+            return None
+
+    def lookup(self, key, node):
+        '''Returns the memoized {port title: data} or None.'''
+        entry = self._db.get(key)
+        if (entry is not None) and (entry.nodeClass is type(node._nodeIF)):
+            self._hits += 1
+            self._db.move_to_end(key)
+            return entry.outputs
+
+        if Disk.enabled():
+            outputs = Disk.lookup(key)
+            if outputs is not None:
+                self._hits += 1
+                return outputs
+
+        self._misses += 1
+        return None
+
+    def store(self, key, node):
+        '''Save the data set on the node's outports by the last compute.'''
+        outputs = {}
+        for port in node.outportList:
+            if port.dataHasChanged():
+                outputs[port.portTitle] = port.data
+
+        if Disk.enabled():
+            Disk.store(key, outputs)
+
+        if not self.enabled():
+            return
+        entry = MemoEntry(type(node._nodeIF), outputs)
+        if entry.nbytes > self.maxBytes():
+            return
+
+        old = self._db.pop(key, None)
+        if old is not None:
+            self._nbytes -= old.nbytes
+        self._db[key] = entry
+        self._nbytes += entry.nbytes
+        self.trim()
+
+    def trim(self):
+        while (self._nbytes > self.maxBytes()) and len(self._db):
+            key, entry = self._db.popitem(last=False)
+            self._nbytes -= entry.nbytes
+
+
+
+class DiskCache(object):
+    '''Node outputs kept in a directory so they can be reused by later
+    sessions, limited by the total bytes on disk.
+
+    Each entry is a sub-directory named by its memo key that holds an index
+    of the outport titles and a file for each output.  Arrays are saved as
+    .npy files and memory-mapped (read-only) when they are loaded, other data
+    is pickled.  An entry's mtime is updated when it is used, so the least
+    recently used entries can be deleted first.
+    '''
+
+    def __init__(self):
+        self._path = None
+        self._maxBytes = None
+        self._entries = None  # key: bytes on disk, oldest first
+        self._nbytes = 0
+
+    def __str__(self):
+        self.scan()
+        msg = 'DiskCache: '+str(self.path())+', '+str(len(self._entries))+' entries, '
+        msg += str(self._nbytes)+' of '+str(self.maxBytes())+' bytes'
+        return msg
+
+    def path(self):
+        if self._path is None:
+            from .config import Config
+            self._path = Config.DISK_CACHE_DIR
+        return self._path
+
+    def maxBytes(self):
+        if self._maxBytes is None:
+            from .config import Config
+            self._maxBytes = Config.DISK_CACHE_SIZE
+        return self._maxBytes
+
+    def setMaxBytes(self, val):
+        self._maxBytes = max(0, int(val))
+        self.trim()
+
+    def enabled(self):
+        return self.maxBytes() > 0
+
+    @staticmethod
+    def isKey(name):
+        try:
+            return (len(name) == 32) and (int(name, 16) >= 0)
+        except ValueError:
+            return False
+
+    @staticmethod
+    def diskUsage(path):
+        return sum([os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)])
+
+    def scan(self):
+        '''Read the existing entries from the cache directory, once.'''
+        if self._entries is not None:
+            return
+        self._entries = collections.OrderedDict()
+        self._nbytes = 0
+
+        found = []
+        if os.path.isdir(self.path()):
+            for name in os.listdir(self.path()):
+                entry = os.path.join(self.path(), name)
+                if not (self.isKey(name) and os.path.isdir(entry)):
+                    continue
+                try:
+                    found.append((os.path.getmtime(entry), name, self.diskUsage(entry)))
+                except OSError:
+                    pass
+
+        for mtime, key, nbytes in sorted(found):
+            self._entries[key] = nbytes
+            self._nbytes += nbytes
+        log.debug('scan(): '+str(self))
+
+    def lookup(self, key):
+        '''Returns the cached {port title: data} or None.'''
+        self.scan()
+        if key not in self._entries:
+            return None
+
+        entry = os.path.join(self.path(), key)
+        try:
+            with open(os.path.join(entry, DISK_INDEX_FILE), 'rb') as f:
+                index = pickle.load(f)
+            outputs = {}
+            for title, fn in index.items():
+                fn = os.path.join(entry, fn)
+                if fn.endswith('.npy'):
+                    outputs[title] = np.load(fn, mmap_mode='r', allow_pickle=False)
+                else:
+                    with open(fn, 'rb') as f:
+                        outputs[title] = pickle.load(f)
+            os.utime(entry)
+        except Exception as e:
+            # e.g. removed by another session
+            log.warn('lookup(): disk cache entry '+str(key)+' can\'t be read, removing it: '+str(e))
+            self.remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return outputs
+
+    def store(self, key, outputs):
+        '''Write the given {port title: data} as a new entry.'''
+        self.scan()
+        if key in self._entries:
+            return
+
+        # the entry is written in a temporary dir, then moved into place so
+        # other sessions never see a partial entry.
+        tmp = None
+        try:
+            os.makedirs(self.path(), exist_ok=True)
+            tmp = tempfile.mkdtemp(prefix='.'+key+'-', dir=self.path())
+            index = {}
+            for i, (title, data) in enumerate(outputs.items()):
+                if (type(data) is np.ndarray) and (data.nbytes > 0) and not data.dtype.hasobject:
+                    fn = str(i)+'.npy'
+                    np.save(os.path.join(tmp, fn), data, allow_pickle=False)
+                else:
+                    fn = str(i)+'.pickle'
+                    with open(os.path.join(tmp, fn), 'wb') as f:
+                        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+                index[title] = fn
+            with open(os.path.join(tmp, DISK_INDEX_FILE), 'wb') as f:
+                pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            nbytes = self.diskUsage(tmp)
+            if nbytes > self.maxBytes():
+                shutil.rmtree(tmp, ignore_errors=True)
+                return
+            os.rename(tmp, os.path.join(self.path(), key))
+        except Exception as e:
+            log.warn('store(): node outputs could not be written to the disk cache: '+str(e))
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        self._entries[key] = nbytes
+        self._nbytes += nbytes
+        self.trim()
+
+    def remove(self, key):
+        self._nbytes -= self._entries.pop(key, 0)
+        shutil.rmtree(os.path.join(self.path(), key), ignore_errors=True)
+
+    def trim(self):
+        self.scan()
+        while (self._nbytes > self.maxBytes()) and len(self._entries):
+            self.remove(next(iter(self._entries)))
+
+    def clear(self):
+        '''Delete all entries, including those left by other sessions.'''
+        if os.path.isdir(self.path()):
+            for name in os.listdir(self.path()):
+                if self.isKey(name) or (name.startswith('.') and self.isKey(name[1:33])):
+                    shutil.rmtree(os.path.join(self.path(), name), ignore_errors=True)
+        log.dialog('Cleared the disk cache: '+str(self.path()))
+        self._entries = collections.OrderedDict()
+        self._nbytes = 0
+
+Memo = MemoCache()
+Disk = DiskCache()
@@ -287,6 +287,9 @@ class Network_v2(Network_Base):
         if 'WALLTIME' in self._contents:
             msg += '\twall time: '+str(GetHumanReadable_time(float(self._contents['WALLTIME']))) + '\n'
 
+        if 'PREDICTED_WALLTIME' in self._contents:
+            msg += '\tpredicted wall time: '+str(GetHumanReadable_time(float(self._contents['PREDICTED_WALLTIME']))) + '\n'
+
         if 'TOTAL_PMEM' in self._contents:
             msg += '\ttotal port mem: '+str(GetHumanReadable_bytes(int(self._contents['TOTAL_PMEM']))) + '\n'
 
@@ -65,27 +65,27 @@
 #############################################################################
 
 import os
-import sys
 import copy
-import math
 import inspect
 import traceback
 import subprocess
-import numpy as np
 
 
 # gpi
 import gpi
 from gpi import QtCore, QtGui, QtWidgets
-from .defaultTypes import GPIDefaultType
-from .defines import NodeTYPE, GPI_APPLOOP, REQUIRED, GPI_SHDM_PATH
-from .defines import GPI_WIDGET_EVENT, GPI_PORT_EVENT, GPI_INIT_EVENT, GPI_REQUEUE_EVENT
-from .defines import printMouseEvent, getKeyboardModifiers, stw, Cl
+from .defines import NodeTYPE, GPI_APPLOOP, GPI_PROCESS, REQUIRED, GPI_SHDM_PATH
+from .defines import GPI_REQUEUE_EVENT
+from .defines import printMouseEvent, getKeyboardModifiers, Cl
 from .defines import GetHumanReadable_bytes, GetHumanReadable_time
 from .logger import manager
 from .port import InPort, OutPort
 from .stateMachine import GPI_FSM, GPIState
+from .engine import EventManager, NodeState
+from .execPolicy import Policy, EXEC_NAMES
 from .functor import GPIFunctor, Return
+from .workerPool import Pool
+from .dataproxy import Segments
 from .sysspecs import Specs
 
 # start logger for this module
@@ -125,60 +125,6 @@ class TimerPack(object):
         self._ON.start()
 
 
-# Event Manager
-class EventManager(object):
-    '''Stores new events (without duplicates) in a timely manner.'''
-
-    def __init__(self):
-        self._wdg_events = set()  # holds wdg names
-        self._port_events = set()  # port names
-        self._init_event = False  # bool
-        self._requeue_event = False  # bool
-
-    def addWidgetEvent(self, e):
-        self._wdg_events.add(e)
-
-    def addPortEvent(self, e):
-        self._port_events.add(e)
-
-    def setInitEvent(self):
-        self._init_event = True
-
-    def setRequeueEvent(self):
-        self._requeue_event = True
-
-    @property
-    def widget(self):
-        return self._wdg_events
-
-    @property
-    def port(self):
-        return self._port_events
-
-    @property
-    def init(self):
-        return self._init_event
-
-    @property
-    def requeue(self):
-        return self._requeue_event
-
-    @property
-    def events(self):
-        o = {}
-        o[GPI_WIDGET_EVENT] = self._wdg_events
-        o[GPI_PORT_EVENT] = self._port_events
-        o[GPI_INIT_EVENT] = self._init_event
-        o[GPI_REQUEUE_EVENT] = self._requeue_event
-        return o
-
-    def __str__(self):
-        msg = 'widgets: '+str(self._wdg_events)+'\n'
-        msg += 'ports: '+str(self._port_events)+'\n'
-        msg += 'init: '+str(self._init_event)+'\n'
-        msg += 'requeue: '+str(self._requeue_event)
-        return msg
-
 class NodeEvent(object):
     def __init__(self):
         self._status = None
@@ -247,7 +193,7 @@ class NodeAppearance(object):
                 return pt-1
 
 
-class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
+class Node(NodeState, QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
     '''The graphics and execution manager for individual nodes.
     '''
 
@@ -297,6 +243,13 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
 
         self.nodeCompute_thread = None
         self._computeDuration = []
+        self._computeMemory = []  # (output bytes, peak rss bytes)
+
+        # recomputing released memsaver data, downstream nodes aren't signaled
+        self._restoring = False
+
+        # outport title: ChunkStream, while compute() emits chunks
+        self._streams = {}
 
         self.initStateMachine()
 
@@ -492,6 +445,7 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
         # compute
         self._computeState.addTransition('c_error', self._computeErrorState)
         self._computeState.addTransition('next', self._post_compState)
+        self._computeState.addTransition('cancel', self._chkInPortsState)
         self._computeState.addTransition('disable', self._disabledState)
 
         # post_compute
@@ -530,6 +484,8 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
         self.printCurState()
         self._curState.emit('Idle ('+str(sig)+')')
         self.forceUpdate_NodeUI()
+        if sig == 'finished' or sig == 'ignore':
+            self.releaseUpstreamData()
         self.debounceUISignals(sig)
 
     def debounceUISignals(self, sig):
@@ -553,6 +509,7 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
                 self._switchSig.emit('compute')
             else:
                 log.debug(" ->ignore")
+                self.endRestore()
                 self._switchSig.emit('ignore')
         except:
             log.error("chkInPortsRun(): Failed")
@@ -589,12 +546,28 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
     def errorSigEmit(self):
         self._switchSig.emit('c_error')
 
+    def cancelSigEmit(self):
+        # the superseded compute has stopped, start over with the newer events
+        # (they're real events, so the outputs signal downstream nodes), and
+        # the events the cancelled compute was given, which it didn't finish
+        self._restoring = False
+        if self._events_handoff is not None:
+            self._events.merge(self._events_handoff)
+        self.setEventStatus(None)
+        self._switchSig.emit('cancel')
+
+    def supersedeCompute(self):
+        '''Cancel the running compute after a newer event, the node computes
+        again as soon as it has stopped.
+        '''
+        if (self._computeState is self.getCurState()) and self.nodeCompute_thread:
+            self.nodeCompute_thread.cancel()
+
     def computeRun(self, sig):
         self.printCurState()
         self._curState.emit('Compute ('+str(sig)+')')
 
         try:
-            self.forceUpdate_NodeUI()
             self.resetOutportStatus()  # changes color, allows 'change' to be determined
 
             # setup a new functor for either GPI_THREAD, GPI_PROCESS, or GPI_APPLOOP
@@ -603,6 +576,13 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
             self.nodeCompute_thread = GPIFunctor(self)
             self.nodeCompute_thread.finished.connect(self.nextSigEmit)  # -> post_computeRun()
             self.nodeCompute_thread.terminated.connect(self.errorSigEmit)
+            self.nodeCompute_thread.cancelled.connect(self.cancelSigEmit)  # -> chkInPortsRun()
+            self.forceUpdate_NodeUI()  # once the exec type is chosen
+
+            # new widget values can supersede a compute that runs in the
+            # background
+            if self.nodeCompute_thread.execType() != GPI_APPLOOP:
+                self._nodeIF.blockWdgSignals(False)
 
             self._progress_was_on = False
             self._progress_timer.start()
@@ -617,6 +597,7 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
     def post_computeRun(self, sig):
         self.printCurState()
         self._curState.emit('Post Compute ('+str(sig)+')')
+        self.endRestore()
         try:
             self._nodeIF.post_compute_widget_update()
             self.setWidgetOutports()
@@ -649,6 +630,7 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
 
     def computeErrorRun(self, sig):
         self.printCurState()
+        self.endRestore()
         self.graph._switchSig.emit('pause')  # move canvas to a paused state to let users fix the problem
         self._curState.emit('Compute Error ('+str(sig)+')')
         self.forceUpdate_NodeUI()
@@ -656,6 +638,7 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
 
     def validateErrorRun(self, sig):
         self.printCurState()
+        self.endRestore()
         self.graph._switchSig.emit('pause')  # move canvas to a paused state to let users fix the problem
         self._curState.emit('Validate Error ('+str(sig)+')')
         self.forceUpdate_NodeUI()
@@ -716,9 +699,6 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
             and (not self.inDisabledState()) \
             and (not self.inInitUIErrorState())
 
-    def isReady(self):
-        return self.hasEventPending() and (not self.inDisabledState()) and (not self.inInitUIErrorState())
-
     def setDisabledState(self, val):
         if val is True:
             self._machine.next('disable')
@@ -741,69 +721,20 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
                 return True
         return False
 
-    def setEventStatus(self, val):
-        '''None: to clear event status.
-        {GPI_PORT_EVENT:'title'}: for the event type and port name.
-        {GPI_WIDGET_EVENT:'title'}: for the event type and widget name.
-        {GPI_INIT_EVENT:None}: if the node is freshly added.
-        {GPI_REQUEUE_EVENT:None}: if the node was automatically requeued.
+    def setRestoreEvent(self):
+        '''Queue the node to recompute its released memsaver data.  Unless the
+        node has a real event, the new outputs don't signal downstream nodes.
         '''
-        if val is not None:
-            self._event_type = val  # keep last event
-            self._event_pending = True
-
-            self.appendEvent(val)
-
-        else:
-            self._event_pending = False
-            # the queue and delete functions set this to none
-            # so do the handoff at this point to make it available
-            # to the user.
-            self._events_handoff = self._events
-            self._events = EventManager()  # make a new one
-
-    def appendEvent(self, val):
-        # translate to new obj
-        if GPI_WIDGET_EVENT in val:
-            self._events.addWidgetEvent(val[GPI_WIDGET_EVENT])
-        if GPI_PORT_EVENT in val:
-            # TODO: for some reason, events are being added to _nodeIF at close
-            # so check for valid _nodIF function before using.
-            # -its b/c nodes are being deleted, which is causing more events.
-            # -this hack takes care of it for now.
-            if hasattr(self._nodeIF, 'getWidgetNames'):
-                # re-map widget-port events to widget events.
-                if val[GPI_PORT_EVENT] in self._nodeIF.getWidgetNames():
-                    self._events.addWidgetEvent(val[GPI_PORT_EVENT])
-                else:
-                    self._events.addPortEvent(val[GPI_PORT_EVENT])
-        if GPI_INIT_EVENT in val:
-            self._events.setInitEvent()
-        if GPI_REQUEUE_EVENT in val:
-            self._events.setRequeueEvent()
-
-    def hasEventPending(self):
-        return self._event_pending
-
-    def getPendingEvent(self):
-        '''Return copy of event to protect orig.'''
-        return copy.deepcopy(self._event_type)
-
-    def getPendingEvents(self):
-        '''Return copy of event to protect orig.'''
-        return copy.deepcopy(self._events_handoff)
-
-    def getModuleName(self):
-        return self._moduleName
-
-    def setReQueue(self, val=False):  # NODE
-        # At the end of a nodeQueue, these tasked are checked for
-        # more events.
-        self._requeue = val
-
-    def modifyWdg(self, title, kwargs):  # NODE
-        if self._nodeIF:  # not deleted
-            self._nodeIF.modifyWidget_direct(str(title), **kwargs)
+        if not self.hasEventPending():
+            self._restoring = True
+        self.setEventStatus({GPI_REQUEUE_EVENT: None})
+
+    def endRestore(self):
+        # whether or not the released data was set again, the last compute
+        # is all that can be restored.
+        self._restoring = False
+        for port in self.outportList:
+            port.setReleased(False)
 
     def updateToolTips(self):
         for port in self.getPorts():
@@ -815,60 +746,6 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
                 return port
         log.error("getPortByID(): failed to find port id: " + str(pID))
 
-    def getPorts(self):
-        return self.inportList + self.outportList
-
-    def getCyclicPorts(self):
-        plist = []
-        for port in self.inportList:
-            if port.allowsCyclicConn():
-                plist.append(port)
-        return plist
-
-    def getNonCyclicPorts(self):
-        plist = []
-        for port in self.getPorts():
-            if not port.allowsCyclicConn():
-                plist.append(port)
-        return plist
-
-    def getInPortByNumOrTitle(self, pnumORtitle):
-        return self.getPortByNumOrTitle(pnumORtitle, self.inportList)
-
-    def getOutPortByNumOrTitle(self, pnumORtitle):
-        return self.getPortByNumOrTitle(pnumORtitle, self.outportList)
-
-    def getPortByNumOrTitle(self, pnumORtitle, portList=None):
-        if portList is None:
-            portList = self.getPorts()
-        if type(pnumORtitle) is int:
-            if (pnumORtitle < 0) or (pnumORtitle >= len(portList)):
-                log.error("getPortByNumOrTitle (from Node): target out of port range: \'" +stw(pnumORtitle) +"\'")
-                return
-            src = portList[pnumORtitle]
-        elif type(pnumORtitle) is str:
-            src = None
-            cnt = 0
-            for port in portList:
-                if port.portTitle == pnumORtitle:
-                    src = port
-                    pnumORtitle = cnt
-                cnt += 1
-            if src is None:
-                log.error("getPortByNumOrTitle(): failed to find port: \'" + stw(pnumORtitle)+"\'")
-                return
-        else:
-            log.critical("getPortByNumOrTitle(): ERROR: port identifier must be either int or str")
-            return
-
-        return src
-
-    def getInPort(self, pnumORtitle):
-        return self.getPortByNumOrTitle(pnumORtitle, self.inportList)
-
-    def getOutPort(self, pnumORtitle):
-        return self.getPortByNumOrTitle(pnumORtitle, self.outportList)
-
     def getPos(self):
         return [self.scenePos().x(), self.scenePos().y()]
 
@@ -882,6 +759,7 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
             s['walltime'] = str(self.curWallTime())  # in sec
         s['avgwalltime'] = str(self.avgWallTime())
         s['stdwalltime'] = str(self.stdWallTime())
+        s['walltimes'] = list(self._computeDuration)  # in sec, for scheduling
         s['id'] = self.getID()  # unique canvas id
         s['pos'] = self.getPos()
         s['name'] = self.getModuleName()
@@ -899,15 +777,6 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
             o.append(str(w.title()))
         return o
 
-    def setID(self, value=None):
-        if value is None:
-            self._id = id(self)  # this will always be unique
-        else:
-            self._id = value
-
-    def getID(self):
-        return self._id
-
     def detachSelf(self):
         '''Remove all upstream and downstream connections'''
         # inports
@@ -971,6 +840,12 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
     def getParmList(self):
         return self._nodeIF.parmList
 
+    def fusedMacro(self):
+        # process nodes of a collapsed macro can share the macro's worker
+        if Specs.inWindows() or (self._nodeIF.execType() != GPI_PROCESS):
+            return None
+        return self.graph.getFusedMacro(self)
+
     def deleteComputeThread(self):
         if self.nodeCompute_thread:  # it is currently running
             self.nodeCompute_thread.blockSignals(True)
@@ -997,7 +872,9 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
         self.removeMenu()
         self.removePorts()
         self.deleteComputeThread()
+        Pool.release(self)
         self.removeMMAPs()
+        Segments.releaseNode(self.getID())
 
 #    def hoverEnterEvent(self, event):
 #        self.beingHovered = True
@@ -1007,50 +884,6 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
 #        self.beingHovered = False
 #        self.update()
 
-    def appendWallTime(self, time):
-        '''Only keep the last 100 wall times.
-        '''
-        self._computeDuration.append(time)
-        if len(self._computeDuration) > 100:
-            self._computeDuration.pop(0)
-
-    def curWallTime(self):
-        if len(self._computeDuration):
-            return self._computeDuration[-1]
-
-    def maxWallTime(self):
-        # get the most recent time over 'thresh'
-        if len(self._computeDuration):
-            x = np.array(self._computeDuration)
-            x = x[x > self._prog_thresh]
-            if len(x) > 0:
-                return x[-1]
-            #return max(self._computeDuration)
-
-    def avgWallTime(self):
-        if len(self._computeDuration):
-            return sum(self._computeDuration)/len(self._computeDuration)
-
-    def stdWallTime(self):
-        if len(self._computeDuration):
-            avg = self.avgWallTime()  # a little wastefull
-            return math.sqrt(sum( [ (x-avg)**2 for x in self._computeDuration ] )/len(self._computeDuration))
-
-    def portMem(self):
-        # a byte count of all outport memory being held
-        bytes_held = 0
-        for port in self.outportList:
-
-            # numpy arrays have a direct byte count
-            if hasattr(port.data, 'nbytes'):
-                bytes_held += port.data.nbytes
-
-            # try to get an estimate of the object w/ sys
-            else:
-                bytes_held += sys.getsizeof(port.data)
-
-        return bytes_held
-
     def updateToolTip(self):  # NODE
 
         bytes_held = self.portMem()
@@ -1076,16 +909,20 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
 
         tip += 'Outport Mem: ' + GetHumanReadable_bytes(
             bytes_held) + pct_physmem
-        self.setToolTip(tip)
 
-    def setHierarchalLevel(self, level):
-        self._hierarchal_level = level
+        if len(self._computeMemory):
+            tip += '\nPeak Compute Mem: ' + GetHumanReadable_bytes(
+                max([p for o, p in self._computeMemory]))
 
-    def getHierarchalLevel(self):
-        return self._hierarchal_level
+        decisions = Policy.decisions(self)
+        if len(decisions):
+            t, execType, reason = decisions[-1]
+            tip += '\nAuto Exec: ' + EXEC_NAMES[execType] + ' (' + reason + ')'
 
-    def resetHierarchalLevel(self):
-        self._hierarchal_level = -1
+        events, coalesced = self._nodeIF.wdgEventCounts()
+        if events:
+            tip += '\nWidget Events: ' + str(events) + ' (' + str(coalesced) + ' coalesced)'
+        self.setToolTip(tip)
 
     def menu(self):
         '''raises node menu.'''
@@ -1102,25 +939,14 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
             self._nodeIF_scrollArea.close()
             self._menuHasRaised = False
 
-    def getModuleCompute(self):
-        return self._nodeIF.compute
-
-    def getModuleValidate(self):
-        return self._nodeIF.validate
-
-    def getNodeLabel(self):
-        return self._nodeIF.label
-
     def forceUpdate_NodeUI(self):
         self._forceUpdate.emit()
         self.update()
-        # only run this if execType is an APPLOOP
-        if self._nodeIF.execType() == GPI_APPLOOP:
+        # only run this if the compute is an APPLOOP (GPI_AUTO nodes choose
+        # for each compute)
+        if self.nodeCompute_thread and (self.nodeCompute_thread.execType() == GPI_APPLOOP):
             QtWidgets.QApplication.processEvents()  # allow gui to update
 
-    def execType(self):
-        return self._nodeIF.execType()
-
     def inPortsAreValid(self):
         # check that all required ports have data
         # and that the data matches the requested type
@@ -1153,29 +979,6 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
                             inport.getUpstreamData())
         return (not dontRunFlag)
 
-    def setWidgetOutports(self):
-        # send events for widget ports
-        for port in self.outportList:
-            if port.isWidgetPort():
-                if port.setWidgetData():
-                    port.setDownstreamEvents()
-                    port.update()
-
-    def resetOutportStatus(self):
-        for port in self.outportList:
-            port.setDataCalled(False)
-            port.update()
-
-    def setData(self, pnumORtitle, data):
-        '''Set output data, determine port status, and send downstream events'''
-        port = self.getOutPort(pnumORtitle)
-        port.setData(data)
-        if port.dataHasChanged():
-            port.setDownstreamEvents()
-        port.update()
-        # allow gui update so port status can be seen
-        # QtWidgets.QApplication.processEvents()
-
     def isTopNode(self):
         cnt = 0
         for port in self.getPorts():
@@ -1204,6 +1007,25 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
             c += port.getNonCyclicConnectionTuples()
         return c
 
+    def getReleasedUpstreamNodes(self):
+        '''The upstream nodes whose released memsaver data this node needs.
+        '''
+        nodes = []
+        for port in self.inportList:
+            uport = port.getUpstreamPort()
+            if (uport is not None) and uport.isReleased():
+                if uport.getNode() not in nodes:
+                    nodes.append(uport.getNode())
+        return nodes
+
+    def releaseUpstreamData(self):
+        # drop the data of upstream memsaver ports once all of their
+        # downstream nodes have run.
+        for port in self.inportList:
+            uport = port.getUpstreamPort()
+            if (uport is not None) and uport.isMemSaver() and uport.consumersAreFinished():
+                uport.releaseData()
+
     def edges(self):
         edges = []
         for port in self.getPorts():
@@ -1217,42 +1039,10 @@ class Node(QtWidgets.QGraphicsObject, QtWidgets.QGraphicsItem):
         if self._nodeIF is not None:  # update node menu
             self._nodeIF.updateTitle()
 
-    def getName(self):
-        # node title
-        return self.name
-
-    def getNameFromItem(self):
-        return self.item.name
-
-    def getFullPath(self):
-        return self.item.fullpath
-
     def refreshName(self):
         '''Name based on node level and pending event status'''
         self.update()
 
-    def titleExists(self, title):
-        for port in self.getPorts():
-            if port.portTitle == title:
-                return True
-        # print type(self)
-        if self._nodeIF:
-            for wdg in self._nodeIF.parmList:
-                if wdg.getTitle() == title:
-                    return True
-        return False
-
-    # Parse the extTypes dict held by the graph
-    # to get an instance of the requested GPIType.
-    def findGPIType(self, ptype):
-        if self.graph:
-            typ, req = self.graph._library.getType(ptype)
-            if not req:
-                log.warn(str(self._moduleName)+' NODE: Requested port-type: \''+str(ptype)+'\' not found.  Using \'PASS\' instead.')
-            return typ
-        else:  # this is just in case the node is being instantiated as a dummy
-            return GPIDefaultType()
-
     def addInPort(self, title=None, ptype=None, obligation=REQUIRED, menuWidget=None, cyclic=False, **kwargs):  # NODE
 
         # check if title is used (but not for wdg ports,
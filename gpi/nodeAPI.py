@@ -35,11 +35,12 @@ from multiprocessing import sharedctypes # numpy xfer
 # gpi
 import gpi
 from gpi import QtCore, QtGui, QtWidgets
-from .defines import ExternalNodeType, GPI_PROCESS, GPI_THREAD, stw, GPI_SHDM_PATH
+from .defines import ExternalNodeType, GPI_PROCESS, GPI_THREAD, GPI_AUTO, stw, GPI_SHDM_PATH
 from .defines import GPI_WIDGET_EVENT, REQUIRED, OPTIONAL, GPI_PORT_EVENT
-from .dataproxy import DataProxy, ProxyType
+from .defines import InPortTYPE, OutPortTYPE
+from .config import Config
+from .dataproxy import DataProxy, ProxyType, Segments, SharedOutputs
 from .logger import manager
-from .port import InPort, OutPort
 from .widgets import HidableGroupBox
 from . import widgets as BUILTIN_WIDGETS
 from . import syntax
@@ -95,6 +96,15 @@ class NodeAPI(QtWidgets.QWidget):
         self.parmDict = {}  # mirror parmList for now
         self.parmSettings = {}  # for buffering wdg parms before copying to a PROCESS
         self.shdmDict = {} # for storing base addresses
+        self._modifyingWdg = False  # the node is setting its own widgets
+
+        # widget changes collected by the debounce window
+        self._debounceTimer = QtCore.QTimer(self)
+        self._debounceTimer.setSingleShot(True)
+        self._debounceTimer.timeout.connect(self.flushWdgEvents)
+        self._debouncedWdgs = []
+        self._wdgEventCount = 0
+        self._wdgEventsCoalesced = 0
 
         # grid for module widgets
         self.layout = QtWidgets.QGridLayout()
@@ -220,7 +230,9 @@ class NodeAPI(QtWidgets.QWidget):
         log.node(self.node.getName()+' - '+str(ttime)+'sec, between lines:'+str(self._startline)+'-'+str(eline)+'. '+msg)
 
     def stringifyExecType(self):
-        if self.execType() is GPI_PROCESS:
+        if self.execType() is GPI_AUTO:
+            return " [Auto]"
+        elif self.execType() is GPI_PROCESS:
             return " [Process]"
         elif self.execType() is GPI_THREAD:
             return " [Thread]"
@@ -237,9 +249,83 @@ class NodeAPI(QtWidgets.QWidget):
     def execType(self):
         # default executable type
         # return GPI_THREAD
+        # return GPI_AUTO  # chosen for each compute, see execPolicy.py
         return GPI_PROCESS  # this is the safest
         # return GPI_APPLOOP
 
+    def memoize(self):
+        """Allow the outputs of :py:meth:`compute` to be reused when the
+        inputs and widget settings are the same as a previous run (see the
+        ``[CACHE]`` section of the config file).
+
+        Returns:
+            bool: ``True`` by default.  Nodes with side effects (e.g. writing
+            files) or non-deterministic output should override this and
+            return ``False``.
+        """
+        return True
+
+    def acceptsChunks(self):
+        """Whether this node takes the chunks of its upstream nodes (see
+        :py:meth:`computeChunk`).
+
+        Returns:
+            bool: ``False`` by default.  Nodes that define
+            :py:meth:`computeChunk` should override this and return ``True``.
+        """
+        return False
+
+    def computeChunk(self, title, chunk, index):
+        """Process one chunk of an upstream node's output as soon as it is
+        emitted (see :py:meth:`emitChunk`), before the upstream node has
+        finished.  It is only called if :py:meth:`acceptsChunks` returns
+        ``True``, for the chunks on all of the node's inports.
+
+        It runs on its own thread in the main process while the upstream
+        compute continues, so it should only keep its results as attributes
+        of the node (e.g. ``self.slices[index] = ...``).  :py:meth:`compute`
+        still runs once the upstream node is done, with the assembled data at
+        the port and the attributes set here.
+
+        A ``GPI_PROCESS`` node gets these attributes as they are when its
+        compute starts: they are compared with what its warm worker holds
+        and sent again if they have changed, in place or not.  That copies
+        them for every compute, so chunk consumers that keep large results
+        are better off as ``GPI_THREAD`` nodes.
+
+        Args:
+            title (str): the inport the chunk arrived on
+            chunk: the emitted object
+            index: the position of the chunk in the assembled data
+        """
+        pass
+
+    def debounce(self):
+        """The time (in ms) that changes to this node's widgets are
+        collected for before the node computes once with the latest values.
+
+        Returns:
+            int: ``None`` by default, to use the ``WDG_DEBOUNCE`` value of the
+            config file.  Heavy nodes with sliders can override this (e.g.
+            ``return 200``), a value of 0 computes on every change.
+        """
+        return None
+
+    def isCancelled(self):
+        """Check if the running :py:meth:`compute` has been superseded by a
+        newer event (e.g. the user moved a slider again).
+
+        The outputs of a cancelled compute are discarded and the node is
+        computed again with the newer widget values, so a long running
+        :py:meth:`compute` can check this periodically and return early.
+        A process node that doesn't return soon after it's cancelled is
+        stopped.
+
+        Returns:
+            bool: ``True`` if the results of this compute will be discarded
+        """
+        return self.node.nodeCompute_thread.isCancelled()
+
     def setReQueue(self, val=False):  # NODEAPI
         # At the end of a nodeQueue, these tasked are checked for
         # more events.
@@ -715,13 +801,19 @@ class NodeAPI(QtWidgets.QWidget):
     def modifyWidget_direct(self, pnumORtitle, **kwargs):
         src = self.getWidget(pnumORtitle)
 
-        for k, v in list(kwargs.items()):
-            if k != 'val':
-                self.modifyWidget_setter(src, k, v)
+        # the widget events caused by the node itself don't supersede its
+        # compute
+        self._modifyingWdg = True
+        try:
+            for k, v in list(kwargs.items()):
+                if k != 'val':
+                    self.modifyWidget_setter(src, k, v)
 
-        # set 'val' last so that bounds don't cause a temporary conflict.
-        if 'val' in kwargs:
-            self.modifyWidget_setter(src, 'val', kwargs['val'])
+            # set 'val' last so that bounds don't cause a temporary conflict.
+            if 'val' in kwargs:
+                self.modifyWidget_setter(src, 'val', kwargs['val'])
+        finally:
+            self._modifyingWdg = False
 
     def modifyWidget_buffer(self, title, **kwargs):
         """GPI_PROCESSes have to use buffered widget attributes to effect the
@@ -749,7 +841,36 @@ class NodeAPI(QtWidgets.QWidget):
     def wdgEvent(self, title):
         # Captures all valueChanged events from widgets.
         # 'title' is for interrogating who changed in compute().
+        self._wdgEventCount += 1
+
+        window = self.debounce()
+        if window is None:
+            window = Config.WDG_DEBOUNCE
+        if (window > 0) and not self._modifyingWdg:
+            # the changes made within the window become one event, compute()
+            # reads the latest values.
+            if title not in self._debouncedWdgs:
+                self._debouncedWdgs.append(title)
+            if self._debounceTimer.isActive():
+                self._wdgEventsCoalesced += 1
+            else:
+                self._debounceTimer.start(int(window))
+            return
 
+        self.processWdgEvent(title)
+
+    def flushWdgEvents(self):
+        titles = self._debouncedWdgs
+        self._debouncedWdgs = []
+        for title in titles:
+            self.processWdgEvent(title)
+
+    def wdgEventCounts(self):
+        # the widget changes seen and how many were collected into an earlier
+        # event
+        return self._wdgEventCount, self._wdgEventsCoalesced
+
+    def processWdgEvent(self, title):
         # Once the event status has been set, disable valueChanged signals
         # until the node has successfully completed.
         # -this was b/c sliders etc. were causing too many signals resulting
@@ -763,6 +884,10 @@ class NodeAPI(QtWidgets.QWidget):
         else:
             self.node.setEventStatus({GPI_WIDGET_EVENT: title})
 
+        # the running compute is now out of date
+        if not self._modifyingWdg:
+            self.node.supersedeCompute()
+
         # Can start event from any applicable 'check' transition
         if self.node.graph.inIdleState():
             self.node.graph._switchSig.emit('check')
@@ -806,6 +931,9 @@ class NodeAPI(QtWidgets.QWidget):
             # either emit a signal or save a queue
             if self.node.inDisabledState():
                 return
+            # a superseded compute no longer changes the node
+            if self.node.nodeCompute_thread.isCancelled():
+                return
             if self.node.nodeCompute_thread.execType() == GPI_PROCESS:
                 # PROCESS
                 self.node.nodeCompute_thread.addToQueue(['modifyWdg', title, kwargs])
@@ -829,6 +957,10 @@ class NodeAPI(QtWidgets.QWidget):
             -the array name needs to be unique
         """
         if self.node.nodeCompute_thread.execType() == GPI_PROCESS:
+            # shared memory arrays can be passed on as any view
+            if (Config.DATA_TRANSPORT == 'shm') and Segments.available():
+                return Segments.allocate(shape, dtype)
+
             buf, shd = DataProxy()._genNDArrayMemmap(shape, dtype, self.node.getID(), name)
 
             if shd is not None:
@@ -841,6 +973,28 @@ class NodeAPI(QtWidgets.QWidget):
         else:
             return np.ndarray(shape, dtype=dtype)
 
+    def sharedOutputs(self):
+        """Allocate large output arrays in shared memory.
+
+        When the node runs as a process, the arrays of 32MiB or more made by
+        ``np.empty()``, ``np.zeros()`` and ``np.ones()`` (and their
+        ``_like()`` versions) in this context are allocated in shared memory.
+        Results written into them (e.g. with ``out=``) and passed to
+        :py:meth:`setData`, or any view of them, reach the outport without a
+        copy.  The arrays shouldn't be kept by the node after
+        :py:meth:`compute` returns.  Other execution types already pass
+        arrays by reference, so nothing changes for them::
+
+            with self.sharedOutputs():
+                out = np.empty_like(data)
+            np.multiply(data, scale, out=out)
+            self.setData('out', out)
+
+        Returns:
+            A context manager.
+        """
+        return SharedOutputs(self.node.nodeCompute_thread.execType() == GPI_PROCESS)
+
     def setData(self, title, data):
         """Set the data at an :py:class:`OutPort`.
 
@@ -859,8 +1013,16 @@ class NodeAPI(QtWidgets.QWidget):
             # either set directly or save a queue
             if self.node.inDisabledState():
                 return
+            # a superseded compute no longer changes the node
+            if self.node.nodeCompute_thread.isCancelled():
+                return
             if self.node.nodeCompute_thread.execType() == GPI_PROCESS:
 
+                # data passed between the nodes of a fused macro stays in
+                # the macro's worker
+                if self.node.nodeCompute_thread.keepData(title, data):
+                    return
+
                 #  numpy arrays
                 if type(data) is np.memmap or type(data) is np.ndarray:
                     if str(id(data)) in self.shdmDict: # pre-alloc
@@ -879,8 +1041,12 @@ class NodeAPI(QtWidgets.QWidget):
 
                 # all other non-numpy data that are pickleable
                 else:
-                    # PROCESS output other than numpy
-                    self.node.nodeCompute_thread.addToQueue(['setData', title, data])
+                    # PROCESS output other than numpy, the large buffers it
+                    # holds are passed like arrays
+                    s = DataProxy().Object(data, nodeID=self.node.getID(), portname=title)
+                    if s is None:
+                        s = data
+                    self.node.nodeCompute_thread.addToQueue(['setData', title, s])
             else:
                 # THREAD or APPLOOP
                 self.node.setData(title, data)
@@ -906,7 +1072,7 @@ class NodeAPI(QtWidgets.QWidget):
         """
         try:
             port = self.node.getPortByNumOrTitle(title)
-            if isinstance(port, InPort):
+            if port.porttype() == InPortTYPE:
                 data = port.getUpstreamData()
                 if type(data) is np.ndarray:
                     # don't allow users to change original array attributes
@@ -917,7 +1083,7 @@ class NodeAPI(QtWidgets.QWidget):
                 else:
                     return data
 
-            elif isinstance(port, OutPort):
+            elif port.porttype() == OutPortTYPE:
                 return port.data
             else:
                 raise Exception("getData", "Invalid Port Title")
@@ -952,6 +1118,37 @@ class NodeAPI(QtWidgets.QWidget):
         log.warn('The \'getData_fromPort()\' function is deprecated, use \'getData()\' instead.  '+str(self.node.getFullPath()))
         return self.getData(title)
 
+    def emitChunk(self, title, data, index=None):
+        """Send one chunk of an :py:class:`OutPort`'s data (e.g. a slice of a
+        volume) to the downstream nodes that accept chunks (see
+        :py:meth:`computeChunk`), while :py:meth:`compute` continues.
+
+        Each downstream node buffers the chunks it hasn't processed; when a
+        buffer holds more than ``CHUNK_BUFFER`` bytes this call waits until
+        the node catches up (for a ``GPI_PROCESS`` compute, until the nodes
+        have taken enough of the chunks it has sent).
+        After :py:meth:`compute` returns, the chunks are assembled in index
+        order (stacked into one array if they are arrays of the same shape and
+        type, otherwise as a list) and set as the port's data for all downstream nodes, unless
+        :py:meth:`setData` was called for the port.
+
+        Args:
+            title (str): name of the port
+            data: the chunk
+            index (int): the position of the chunk in the assembled data,
+                the order of the calls is used by default
+        """
+        try:
+            if self.node.inDisabledState():
+                return
+            if self.node.nodeCompute_thread.execType() == GPI_PROCESS:
+                self.node.nodeCompute_thread.addToQueue(['chunk', title, data, index])
+            else:
+                # THREAD or APPLOOP
+                self.node.emitChunk(title, data, index)
+        except:
+            log.error("emitChunk() failed. "+str(traceback.format_exc()))
+
     def setData_ofPort(self, title, data):
         """title = (str) name of the OutPort to send the object reference.
         data = (object) any object corresponding to a GPIType class.
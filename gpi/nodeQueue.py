@@ -26,94 +26,23 @@
 # gpi
 import gpi
 from gpi import QtCore
-from .logger import manager
+from .engine import NodeScheduler
 from .node import Node
 
-# start logger for this module
-log = manager.getLogger(__name__)
 
-
-class GPINodeQueue(QtCore.QObject):
-    '''The list of nodes to process based on UI and hierarchy changes.
+class GPINodeQueue(QtCore.QObject, NodeScheduler):
+    '''The canvas' NodeScheduler, it signals when the queue has finished so
+    that the canvas can check for new events.
     '''
 
     finished = gpi.Signal()
 
     def __init__(self, parent=None):
         super(GPINodeQueue, self).__init__(parent)
-        self._queue = []
-        self._paused = False
-        self._last_node_started = '-init-str-'
-
-    def __str__(self):
-        # stringify the status of the queue
-        msg =  "GPINodeQueue object:\n"
-        msg += "\tis paused: "+str(self.isPaused())+"\n"
-        msg += "\tis empty:  "+str(self.isEmpty())+"\n"
-        msg += "\tqueue len: "+str(self.getQueueLen())+"\n"
-        msg += "\tlast node:  "+str(self._last_node_started)+"\n"
-        return msg
-
-    def setPause(self, val):
-        self._paused = val
-
-    def isPaused(self):
-        return self._paused
-
-    def isEmpty(self):
-        if len(self._queue) > 0:
-            return False
-        return True
-
-    def put(self, node):
-        if isinstance(node, Node):
-            self._queue.append(node)
-
-    def getQueueLen(self):
-        return len(self._queue)
-
-    def resetQueue(self):
-        self._queue = []
-
-    def setQueue(self, nlist):
-        self._queue = nlist
-
-    def removeNode(self, node):
-        # removes the first instance of given 'node'
-        if node in self._queue:
-            ind = self._queue.index(node)
-            self._queue.pop(ind)
-            log.debug("removeNode(): Node(" + node.name + \
-                "): Removed node from queue.")
-            return True  # SUCCESS
-        else:
-            log.debug("removeNode(): Node(" + node.name + \
-                "): This node was not found in the queue.")
-            return False  # FAILURE
-
-    def startNextNode(self):
-        if self.isPaused():
-            log.debug("startNextNode(): blocking for pause.")
-            return 'paused'
-
-        # find next node in queue
-        if len(self._queue) > 0:
-            while not self._queue[0].isReady():
-                self._queue.pop(0)
-                if len(self._queue) == 0:
-                    break
+        NodeScheduler.__init__(self)
 
-        # if queue is done then finalize
-        if len(self._queue) == 0:
-            log.debug("startNextNode(): node queue empty, finished.")
-            self.finished.emit()
-            return 'finished'
+    def isNode(self, node):
+        return isinstance(node, Node)
 
-        # run next node
-        node = self._queue.pop(0)
-        self._last_node_started = node.getName()
-        if node.hasEventPending():
-            node.setEventStatus(None)
-            log.debug("startNextNode(): node: "+node.getName())
-            node.start()
-            return 'started'
+    def queueFinished(self):
+        self.finished.emit()
@@ -655,6 +655,9 @@ class OutPort(Port):
 
         self.data_changed = True  # don't start in warning state
 
+        # memsaver data that was dropped after all consumers used it
+        self._released = False
+
     def setDataCalled(self, called=True):
         self.data_changed = called
 
@@ -712,6 +715,31 @@ class OutPort(Port):
         '''
         self._data = None
 
+    def releaseData(self):
+        '''Free the data of a memsaver port once it has been used.  The node
+        has to recompute before any downstream node can use it again.
+        '''
+        if self.isMemSaver() and (not self.isWidgetPort()) and (self._data is not None):
+            log.debug("releaseData(): \'"+stw(self.portTitle)+"\' released.")
+            self.freeDataQuietly()
+            self._released = True
+            self.update()
+
+    def setReleased(self, val):
+        self._released = val
+
+    def isReleased(self):
+        return self._released
+
+    def consumersAreFinished(self):
+        '''True if none of the downstream nodes are still waiting to use the
+        data.
+        '''
+        for nodeObj in self.getDownstreamNodes():
+            if nodeObj[0].hasEventPending() or nodeObj[0].isProcessingEvent():
+                return False
+        return True
+
     def getDataString(self):
         # PORTAUTH
         return self._GPIType.edgeTip(self._data)
@@ -727,6 +755,8 @@ class OutPort(Port):
 
     def setData(self, out):
         # PORTAUTH
+        self._released = False
+
         # enforce port type
         if self.checkDataType(out):
             self._data = self._GPIType.setDataAttr(out)
@@ -0,0 +1,362 @@
+#    Copyright (C) 2014  Dignity Health
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL PURPOSES
+#    AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+#    SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+#    PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+#    USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT
+#    LIMITED TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR
+#    MAKES NO WARRANTY AND HAS NO LIABILITY ARISING FROM ANY USE OF THE
+#    SOFTWARE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+
+
+'''A resident server that keeps networks loaded and runs jobs on them
+(gpi --serve).
+
+The library is scanned and each network is loaded once, onto its own
+headless Engine.  Jobs arrive on a local socket; a job names a network and
+gives the String-node args and widget values to run it with.
+
+The socket is made in a directory that only the user can open, next to a
+key that only the user can read.  Requests are pickled, so a connection
+has to prove it holds the key before anything it sends is unpickled.  Jobs are run
+one at a time, highest priority first, and each one only recomputes the
+nodes downstream of the widgets it changes.  The reply holds the status, the
+files written by the nodes that ran and the timings.
+
+    from gpi.server import submit
+    reply = submit('/tmp/gpi-server', 'recon', strings={'infile': '/data/01.npy'})
+    print(reply['status'], reply['outputs'], reply['walltime'])
+'''
+
+import os
+import time
+import queue
+import itertools
+import threading
+import traceback
+import multiprocessing.connection
+
+from .logger import manager
+
+# start logger for this module
+log = manager.getLogger(__name__)
+
+# how often the server wakes up to check for a shutdown
+SERVER_POLL_INTERVAL = 0.5  # sec
+
+# the files kept in the server directory
+SERVER_SOCKET = 'socket'
+SERVER_AUTHKEY = 'authkey'
+SERVER_AUTHKEY_LEN = 32  # bytes
+
+
+def socketPath(directory):
+    return os.path.join(directory, SERVER_SOCKET)
+
+def readAuthKey(directory):
+    with open(os.path.join(directory, SERVER_AUTHKEY), 'rb') as f:
+        return f.read()
+
+def makeServerDir(directory):
+    '''Make the server directory, private to the user, and write a new key
+    into it.  Returns the key.
+    '''
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.stat(directory)
+    if st.st_uid != os.getuid():
+        raise OSError('\''+str(directory)+'\' is owned by another user')
+    os.chmod(directory, 0o700)
+
+    key = os.urandom(SERVER_AUTHKEY_LEN)
+    path = os.path.join(directory, SERVER_AUTHKEY)
+    if os.path.lexists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def submit(address, network, strings=None, widgets=None, priority=0):
+    '''Send a job to a running server and wait for the reply.
+
+    address: the server directory, as passed to --serve
+    network: the name of a loaded network (its file name without '.net')
+    strings: {label: string} for the String nodes, as with -s
+    widgets: {node label: {widget title: value}}, nodes without a label can
+        be given by name
+    priority: jobs with a higher priority are run first
+    '''
+    job = {'cmd': 'run', 'network': network, 'strings': strings or {},
+           'widgets': widgets or {}, 'priority': priority}
+    return request(address, job)
+
+def request(address, msg):
+    # send one message and wait for the reply
+    conn = multiprocessing.connection.Client(socketPath(address), family='AF_UNIX',
+                                             authkey=readAuthKey(address))
+    try:
+        conn.send(msg)
+        return conn.recv()
+    finally:
+        conn.close()
+
+
+class ServerJob(object):
+    '''A request and, once it has been run, its reply.'''
+
+    def __init__(self, msg):
+        self.msg = msg
+        self.reply = None
+        self.submitted = time.time()
+        self._done = threading.Event()
+
+    def priority(self):
+        try:
+            return int(self.msg.get('priority', 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def finish(self, reply):
+        self.reply = reply
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        return self.reply
+
+
+class GPIServer(object):
+    '''Holds the loaded Engines and runs the jobs sent to a local socket.
+
+    Connections are accepted and read on their own threads, the jobs are run
+    on the thread that calls serve() (the main thread, as the node menus are
+    QWidgets).
+    '''
+
+    def __init__(self, address):
+        self._address = address  # the server directory
+        self._engines = {}  # network name: Engine
+        self._paths = {}  # network name: path it was loaded from
+        self._library = None
+        self._jobs = queue.PriorityQueue()
+        self._seq = itertools.count()  # keeps equal priorities in order
+        self._listener = None
+        self._running = False
+
+    def networks(self):
+        return sorted(self._engines.keys())
+
+    def loadNetwork(self, path):
+        '''Load a network onto its own Engine, under its file name.  Returns
+        False if it fails to load.
+        '''
+        from .engine import Engine
+
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in self._engines:
+            log.error('loadNetwork(): a network named \''+str(name)+'\' is already loaded.')
+            return False
+
+        # the networks share one scan of the library
+        engine = Engine(self._library)
+        if not engine.loadNetwork(path):
+            return False
+        self._library = engine.library()
+
+        # compute the network as loaded, so jobs only rerun what they change
+        if engine.run():
+            log.warn('loadNetwork(): \''+str(name)+'\' failed its first run.')
+        self._engines[name] = engine
+        self._paths[name] = path
+        log.dialog('Network \''+str(name)+'\' loaded from '+str(path))
+        return True
+
+    def reloadNetwork(self, name):
+        '''Load a network again, in place of its Engine.  Returns False (and
+        keeps the old Engine) if it fails to load.
+        '''
+        engine = self._engines.pop(name)
+        if self.loadNetwork(self._paths[name]):
+            return True
+        self._engines[name] = engine
+        return False
+
+    def serve(self):
+        '''Take jobs until a 'shutdown' request arrives.  Returns the exit
+        code.
+        '''
+        try:
+            key = makeServerDir(self._address)
+            self._listener = multiprocessing.connection.Listener(socketPath(self._address),
+                                                                 family='AF_UNIX', authkey=key)
+        except (OSError, ValueError) as e:
+            log.error('serve(): can\'t listen on \''+str(self._address)+'\': '+str(e))
+            return 1
+
+        self._running = True
+        accept = threading.Thread(target=self.accept, name='GPIServer-accept')
+        accept.daemon = True
+        accept.start()
+        log.dialog('Serving '+', '.join(self.networks())+' on '+str(self._address))
+
+        try:
+            while self._running:
+                try:
+                    _, _, job = self._jobs.get(timeout=SERVER_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                job.finish(self.runJob(job))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._running = False
+            self._listener.close()
+            try:
+                os.remove(os.path.join(self._address, SERVER_AUTHKEY))
+            except OSError:
+                pass
+
+        # answer anything that was still waiting
+        while not self._jobs.empty():
+            self._jobs.get()[2].finish({'status': 'error', 'error': 'the server shut down'})
+        return 0
+
+    # CONNECTION THREADS
+    def accept(self):
+        while self._running:
+            try:
+                conn = self._listener.accept()
+            except multiprocessing.AuthenticationError:
+                log.warn('accept(): a connection without the key was refused.')
+                continue
+            except (OSError, EOFError):
+                break  # listener closed
+            t = threading.Thread(target=self.handle, args=(conn,), name='GPIServer-conn')
+            t.daemon = True
+            t.start()
+
+    def handle(self, conn):
+        try:
+            msg = conn.recv()
+            conn.send(self.dispatch(msg))
+        except (OSError, EOFError):
+            pass
+        except Exception:
+            log.error('handle(): '+str(traceback.format_exc()))
+        finally:
+            conn.close()
+
+    def dispatch(self, msg):
+        # answer requests that don't run anything, queue the rest
+        if not isinstance(msg, dict):
+            return {'status': 'error', 'error': 'requests must be a dict'}
+        cmd = msg.get('cmd', 'run')
+        if cmd == 'networks':
+            return {'status': 'ok', 'networks': self.networks()}
+        if cmd == 'shutdown':
+            self._running = False
+            return {'status': 'ok'}
+        if cmd != 'run':
+            return {'status': 'error', 'error': 'unknown command \''+str(cmd)+'\''}
+        if msg.get('network') not in self._engines:
+            return {'status': 'error', 'error': 'no network named \''+str(msg.get('network'))+'\''}
+        if not self._running:
+            return {'status': 'error', 'error': 'the server is shutting down'}
+
+        job = ServerJob(msg)
+        self._jobs.put((-job.priority(), next(self._seq), job))
+        return job.wait()
+
+    # MAIN THREAD
+    def runJob(self, job):
+        '''Apply the job's args to its network, run it and collect the
+        outputs.
+        '''
+        st = time.time()
+        msg = job.msg
+
+        # a node that failed to initialize would fail every job, so the
+        # network is loaded again to give it another try
+        engine = self._engines[msg['network']]
+        if any([n.inInitUIErrorState() for n in engine.failedNodes()]):
+            log.warn('runJob(): reloading \''+str(msg['network'])+'\', a node failed to initialize.')
+            self.reloadNetwork(msg['network'])
+            engine = self._engines[msg['network']]
+        reply = {'queued': st - job.submitted}
+        try:
+            args = self.widgetArgs(engine, msg.get('strings', {}), msg.get('widgets', {}))
+        except (AttributeError, ValueError) as e:
+            reply.update({'status': 'error', 'error': str(e), 'walltime': 0})
+            return reply
+
+        try:
+            engine.retryFailed()
+            engine.setWidgetArgs(args)
+            files = self.namedFiles(engine.getAllNodes())
+            retcode = engine.run()
+        except Exception:
+            log.error('runJob(): '+str(traceback.format_exc()))
+            reply.update({'status': 'error', 'error': traceback.format_exc(limit=1),
+                          'walltime': time.time() - st})
+            return reply
+
+        computed = engine.computedNodes()
+        reply['status'] = 'failed' if retcode else 'ok'
+        reply['failed'] = [n.getName() for n in engine.failedNodes()]
+        reply['outputs'] = self.writtenFiles([n for n, sec in computed], files)
+        reply['nodes'] = [(n.getName(), n.getNodeLabel(), sec) for n, sec in computed]
+        reply['walltime'] = time.time() - st
+        log.info('runJob(): '+str(msg['network'])+' '+reply['status']+' in '+str(reply['walltime'])+'s')
+        return reply
+
+    def widgetArgs(self, engine, strings, widgets):
+        # the {(node, widget title): value} set by a job, String args first
+        args = {}
+        for lab, val in strings.items():
+            node = engine.findNodeByNameAndLabel('String', lab)
+            if node is None:
+                raise ValueError('String node label \''+str(lab)+'\' not found')
+            args[(node, 'string')] = val
+        for lab, vals in widgets.items():
+            node = engine.findNodeByLabel(lab)
+            if node is None:
+                raise ValueError('node \''+str(lab)+'\' not found')
+            for title, val in vals.items():
+                if title not in node._nodeIF.getWidgetNames():
+                    raise ValueError('node \''+str(lab)+'\' has no widget \''+str(title)+'\'')
+                args[(node, title)] = val
+        return args
+
+    def namedFiles(self, nodes):
+        # {path: modification time} of the files named by the nodes' widgets
+        files = {}
+        for node in nodes:
+            for title in node._nodeIF.getWidgetNames():
+                val = node._nodeIF.getVal(title)
+                if isinstance(val, str) and os.path.isfile(val):
+                    files[os.path.abspath(val)] = os.path.getmtime(val)
+        return files
+
+    def writtenFiles(self, nodes, before):
+        # the files named by the nodes that ran which are new or modified
+        # since the job started (e.g. by a Writer node)
+        paths = []
+        for path, mtime in self.namedFiles(nodes).items():
+            if before.get(path) != mtime:
+                paths.append(path)
+        return paths
@@ -0,0 +1,185 @@
+#    Copyright (C) 2014  Dignity Health
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL PURPOSES
+#    AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+#    SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+#    PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+#    USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT
+#    LIMITED TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR
+#    MAKES NO WARRANTY AND HAS NO LIABILITY ARISING FROM ANY USE OF THE
+#    SOFTWARE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+
+
+'''Chunked outport data (NodeAPI.emitChunk()).
+
+A node can hand out the pieces of a result (e.g. the slices of a volume) as
+they are made, so that downstream nodes that accept chunks can start on them
+(in computeChunk()) before the producer has finished.  Each consuming node is
+fed on its own thread through a buffer.  A producer computing on a thread
+waits in emitChunk() while a buffer holds more than CHUNK_BUFFER bytes, until
+the consumer catches up.
+
+The chunks of a forked producer arrive on the main thread, which mustn't
+wait, so the producer is held back instead: its ResultChannel only lets
+CHUNK_BUFFER bytes of chunks through until the consumers have taken them
+(see ResultChannel.credit()).  Once the producer is done the chunks are
+assembled, in index order, into the port's data for every other consumer.
+'''
+
+import collections
+import threading
+import traceback
+import numpy as np
+
+from .logger import manager
+
+# start logger for this module
+log = manager.getLogger(__name__)
+
+# data waiting for each consumer before a producer is held back
+CHUNK_BUFFER = 64 * 1024**2  # bytes
+
+# marks the end of a stream
+_END = '_GPI_STREAM_END_'
+
+
+def chunkBytes(chunk):
+    # the size a chunk counts for in the buffers
+    nbytes = getattr(chunk, 'nbytes', 0)
+    if isinstance(nbytes, int):
+        return nbytes
+    return 0
+
+
+class ChunkTicket(object):
+    '''Calls done() once every consumer has taken its copy of a chunk.'''
+
+    def __init__(self, count, done=None):
+        self._count = count
+        self._done = done
+        self._lock = threading.Lock()
+        if count == 0:
+            self._finish()
+
+    def release(self):
+        with self._lock:
+            self._count -= 1
+            if self._count != 0:
+                return
+        self._finish()
+
+    def _finish(self):
+        if self._done is not None:
+            self._done()
+
+
+class ChunkConsumer(object):
+    '''Feeds the chunks of one stream to one node's computeChunk() on a
+    thread.'''
+
+    def __init__(self, node, title):
+        self._node = node
+        self._title = title  # the inport the stream arrives on
+        self._buffer = collections.deque()  # (chunk, index, nbytes, ticket)
+        self._nbytes = 0  # held in the buffer
+        self._cond = threading.Condition()
+        self._failed = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run,
+                name='GPIChunks-'+str(node.getName()))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, chunk, index, ticket, wait=True):
+        # if wait is set, blocks while the buffer is full
+        nbytes = chunkBytes(chunk)
+        with self._cond:
+            while wait and self._nbytes and (self._nbytes + nbytes > CHUNK_BUFFER):
+                self._cond.wait()
+            if self._closed:
+                ticket.release()
+                return
+            self._buffer.append((chunk, index, nbytes, ticket))
+            self._nbytes += nbytes
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._buffer.append(_END)
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _next(self):
+        with self._cond:
+            while not len(self._buffer):
+                self._cond.wait()
+            item = self._buffer.popleft()
+            if item is not _END:
+                self._nbytes -= item[2]
+            self._cond.notify_all()
+            return item
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is _END:
+                break
+            if not self._failed:  # otherwise skipped, to keep the producer moving
+                try:
+                    self._node._nodeIF.computeChunk(self._title, item[0], item[1])
+                except:
+                    log.error('\''+str(self._node.getName())+'\' computeChunk() failed, the remaining chunks are skipped.\n'+str(traceback.format_exc()))
+                    self._failed = True
+            item[3].release()
+
+
+class ChunkStream(object):
+    '''The chunks emitted on one outport during a compute.'''
+
+    def __init__(self, port):
+        self._chunks = {}  # index: chunk
+        self._consumers = []
+        for node, title in port.getDownstreamNodes():
+            if node._nodeIF.acceptsChunks():
+                self._consumers.append(ChunkConsumer(node, title))
+
+    def put(self, chunk, index=None, wait=True, done=None):
+        '''Hand a chunk to the consumers, done() is called once all of them
+        have taken it.
+        '''
+        if index is None:
+            index = len(self._chunks)
+        self._chunks[index] = chunk
+        ticket = ChunkTicket(len(self._consumers), done)
+        for consumer in self._consumers:
+            consumer.put(chunk, index, ticket, wait)
+
+    def close(self):
+        '''Wait for the consumers to finish the chunks they've been given.'''
+        for consumer in self._consumers:
+            consumer.close()
+        self._consumers = []
+
+    def assemble(self):
+        '''The chunks in index order, stacked into one array if they are
+        arrays of the same shape and type, otherwise as a list.
+        '''
+        chunks = [self._chunks[i] for i in sorted(self._chunks)]
+        if len(chunks) and all([type(c) is np.ndarray for c in chunks]):
+            if len(set([(c.shape, c.dtype) for c in chunks])) == 1:
+                return np.stack(chunks)
+        return chunks
@@ -28,7 +28,9 @@ in networks, etc... '''
 
 
 import psutil
+import weakref
 import platform
+import threading
 # import resource
 
 # gpi
@@ -48,6 +50,11 @@ class SysSpecs(object):
         self._inLinux = (platform.system() == 'Linux')
         self._inWindows = (platform.system() == 'Windows')
 
+        # in-process computes whose peak rss is being measured
+        self._peakLock = threading.Lock()
+        self._peakGen = 0  # counts the measurements started
+        self._peakOwners = weakref.WeakKeyDictionary()  # owner: (gen, rss)
+
         self._plat = {}
 
         # platform
@@ -131,9 +138,67 @@ class SysSpecs(object):
     def TOTAL_PHYMEM(self):
         return self._plat['TOTAL_PHYMEM']
 
+    # memory use of the calling process (e.g. a forked node)
+    def RSS(self):
+        return psutil.Process().memory_info().rss
+
+    def peakRSS(self):
+        if self._inLinux:
+            # VmHWM, unlike ru_maxrss, can be reset by resetPeakRSS()
+            try:
+                with open('/proc/self/status') as f:
+                    for line in f:
+                        if line.startswith('VmHWM:'):
+                            return int(line.split()[1]) * 1024  # kB
+            except (IOError, OSError, ValueError):
+                pass
+        if self._inWindows:
+            return psutil.Process().memory_info().peak_wset
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if self._inOSX:
+            return peak  # bytes
+        return peak * 1024  # kB
+
+    def resetPeakRSS(self):
+        # only Linux allows the peak to be reset, elsewhere it's the peak for
+        # the life of the process.
+        if self._inLinux:
+            try:
+                with open('/proc/self/clear_refs', 'w') as f:
+                    f.write('5')
+            except (IOError, OSError):
+                pass
+
+    def startPeakRSS(self, owner):
+        '''Start measuring the peak rss of a compute that runs in this
+        process.  The peak is process-wide, so it's only reset when no other
+        compute is being measured.
+        '''
+        with self._peakLock:
+            self._peakGen += 1
+            rss = None
+            if len(self._peakOwners) == 0:
+                self.resetPeakRSS()
+                rss = self.RSS()
+            self._peakOwners[owner] = (self._peakGen, rss)
+
+    def endPeakRSS(self, owner):
+        '''The peak rss (bytes) reached since startPeakRSS(), or None if
+        another compute ran in this process in the meantime.
+        '''
+        with self._peakLock:
+            gen, rss = self._peakOwners.pop(owner, (None, None))
+            if (rss is None) or (gen != self._peakGen):
+                return None
+        return max(0, self.peakRSS() - rss)
+
     def NUM_CPUS(self):
         return self._plat['NUM_CPUS']
 
+    def pidExists(self, pid):
+        return psutil.pid_exists(pid)
+
     def table(self):
         return self._plat
 
@@ -117,29 +117,202 @@ def topsort(connection_list):
     return topological_sort(l,c)
 
 
+class DynamicTopologicalOrder(object):
+    """NRZ:
+       A topological order that is updated as connections are added and
+       removed, instead of being re-sorted.  This is the Pearce-Kelly
+       algorithm: only the nodes between the two ends of a new out-of-order
+       arc are visited and re-ranked.
+
+       Items are only ordered while they have arcs, island items have no
+       index().  Parallel arcs are counted so that each must be removed.
+    """
+
+    def __init__(self):
+        self._index = {}  # item: rank
+        self._succ = {}  # item: {successor: arc count}
+        self._pred = {}  # item: {predecessor: arc count}
+        self._next = 0  # next free rank
+
+    def __contains__(self, item):
+        return item in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def index(self, item):
+        """The item's rank, or -1 if it has no arcs."""
+        return self._index.get(item, -1)
+
+    def order(self):
+        return sorted(self._index, key=self._index.get)
+
+    def successors(self, item):
+        return list(self._succ.get(item, {}))
+
+    def predecessors(self, item):
+        return list(self._pred.get(item, {}))
+
+    def _add(self, item):
+        if item not in self._index:
+            self._index[item] = self._next
+            self._next += 1
+            self._succ[item] = {}
+            self._pred[item] = {}
+
+    def _discard(self, item):
+        if (item in self._index) and not (self._succ[item] or self._pred[item]):
+            del self._index[item]
+            del self._succ[item]
+            del self._pred[item]
+
+    def _reach(self, start, adj, inBounds):
+        # depth first search limited to the affected region
+        seen = set([start])
+        stack = [start]
+        while stack:
+            for n in adj[stack.pop()]:
+                if (n not in seen) and inBounds(self._index[n]):
+                    seen.add(n)
+                    stack.append(n)
+        return seen
+
+    def addArc(self, a, b):
+        """Add the arc a -> b.  Returns a list of the items whose index()
+        changed (including new items), or None if the arc would make a loop,
+        in which case nothing is changed.
+        """
+        if a is b:
+            return None
+
+        changed = set([i for i in (a, b) if i not in self._index])
+        self._add(a)
+        self._add(b)
+
+        lb = self._index[b]
+        ub = self._index[a]
+        if lb < ub:
+            # forward: everything reachable from b that ranks before a
+            fwd = self._reach(b, self._succ, lambda i: i <= ub)
+            if a in fwd:
+                for i in changed:
+                    self._discard(i)
+                return None
+            # backward: everything reaching a that ranks after b
+            bwd = self._reach(a, self._pred, lambda i: i >= lb)
+
+            # the backward set takes the lowest of the freed ranks
+            bwd = sorted(bwd, key=self._index.get)
+            fwd = sorted(fwd, key=self._index.get)
+            ranks = sorted([self._index[i] for i in bwd + fwd])
+            for item, rank in zip(bwd + fwd, ranks):
+                if self._index[item] != rank:
+                    self._index[item] = rank
+                    changed.add(item)
+
+        self._succ[a][b] = self._succ[a].get(b, 0) + 1
+        self._pred[b][a] = self._pred[b].get(a, 0) + 1
+        return list(changed)
+
+    def removeArc(self, a, b):
+        """Remove one a -> b arc.  Returns the items that became islands."""
+        if (a not in self._succ) or (b not in self._succ[a]):
+            return []
+        self._succ[a][b] -= 1
+        self._pred[b][a] -= 1
+        if self._succ[a][b] == 0:
+            del self._succ[a][b]
+            del self._pred[b][a]
+        islands = []
+        for i in (a, b):
+            self._discard(i)
+            if i not in self._index:
+                islands.append(i)
+        return islands
+
+    def removeItem(self, item):
+        """Remove an item and all its arcs.  Returns the other items that
+        became islands.
+        """
+        if item not in self._index:
+            return []
+        for n in self._succ[item]:
+            del self._pred[n][item]
+        for n in self._pred[item]:
+            del self._succ[n][item]
+        # only the former neighbours can have lost their last arc
+        neighbours = set(self._succ[item]) | set(self._pred[item])
+        self._succ[item] = {}
+        self._pred[item] = {}
+        self._discard(item)
+        islands = []
+        for n in neighbours:
+            self._discard(n)
+            if n not in self._index:
+                islands.append(n)
+        return islands
+
+    def reset(self, partial_order):
+        """Rebuild from a list of pairs.  Arcs that would make a loop are
+        skipped and returned.
+        """
+        self.__init__()
+        arcs = list(partial_order)
+        skipped = []
+        order = topological_sort(set([i for i,j in arcs] + [j for i,j in arcs]), set(arcs))
+        if order is not None:
+            for item in order:
+                self._add(item)
+        for a, b in arcs:
+            if self.addArc(a, b) is None:
+                skipped.append((a, b))
+        return skipped
+
+
 if __name__ == '__main__':
 
     print("test topsort")
-    print((topological_sort([1,2,3], [(1,2),(1,3),(3,2)]))) # --> [1,3,2]
-    print((topological_sort([1,2], [(2,1),(2,1)]))) # --> [2,1]
-    print((topological_sort([1,2], [(1,2),(2,1)]))) # --> None
-    print((topological_sort([0,1,2], [(0,1),(1,2),(2,1)]))) # --> None
-
+    assert topological_sort([1,2,3], [(1,2),(1,3),(3,2)]) == [1,3,2]
+    assert topological_sort([1,2], [(2,1),(2,1)]) == [2,1]  # duplicate edge
+    assert topological_sort([1,2], [(1,2),(2,1)]) is None  # cycle
+    assert topological_sort([0,1,2], [(0,1),(1,2),(2,1)]) is None  # cycle
 
     # hashable type
     x = type
     y = int
     z = float
-    print((topological_sort([x,y,z], [(x,y),(x,z),(z,y)]))) # --> [1,3,2]
-
-    print((topsort( [(x,y),(x,z),(z,y)] )))
+    assert topological_sort([x,y,z], [(x,y),(x,z),(z,y)]) == [x,z,y]
+    assert topsort( [(x,y),(x,z),(z,y)] ) == [x,z,y]
 
     print("cyclic and acylic graphs")
-    print((topsort( [(1,2),(1,3),(3,2),(5,6),(5,7),(7,6),(7,5)] )))
+    assert topsort( [(1,2),(1,3),(3,2),(5,6),(5,7),(7,6),(7,5)] ) is None
 
     print("multiple graphs")
-    print((topsort( [(1,2),(1,3),(3,2),(5,6),(5,7),(7,6)] )))
-
+    order = topsort( [(1,2),(1,3),(3,2),(5,6),(5,7),(7,6)] )
+    assert order.index(1) < order.index(3) < order.index(2)
+    assert order.index(5) < order.index(7) < order.index(6)
 
+    print("dynamic order")
+    d = DynamicTopologicalOrder()
+    # addArc() returns the items whose rank changed, in no particular order
+    assert sorted(d.addArc(3,2)) == [2,3]
+    assert sorted(d.addArc(1,3)) == [1,2,3]
+    assert d.order() == [1,3,2]
+    assert d.addArc(2,1) is None  # cycle, the order is kept
+    assert d.order() == [1,3,2]
 
+    # a duplicate arc is counted, the order holds until both are removed
+    assert d.addArc(1,3) == []
+    assert d.removeArc(1,3) == []
+    assert d.order() == [1,3,2]
+    assert d.removeArc(1,3) == [1]
+    assert d.order() == [3,2]
 
+    # removing an item only leaves its own neighbours as islands
+    d.addArc(4,3)
+    d.addArc(3,5)
+    d.addArc(6,7)
+    assert sorted(d.removeItem(3)) == [2,4,5]
+    assert d.order() == [6,7]
+    assert d.removeItem(3) == []
+    print("ok")
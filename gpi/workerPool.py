@@ -0,0 +1,829 @@
+#    Copyright (C) 2014  Dignity Health
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#    NO CLINICAL USE.  THE SOFTWARE IS NOT INTENDED FOR COMMERCIAL PURPOSES
+#    AND SHOULD BE USED ONLY FOR NON-COMMERCIAL RESEARCH PURPOSES.  THE
+#    SOFTWARE MAY NOT IN ANY EVENT BE USED FOR ANY CLINICAL OR DIAGNOSTIC
+#    PURPOSES.  YOU ACKNOWLEDGE AND AGREE THAT THE SOFTWARE IS NOT INTENDED FOR
+#    USE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITY, INCLUDING BUT NOT
+#    LIMITED TO LIFE SUPPORT OR EMERGENCY MEDICAL OPERATIONS OR USES.  LICENSOR
+#    MAKES NO WARRANTY AND HAS NO LIABILITY ARISING FROM ANY USE OF THE
+#    SOFTWARE IN ANY HIGH RISK OR STRICT LIABILITY ACTIVITIES.
+
+'''A pool of long-lived GPI_PROCESS workers.
+
+Each process node gets its own worker, forked the first time the node
+computes.  The worker stays alive between computes so that the fork and any
+modules imported inside compute() are only paid for once.  Before each
+compute the node state that changed since the worker last saw it (input
+data, buffered widget settings, events and other node attributes) is sent
+down the worker's pipe, and the results come back the same way.  If the change is too large to be worth
+sending, or the node's connections have changed, the worker is replaced by a
+fresh fork.
+
+State is compared by identity and, for objects of up to WORKER_DIGEST_LIMIT
+bytes, by a digest of their content, so small changes made in place are seen
+as well.  Read-only arrays (e.g. the outputs of other process nodes) can't
+be changed in place and are only compared by identity, as are objects that
+can't be pickled (e.g. the node's widgets), which can't be sent either.
+Larger writable objects are too costly to hash on every compute, so they are
+taken to have changed and the worker is replaced by a fresh fork, which
+shares them without a copy.  The worker checks its own copy the same way
+after each compute, anything the compute changed in place is sent again
+before the next one.
+
+The members of a fused macro share one GroupWorker instead.  Data passed
+between members stays in that worker, only the data that leaves the macro is
+sent back to the canvas.
+'''
+
+import atexit
+import pickle
+import hashlib
+import weakref
+import platform
+import traceback
+import time
+import collections
+import multiprocessing
+import multiprocessing.util  # register its exit handler before the pool's
+import numpy as np
+
+from .channel import ResultChannel, sendFramed, recvFramed
+from .dataproxy import Segments
+from .defines import GPI_PROCESS
+from .logger import manager
+from .memo import Memo
+from .sysspecs import Specs
+
+# start logger for this module
+log = manager.getLogger(__name__)
+
+# Python 3.8 - need to explicitly declare fork for MacOS
+if platform.system() == 'Windows':
+    multiprocessing_context = multiprocessing.get_context('spawn')
+else:
+    multiprocessing_context = multiprocessing.get_context('fork')
+
+# changed state larger than this is handed to a new fork instead of a pipe
+WORKER_RESYNC_LIMIT = 32*1024**2  # bytes
+
+# writable objects larger than this aren't hashed, they're taken as changed
+WORKER_DIGEST_LIMIT = 8*1024**2  # bytes
+
+# time allowed for an idle worker to answer a health check
+WORKER_PING_TIMEOUT = 1.0  # sec
+
+# marks a node attribute that no longer exists in the parent
+_DROPPED = '_GPI_WORKER_DROPPED_'
+
+# node attributes that are reset for every compute
+_RESET = ('shdmDict',)
+
+# the digest of an object too large to hash
+_UNHASHED = '_GPI_WORKER_UNHASHED_'
+
+
+def _ref(obj):
+    # Remember an object's identity without keeping large arrays alive.
+    try:
+        return weakref.ref(obj)
+    except TypeError:
+        return lambda: obj
+
+def _readonly(data):
+    # an array that can't be written through, nor through the arrays it views
+    while isinstance(data, np.ndarray):
+        if data.flags.writeable:
+            return False
+        data = data.base
+    return True
+
+def _digest(obj):
+    # The (digest, bytes) of an object.  The digest is None if it can only be
+    # compared by identity and _UNHASHED if it's too large to hash.
+    if isinstance(obj, np.ndarray):
+        if _readonly(obj):
+            return None, obj.nbytes
+        if obj.nbytes > WORKER_DIGEST_LIMIT:
+            return _UNHASHED, obj.nbytes
+        return Memo.fingerprint(obj), obj.nbytes
+
+    # the buffers of arrays held by other objects are counted before hashing
+    buffers = []
+    try:
+        meta = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL, buffer_callback=buffers.append)
+        views = [b.raw() for b in buffers]
+    except Exception:
+        return None, 0
+    nbytes = sum([v.nbytes for v in views])
+    if nbytes > WORKER_DIGEST_LIMIT:
+        return _UNHASHED, nbytes
+    h = hashlib.blake2b(meta, digest_size=16)
+    for v in views:
+        h.update(v)
+    return h.digest(), nbytes
+
+def _track(obj):
+    # a token for the state the child has seen: (ref, digest, bytes)
+    return (_ref(obj),) + _digest(obj)
+
+def _retrack(seen, obj):
+    # Returns None if the object is the one that was seen and its content
+    # hasn't changed, otherwise a new token for it.
+    if (seen is not None) and (seen[0]() is obj):
+        if seen[1] is None:
+            return None
+        tok = (seen[0],) + _digest(obj)
+        if (tok[1] == seen[1]) and (tok[1] is not _UNHASHED):
+            return None
+        return tok
+    return _track(obj)
+
+# the arrays that stand in for data kept by a GroupWorker
+_placeholders = weakref.WeakValueDictionary()
+
+def placeholder(shape, dtype):
+    '''An array with the shape and dtype of one that was kept by a
+    GroupWorker.  The zeroed pages are mapped lazily, so the (read-only)
+    placeholder takes next to no memory.
+    '''
+    data = np.zeros(shape, dtype=np.dtype(dtype))
+    data.flags.writeable = False
+    _placeholders[id(data)] = data
+    return data
+
+def isPlaceholder(data):
+    return (data is not None) and (_placeholders.get(id(data)) is data)
+
+
+class GPIWorker(object):
+    '''A forked copy of a node that waits for compute requests.
+
+    The parent keeps a reference and a digest of each piece of state the
+    child has seen, so that only the changes are sent with the next request.
+    '''
+
+    def __init__(self, node):
+        self._node = node
+        self._topology = self.signature()
+        self._busy = False
+
+        self._conn, self._childConn = multiprocessing_context.Pipe()
+        self._proc = multiprocessing_context.Process(target=self._serve,
+                name='GPIWorker-'+str(node.getName()))
+        self._cancel = multiprocessing_context.Event()
+
+        # the state the child was forked with
+        self._inputs = {}
+        self._attrs = {}
+        self.commit(dict(self.portData(node)), node._nodeIF.__dict__, [])
+
+    def __str__(self):
+        return 'GPIWorker('+str(self._node.getName())+', pid: '+str(self._proc.pid)+')'
+
+    @staticmethod
+    def topology(node):
+        # The child's copy of the graph is only valid for the same node
+        # interface and the same upstream connections.
+        sig = [id(node._nodeIF), len(node.outportList)]
+        for port in node.inportList:
+            sig.append(tuple([(e.sourcePort().getNodeID(), e.sourcePort().portTitle) for e in port.edges()]))
+        return tuple(sig)
+
+    def signature(self):
+        return self.topology(self._node)
+
+    def select(self, node):
+        # a node's own worker only computes that node
+        pass
+
+    def serves(self, node):
+        return node is self._node
+
+    @staticmethod
+    def portData(node):
+        for i, port in enumerate(node.inportList):
+            yield ('in', i), port.getUpstreamData()
+        for i, port in enumerate(node.outportList):
+            yield ('out', i), port.data
+
+    def start(self):
+        self._proc.start()
+        # only the child should hold its end, so a crash reads as EOF
+        self._childConn.close()
+
+    def isAlive(self):
+        return self._proc.is_alive()
+
+    def sentinel(self):
+        # readable once the worker process has exited
+        return self._proc.sentinel
+
+    def isBusy(self):
+        return self._busy
+
+    def isHealthy(self):
+        '''Check that the idle worker is alive, answering and still matches the
+        node's connections.
+        '''
+        if self._busy or not self.isAlive():
+            return False
+        if self.signature() != self._topology:
+            return False
+        try:
+            sendFramed(self._conn, ('ping',))
+            if self._conn.poll(WORKER_PING_TIMEOUT):
+                return recvFramed(self._conn) == ('pong',)
+        except (EOFError, OSError):
+            pass
+        return False
+
+    def changes(self):
+        '''Collect the node state that has changed since the child last saw it,
+        with the tokens to commit() once it's sent.
+        '''
+        nbytes = 0
+        tokens = {}
+        inputs = {}
+        for key, data in self.portData(self._node):
+            tok = _retrack(self._inputs.get(key), data)
+            if tok is not None:
+                inputs[key] = data
+                tokens[key] = tok
+                nbytes += tok[2]
+
+        attrs = {}
+        cur = self._node._nodeIF.__dict__
+        for k, v in cur.items():
+            tok = _retrack(self._attrs.get(k), v)
+            if tok is not None:
+                attrs[k] = v
+                tokens[('attr', k)] = tok
+                nbytes += tok[2]
+        dropped = [k for k in self._attrs if k not in cur]
+
+        return inputs, attrs, dropped, nbytes, tokens
+
+    def commit(self, inputs, attrs, dropped, tokens=None):
+        tokens = tokens or {}
+        for k, v in inputs.items():
+            self._inputs[k] = tokens.get(k) or _track(v)
+        for k, v in attrs.items():
+            self._attrs[k] = tokens.get(('attr', k)) or _track(v)
+        for k in dropped:
+            del self._attrs[k]
+
+    def forget(self, nid, keys):
+        # the child changed this state in place, it's sent again next time
+        for key in keys:
+            if key[0] == 'attr':
+                self._attrs.pop(key[1], None)
+            else:
+                self._inputs.pop(key, None)
+
+    def dispatch(self, channel):
+        '''Send the changed node state and start a compute, the results are
+        returned on the given channel.  Returns False if the change can't (or
+        shouldn't) go through the pipe.
+        '''
+        inputs, attrs, dropped, nbytes, tokens = self.changes()
+        if nbytes > WORKER_RESYNC_LIMIT:
+            log.debug('dispatch(): '+str(nbytes)+' bytes changed, refork '+str(self))
+            return False
+
+        node = self._node
+        msg = ('compute', inputs, attrs, dropped, node._event_type, node._events_handoff)
+        if not self.send(msg, channel):
+            return False
+
+        self.commit(inputs, attrs, dropped, tokens)
+        return True
+
+    def send(self, msg, channel):
+        self._cancel.clear()
+        try:
+            # the message is fully pickled before anything is written
+            sendFramed(self._conn, msg)
+        except Exception:
+            log.debug('dispatch(): state could not be sent, refork '+str(self)+'\n'+str(traceback.format_exc()))
+            return False
+
+        channel.connect(self._conn)
+        self._busy = True
+        return True
+
+    def poll(self, channel):
+        '''Collect the results that have arrived on the channel.  Returns
+        'done' when the compute has finished, 'dead' if the worker died and
+        None while it's still running.
+        '''
+        other = channel.drain()
+        for msg in other:
+            if msg[0] == 'stale':
+                self.forget(msg[1], msg[2])
+        if ('done',) in other:
+            self._busy = False
+            return 'done'
+        if channel.isClosed() or not self.isAlive():
+            return 'dead'
+
+    def cancel(self):
+        # seen by NodeAPI.isCancelled() in the running compute
+        self._cancel.set()
+
+    def shutdown(self):
+        try:
+            sendFramed(self._conn, ('quit',))
+        except (EOFError, OSError):
+            pass
+        self._proc.join(WORKER_PING_TIMEOUT)
+        self.kill()
+
+    def kill(self):
+        if self.isAlive():
+            self._proc.terminate()
+            self._proc.join()
+        self._conn.close()
+
+    # CHILD PROCESS
+    def _serve(self):
+        node = self._node
+        conn = self._childConn
+
+        # attributes are reset to the forked state plus the parent's changes
+        # before each compute, just as a fresh fork would see them.
+        base = dict(node._nodeIF.__dict__)
+        overrides = {}
+        seen = {}
+
+        # results are sent back as they are queued
+        channel = ResultChannel(pipe=False)
+        channel.connect(conn)
+
+        while True:
+            try:
+                msg = recvFramed(conn)
+            except EOFError:
+                break  # parent is gone
+
+            if msg[0] == 'ping':
+                sendFramed(conn, ('pong',))
+                continue
+            if msg[0] == 'quit':
+                break
+            if msg[0] == 'credit':
+                channel.takeCredit(msg)  # for chunks of the last compute
+                continue
+
+            _, inputs, attrs, dropped, event, events = msg
+            self._restore(node, base, overrides, inputs, attrs, dropped)
+
+            node._event_type = event
+            node._events_handoff = events
+            node.nodeCompute_thread._proc._proxy = channel
+            node.nodeCompute_thread._cancel = self._cancel
+            self._checkedCompute(node, channel, seen, conn)
+
+            sendFramed(conn, ('done',))
+
+    def _restore(self, node, base, overrides, inputs, attrs, dropped):
+        nodeIF = node._nodeIF
+        for (kind, i), data in inputs.items():
+            if kind == 'in':
+                port = node.inportList[i]
+                if len(port.edgeList) > 0:
+                    port.edgeList[0].sourcePort()._data = data
+            else:
+                node.outportList[i]._data = data
+
+        overrides.update(attrs)
+        for k in dropped:
+            overrides[k] = _DROPPED
+        nodeIF.__dict__.clear()
+        nodeIF.__dict__.update(base)
+        for k, v in overrides.items():
+            if v is _DROPPED:
+                nodeIF.__dict__.pop(k, None)
+            else:
+                nodeIF.__dict__[k] = v
+        nodeIF.shdmDict = {}
+
+    def _state(self, node):
+        # the objects a compute could change in place
+        for key, data in self.portData(node):
+            yield key, data
+        for k, v in node._nodeIF.__dict__.items():
+            if k not in _RESET:
+                yield ('attr', k), v
+
+    def _checkedCompute(self, node, channel, seen, conn):
+        # Compute and tell the parent what the compute changed in place, so
+        # that the next compute doesn't start from the changed copies.
+        for key, obj in self._state(node):
+            tok = _retrack(seen.get(key), obj)
+            if tok is not None:
+                seen[key] = tok
+
+        self._compute(node, channel)
+
+        # (the parent sends the unhashed objects again anyway)
+        changed = []
+        for key, (ref, digest, nbytes) in list(seen.items()):
+            obj = ref()
+            if (obj is None) or (digest is None) or (digest is _UNHASHED):
+                continue
+            if _digest(obj)[0] != digest:
+                changed.append(key)
+                del seen[key]
+        if len(changed):
+            log.debug('PROCESS: \''+str(node.getName())+'\' changed '+str(changed)+' in place')
+            sendFramed(conn, ('stale', node.getID(), changed))
+
+    def _compute(self, node, channel):
+        from .functor import Return
+        Specs.resetPeakRSS()
+        rss = Specs.RSS()
+        cpu = time.thread_time()
+        try:
+            channel.append(['retcode', node.getModuleCompute()()])
+        except:
+            log.error('PROCESS: \''+str(node.getName())+'\':\''+str(node._nodeIF.getLabel())+'\' compute() failed.\n'+str(traceback.format_exc()))
+            channel.append(['retcode', Return.ComputeError])
+        channel.append(['peakRSS', max(0, Specs.peakRSS() - rss)])
+        channel.append(['cpuTime', time.thread_time() - cpu])
+        Segments.releaseUnsent()
+
+
+class FusedTask(object):
+    '''Takes the place of a fused member's GPIFunctor inside its GroupWorker.
+    Array outputs that only feed members computed in this worker are kept
+    here and the parent is sent a placeholder with the same shape and dtype.
+    '''
+
+    def __init__(self, node, members, cancel):
+        self._node = node
+        self._members = members
+        self._cancel = cancel
+        self._proxy = None  # results are dropped while rebuilding
+
+    def execType(self):
+        return GPI_PROCESS
+
+    def isCancelled(self):
+        return self._cancel.is_set()
+
+    def addToQueue(self, item):
+        if self._proxy is not None:
+            self._proxy.append(item)
+
+    def keepData(self, title, data):
+        # downstream members read the data straight from the port
+        port = self._node.getOutPort(title)
+        port.setData(data)
+
+        if type(data) is not np.memmap and type(data) is not np.ndarray:
+            return False
+        for edge in port.edges():
+            if not self.computesHere(edge.destPort().getNodeID()):
+                return False
+        self.addToQueue(['keptData', title, data.shape, data.dtype.str])
+        return True
+
+    def computesHere(self, nid):
+        # only the GPI_PROCESS members are computed by the worker, the
+        # others (THREAD, APPLOOP or AUTO) compute in the parent
+        node = self._members.get(nid)
+        return (node is not None) and (node._nodeIF.execType() == GPI_PROCESS)
+
+
+class GroupWorker(GPIWorker):
+    '''A forked copy of a fused macro that computes each of its member nodes.
+
+    The outputs a member computes here are held by the child.  A member whose
+    outputs the child doesn't hold (e.g. after a refork) is computed again in
+    the child, without sending any results, before the members downstream of
+    it.
+    '''
+
+    def __init__(self, macro):
+        self._macro = macro
+        self._members = dict([(n.getID(), n) for n in macro.getEncapsulatedNodes()])
+        self._node = None
+        self._topology = self.signature()
+        self._busy = False
+
+        self._conn, self._childConn = multiprocessing_context.Pipe()
+        self._proc = multiprocessing_context.Process(target=self._serve,
+                name='GroupWorker-'+str(macro.getID()))
+        self._cancel = multiprocessing_context.Event()
+
+        # the state the child was forked with, for each member
+        self._seen = {}
+        self._held = set()
+        for nid, node in self._members.items():
+            self._seen[nid] = ({}, {})
+            self.select(node)
+            self.commit(dict(self.portData(node)), node._nodeIF.__dict__, [])
+            if not any([isPlaceholder(port.data) for port in node.outportList]):
+                self._held.add(nid)
+
+    def __str__(self):
+        return 'GroupWorker('+str(len(self._members))+' nodes, pid: '+str(self._proc.pid)+')'
+
+    def signature(self):
+        # the members and each of their connections
+        sig = [(nid, self.topology(n)) for nid, n in self._members.items()]
+        sig.append(tuple(sorted([n.getID() for n in self._macro.getEncapsulatedNodes()])))
+        return tuple(sig)
+
+    def select(self, node):
+        self._node = node
+        self._inputs, self._attrs = self._seen[node.getID()]
+
+    def forget(self, nid, keys):
+        node = self._node
+        self.select(self._members[nid])
+        GPIWorker.forget(self, nid, keys)
+        self.select(node)
+
+    def serves(self, node):
+        return node.getID() in self._members
+
+    def portData(self, node):
+        # the inputs from other members are already in the child
+        for i, port in enumerate(node.inportList):
+            src = port.getUpstreamPort()
+            if (src is None) or (src.getNodeID() not in self._members):
+                yield ('in', i), port.getUpstreamData()
+
+    def stale(self, node):
+        '''The members upstream of the node whose outputs the child doesn't
+        hold, in the order they have to be computed.
+        '''
+        order = []
+
+        def visit(n):
+            for port in n.inportList:
+                src = port.getUpstreamPort()
+                if src is None:
+                    continue
+                up = self._members.get(src.getNodeID())
+                if (up is not None) and (up.getID() not in self._held) and (up not in order):
+                    visit(up)
+                    order.append(up)
+        visit(node)
+        return order
+
+    def dispatch(self, channel):
+        node = self._node
+        steps = []
+        nbytes = 0
+        for member in self.stale(node) + [node]:
+            self.select(member)
+            inputs, attrs, dropped, n, tokens = self.changes()
+            steps.append((member, inputs, attrs, dropped, tokens))
+            nbytes += n
+        self.select(node)
+
+        if nbytes > WORKER_RESYNC_LIMIT:
+            log.debug('dispatch(): '+str(nbytes)+' bytes changed, refork '+str(self))
+            return False
+        if len(steps) > 1:
+            log.info('dispatch(): rebuilding '+str(len(steps)-1)+' upstream node(s) in '+str(self))
+
+        msg = ('compute', [(m.getID(), i, a, d) for m, i, a, d, t in steps],
+                node._event_type, node._events_handoff)
+        if not self.send(msg, channel):
+            return False
+
+        for member, inputs, attrs, dropped, tokens in steps:
+            self.select(member)
+            self.commit(inputs, attrs, dropped, tokens)
+            self._held.add(member.getID())
+        self.select(node)
+        return True
+
+    # CHILD PROCESS
+    def _serve(self):
+        conn = self._childConn
+        base = {}
+        overrides = {}
+        seen = {}
+        tasks = {}
+        for nid, node in self._members.items():
+            base[nid] = dict(node._nodeIF.__dict__)
+            overrides[nid] = {}
+            seen[nid] = {}
+            tasks[nid] = FusedTask(node, self._members, self._cancel)
+            node.nodeCompute_thread = tasks[nid]
+
+        channel = ResultChannel(pipe=False)
+        channel.connect(conn)
+
+        while True:
+            try:
+                msg = recvFramed(conn)
+            except EOFError:
+                break  # parent is gone
+
+            if msg[0] == 'ping':
+                sendFramed(conn, ('pong',))
+                continue
+            if msg[0] == 'quit':
+                break
+            if msg[0] == 'credit':
+                channel.takeCredit(msg)  # for chunks of the last compute
+                continue
+
+            _, steps, event, events = msg
+            for nid, inputs, attrs, dropped in steps:
+                node = self._members[nid]
+                self._restore(node, base[nid], overrides[nid], inputs, attrs, dropped)
+
+            # rebuild the stale members quietly, then compute the requested one
+            for nid, inputs, attrs, dropped in steps[:-1]:
+                self._checkedCompute(self._members[nid], [], seen[nid], conn)
+
+            nid = steps[-1][0]
+            node = self._members[nid]
+            node._event_type = event
+            node._events_handoff = events
+            tasks[nid]._proxy = channel
+            self._checkedCompute(node, channel, seen[nid], conn)
+            tasks[nid]._proxy = None
+
+            sendFramed(conn, ('done',))
+
+
+class WorkerPool(object):
+    '''Holds one warm GPIWorker per process node (or GroupWorker per fused
+    macro), up to a maximum number of workers.  The least recently used idle workers are shut down first.
+    '''
+
+    def __init__(self):
+        self._workers = collections.OrderedDict()  # node id: GPIWorker
+        self._size = None
+        atexit.register(self.shutdown)
+
+    def size(self):
+        if self._size is None:
+            from .config import Config
+            self._size = Config.PROCESS_POOL_SIZE
+        return self._size
+
+    def setSize(self, val):
+        self._size = max(0, int(val))
+        self.trim()
+
+    def enabled(self):
+        return self.size() > 0
+
+    def dispatch(self, node, channel, macro=None):
+        '''Start a compute for the given node on a warm worker, forking a new
+        one if needed.  The members of a fused macro share the macro's worker.
+        The results are returned on the given channel.
+        '''
+        if macro is None:
+            key = node.getID()
+        else:
+            key = ('macro', macro.getID())
+        worker = self._workers.pop(key, None)
+        if worker is not None:
+            worker.select(node)
+            if not (worker.isHealthy() and worker.dispatch(channel)):
+                worker.kill()
+                worker = None
+
+        if worker is None:
+            if macro is None:
+                worker = GPIWorker(node)
+            else:
+                worker = GroupWorker(macro)
+                worker.select(node)
+            worker.start()
+            log.debug('dispatch(): started '+str(worker))
+            if not worker.dispatch(channel):
+                worker.kill()
+                raise RuntimeError('the node state could not be sent to a new worker')
+
+        self._workers[key] = worker  # most recently used
+        self.trim()
+        return worker
+
+    def release(self, node):
+        '''Kill the worker that computes the node (e.g. when the node is
+        terminated or deleted).
+        '''
+        for key in [k for k, w in self._workers.items() if w.serves(node)]:
+            self._workers.pop(key).kill()
+
+    def trim(self):
+        idle = [k for k, w in self._workers.items() if not w.isBusy()]
+        while (len(self._workers) > self.size()) and idle:
+            self._workers.pop(idle.pop(0)).shutdown()
+
+    def shutdown(self):
+        for worker in self._workers.values():
+            worker.shutdown()
+        self._workers.clear()
+
+Pool = WorkerPool()
+
+
+if __name__ == '__main__':
+    import os
+    import types
+
+    class _NodeIF(object):
+        def __init__(self):
+            self.value = 1
+        def getLabel(self):
+            return ''
+        def compute(self):
+            if self.value < 0:
+                os._exit(1)  # dies mid-compute
+            return 0
+
+    class _Node(object):
+        # the parts of a process node a worker uses
+        def __init__(self):
+            self._nodeIF = _NodeIF()
+            self.inportList = []
+            self.outportList = []
+            self._event_type = None
+            self._events_handoff = None
+            self.nodeCompute_thread = types.SimpleNamespace(_proc=types.SimpleNamespace(_proxy=None))
+        def getID(self): return 1
+        def getName(self): return 'test'
+        def getModuleCompute(self): return self._nodeIF.compute
+
+    def compute(pool, node):
+        # dispatch and wait for the retcode, None if the worker died
+        channel = ResultChannel(pipe=False)
+        worker = pool.dispatch(node, channel)
+        while True:
+            ret = worker.poll(channel)
+            if ret == 'done':
+                return worker, dict([item[:2] for item in channel])['retcode']
+            if ret == 'dead':
+                return worker, None
+            time.sleep(0.01)
+
+    if multiprocessing_context.get_start_method() != 'fork':
+        print("workers are forked, skipped")
+        raise SystemExit(0)
+
+    print("test WorkerPool")
+    pool = WorkerPool()
+    pool.setSize(1)
+    node = _Node()
+
+    print("warm worker")
+    w1, ret = compute(pool, node)
+    assert ret == 0
+    w2, ret = compute(pool, node)
+    assert (w2 is w1) and (ret == 0)
+
+    print("refork a dead worker")
+    w1._proc.terminate()
+    w1._proc.join()
+    w2, ret = compute(pool, node)
+    assert (w2 is not w1) and w2.isAlive() and (ret == 0)
+
+    print("refork for state that can't be sent")
+    node._nodeIF.func = lambda: None
+    w3, ret = compute(pool, node)
+    assert (w3 is not w2) and (not w2.isAlive()) and (ret == 0)
+
+    print("refork for new connections")
+    node._nodeIF = _NodeIF()
+    w4, ret = compute(pool, node)
+    assert (w4 is not w3) and (ret == 0)
+
+    print("refork after a crash")
+    node._nodeIF.value = -1
+    w5, ret = compute(pool, node)
+    assert (w5 is w4) and (ret is None)
+    node._nodeIF.value = 1
+    w6, ret = compute(pool, node)
+    assert (w6 is not w5) and (ret == 0)
+
+    print("pool size")
+    pool.setSize(0)
+    assert not w6.isAlive()
+    pool.shutdown()
+
+    print("ok")